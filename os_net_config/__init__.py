@@ -14,10 +14,16 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import logging
+
 import pbr.version
+import six
 
 
 from os_net_config import objects
+from os_net_config import utils
+
+logger = logging.getLogger(__name__)
 
 __version__ = pbr.version.VersionInfo(
     'os_net_config').version_string()
@@ -27,22 +33,153 @@ class NotImplemented(Exception):
     pass
 
 
+# NOTE: rendered output is keyed by provider and structural hash, so every
+# provider instance in a long running process shares it.
+_render_cache = utils.LRUCache('render', 8192)
+
+
+def seed_render_cache(rendered):
+    """Load (provider, structural hash) -> output pairs saved earlier."""
+    for key, data in six.iteritems(rendered):
+        _render_cache.set(key, data)
+
+
+class NetConfigGraph(object):
+    """Provider neutral dependency graph of the configured objects.
+
+       Nodes are device names. A device depends on the OVS bridge it is a
+       port of, the bond it is a member of and, for VLANs, the underlying
+       device. Devices which are referenced but not configured (a physical
+       NIC used by a VLAN for example) only appear in the edges. Only names
+       are kept, so the objects themselves are freed once rendered.
+    """
+
+    def __init__(self):
+        self.nodes = set()
+        self.dependencies = {}
+        self.dependents = {}
+
+    def _addEdge(self, name, dependency):
+        self.dependencies.setdefault(name, set()).add(dependency)
+        self.dependents.setdefault(dependency, set()).add(name)
+
+    def add(self, obj):
+        self.nodes.add(obj.name)
+        self.dependencies.setdefault(obj.name, set())
+        self.dependents.setdefault(obj.name, set())
+        if obj.bridge_name:
+            self._addEdge(obj.name, obj.bridge_name)
+        if isinstance(obj, objects.Vlan):
+            self._addEdge(obj.name, obj.device)
+        elif isinstance(obj, objects.OvsBond):
+            for member in obj.members:
+                self._addEdge(member.name, obj.name)
+
+    def levels(self, names=None):
+        """Group device names into topological levels.
+
+           Each level only depends on devices in earlier levels, so the
+           devices of one level can be configured in parallel. When names
+           is given only dependencies between those devices are honoured.
+        """
+        if names is None:
+            names = self.nodes
+        pending = set(names)
+        indegree = dict((name, len(self.dependencies.get(name, set()) &
+                                   pending)) for name in pending)
+        level = sorted(name for name in pending if not indegree[name])
+        levels = []
+        while level:
+            levels.append(level)
+            pending.difference_update(level)
+            next_level = set()
+            for name in level:
+                for dependent in self.dependents.get(name, ()):
+                    if dependent in pending:
+                        indegree[dependent] -= 1
+                        if not indegree[dependent]:
+                            next_level.add(dependent)
+            level = sorted(next_level)
+        if pending:
+            logger.warning('dependency cycle detected between: %s' %
+                           ', '.join(sorted(pending)))
+            levels.append(sorted(pending))
+        return levels
+
+    def order(self, names=None):
+        """Return the device names in canonical order.
+
+           Devices come in topological order and by name within a level,
+           so the result never depends on dict or set ordering.
+        """
+        return [name for level in self.levels(names) for name in level]
+
+    def all_dependents(self, names):
+        """Return the given names plus everything which depends on them."""
+        result = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in result:
+                result.add(name)
+                pending.extend(self.dependents.get(name, ()))
+        return result
+
+
 class NetConfig(object):
     """Configure network interfaces using the ifcfg format."""
 
-    def addObject(self, obj):
+    # NOTE: providers which only touch the devices they were given can be
+    # handed just the objects which changed since the last run.
+    incremental = False
+    # NOTE: providers which write nothing to disk lose their configuration
+    # on reboot, so a run is never skipped because the config is unchanged.
+    persistent = True
+
+    def __init__(self):
+        self.graph = NetConfigGraph()
+        self.ifup_timings = {}
+        self.rendered = {}
+
+    def addObject(self, obj, names=None):
+        """Add an object and its members to the config.
+
+           When names is given only the devices named in it are rendered,
+           the others are still added to the dependency graph.
+        """
+        if isinstance(obj, objects.VlanRange):
+            # ranges are expanded one VLAN at a time while rendering
+            for vlan in obj.expand():
+                self.addObject(vlan, names)
+            return
+        self.graph.add(obj)
+        render = names is None or obj.name in names
         if isinstance(obj, objects.Interface):
-            self.addInterface(obj)
+            if render:
+                self.addInterface(obj)
         elif isinstance(obj, objects.Vlan):
-            self.addVlan(obj)
+            if render:
+                self.addVlan(obj)
         elif isinstance(obj, objects.OvsBridge):
-            self.addBridge(obj)
+            if render:
+                self.addBridge(obj)
             for member in obj.members:
-                self.addObject(member)
+                self.addObject(member, names)
         elif isinstance(obj, objects.OvsBond):
-            self.addBond(obj)
+            if render:
+                self.addBond(obj)
             for member in obj.members:
-                self.addObject(member)
+                self.addObject(member, names)
+
+    def _renderCached(self, obj, render):
+        """Return render(obj), reusing the output for identical objects."""
+        key = (self.__class__.__name__, obj.structural_hash)
+        data = _render_cache.get(key)
+        if data is None:
+            data = render(obj)
+            _render_cache.set(key, data)
+        self.rendered[key] = data
+        return data
 
     def addInterface(self, interface):
         raise NotImplemented("addInterface is not implemented.")
@@ -56,5 +193,42 @@ class NetConfig(object):
     def addBond(self, bond):
         raise NotImplemented("addBond is not implemented.")
 
+    def renderFiles(self):
+        """Return a dict of every config file path to its rendered data."""
+        return {}
+
+    def renderOptions(self):
+        """Return the options which change the rendered output."""
+        return {}
+
+    def _buildPlan(self, files, restart, hot_update, parallel=False):
+        """Describe the changes apply() would make.
+
+           The downtime of a bounced device is estimated from its last
+           recorded ifup time and is None when nothing was recorded yet.
+           Devices which are updated live are estimated at zero.
+        """
+        waves = self.graph.levels(restart)
+        downtime = dict((name, self.ifup_timings.get(name))
+                        for name in restart)
+        downtime.update((name, 0.0) for name in hot_update)
+        total = 0.0
+        for wave in waves:
+            known = [downtime[name] for name in wave
+                     if downtime[name] is not None]
+            if known:
+                total += max(known) if parallel else sum(known)
+        return {
+            'files': files,
+            'restart': sorted(restart),
+            'hot_update': sorted(hot_update),
+            'waves': waves,
+            'estimated_downtime': downtime,
+            'estimated_total_downtime': total,
+        }
+
+    def plan(self):
+        raise NotImplemented("plan is not implemented.")
+
     def apply(self):
         raise NotImplemented("apply is not implemented.")
@@ -16,16 +16,19 @@
 
 
 import argparse
+import itertools
 import json
 import logging
 import os
 import sys
 
+import six
+
 import os_net_config
-from os_net_config import impl_eni
-from os_net_config import impl_ifcfg
-from os_net_config import impl_iproute
+from os_net_config import incremental
 from os_net_config import objects
+from os_net_config import utils
+from os_net_config import validator
 
 
 logger = logging.getLogger(__name__)
@@ -40,8 +43,77 @@ def parse_opts(argv):
                         default='/etc/os-net-config/config.json')
     parser.add_argument('-p', '--provider', metavar='PROVIDER',
                         help="""The provider to use."""
-                        """One of: ifcfg, eni, iproute.""",
+                        """One of: ifcfg, eni, iproute or the name of """
+                        """an os_net_config.providers entry point.""",
+                        default=None)
+    parser.add_argument('-s', '--state-file', metavar='STATE_FILE',
+                        help="""path to the file recording the last """
+                        """applied state. Runs which would not change """
+                        """anything exit early.""",
+                        default='/var/lib/os-net-config/state.json')
+    parser.add_argument(
+        '--no-state',
+        dest="no_state",
+        action='store_true',
+        help="Ignore the state file and always apply the configuration.",
+        required=False)
+    parser.add_argument('-w', '--workers', metavar='WORKERS', type=int,
+                        help="""Number of devices the ifcfg provider """
+                        """brings up in parallel.""",
                         default=None)
+    parser.add_argument(
+        '--plan',
+        dest="plan",
+        action='store_true',
+        help="Print the planned changes and estimated downtime as JSON "
+             "and exit without changing anything.",
+        required=False)
+    parser.add_argument(
+        '--validate',
+        dest="validate",
+        action='store_true',
+        help="Check the config file and print every error found, without "
+             "loading a provider or touching the host.",
+        required=False)
+    parser.add_argument(
+        '--timings',
+        dest="timings",
+        metavar='FILE',
+        nargs='?',
+        const='-',
+        help="Write a JSON report of the time spent in each phase and "
+             "external command to FILE, or to stderr when no FILE is given.",
+        default=None)
+    parser.add_argument(
+        '--stream',
+        dest="stream",
+        action='store_true',
+        help="Decode the network_config array one element at a time and "
+             "hand each object to the provider as soon as it is complete, "
+             "instead of loading the whole config first.",
+        required=False)
+    parser.add_argument(
+        '--no-cache',
+        dest="no_cache",
+        action='store_true',
+        help="Neither use nor write the compiled config cache stored next "
+             "to the config file as CONFIG_FILE.cache.",
+        required=False)
+    parser.add_argument(
+        '--ovs-transaction',
+        dest="ovs_transaction",
+        action='store_true',
+        help="Program all OVS bridges, bonds and ports with a single "
+             "ovs-vsctl transaction (ifcfg provider only).",
+        required=False)
+    parser.add_argument(
+        '--eni-fragments',
+        dest="eni_fragments",
+        action='store_true',
+        help="Write one file per device under /etc/network/interfaces.d "
+             "and only restart the devices whose file changed (eni "
+             "provider only).",
+        required=False)
     parser.add_argument(
         '-d', '--debug',
         dest="debug",
@@ -76,46 +148,248 @@ def configure_logger(verbose=False, debug=False):
                         level=log_level)
 
 
+def write_timings(filename):
+    logger.info('Timings:\n%s' % utils.timings.summary())
+    report = json.dumps(utils.timings.report(), indent=2)
+    if filename == '-':
+        sys.stderr.write(report + '\n')
+    else:
+        with open(filename, 'w') as f:
+            f.write(report + '\n')
+
+
 def main(argv=sys.argv):
     opts = parse_opts(argv)
     configure_logger(opts.verbose, opts.debug)
-    logger.info('Using config file at: %s' % opts.config_file)
-    iface_array = []
-
-    provider = None
-    if opts.provider:
-        if opts.provider == 'ifcfg':
-            provider = impl_ifcfg.IfcfgNetConfig()
-        elif opts.provider == 'eni':
-            provider = impl_eni.ENINetConfig()
-        elif opts.provider == 'iproute':
-            provider = impl_iproute.IprouteNetConfig()
-        else:
-            logger.error('Invalid provider specified.')
-            return 1
-    else:
+    utils.timings.reset()
+    try:
+        return run(opts)
+    finally:
+        if opts.timings:
+            write_timings(opts.timings)
+
+
+def _add_objects(provider, iface_jsons, config_file, built=None,
+                 selected=None, names=None):
+    """Validate, build and add each object, decoding lazily when streaming.
+
+       Invalid entries are not built but validation carries on, so every
+       error in the config is logged before giving up. Unknown fields and
+       unrecognised booleans are only logged as warnings. The objects are
+       appended to built when it is given. When selected is given only
+       the entries at those indexes are loaded and only the devices in
+       names are rendered.
+    """
+    errors = []
+    warnings = []
+    iface_jsons = iter(iface_jsons)
+    for i in itertools.count():
+        with utils.timings.phase('json_decode'):
+            try:
+                iface_json = next(iface_jsons)
+            except StopIteration:
+                break
+            except (KeyError, TypeError):
+                logger.error('No interfaces defined in config: %s' %
+                             config_file)
+                return False
+        if selected is not None and i not in selected:
+            continue
+        with utils.timings.phase('validate'):
+            obj_errors = validator.validate_object(iface_json,
+                                                   'network_config[%i]' % i,
+                                                   warnings)
+        if obj_errors:
+            errors.extend(obj_errors)
+            continue
+        if errors:
+            continue
+        with utils.timings.phase('object_build'):
+            obj = objects.object_from_json(iface_json)
+        if built is not None:
+            built.append(obj)
+        with utils.timings.phase('render'):
+            provider.addObject(obj, names)
+    for warning in warnings:
+        logger.warning('Ignoring config: %s' % warning)
+    for error in errors:
+        logger.error('Invalid config: %s' % error)
+    return not errors
+
+
+def validate_config(config_file):
+    """Print every error in the config file, returning the exit code."""
+    try:
+        with open(config_file) as cf:
+            config = json.load(cf)
+    except IOError as e:
+        logger.error('Unable to read config file %s: %s' % (config_file, e))
+        return 1
+    except ValueError as e:
+        print('%s: invalid JSON: %s' % (config_file, e))
+        return 1
+    errors = validator.validate(config)
+    for error in errors:
+        print('%s: %s' % (config_file, error))
+    return 1 if errors else 0
+
+
+# NOTE: providers are only imported once selected, so --validate and
+# every other provider never pay for loading them. Others can be added
+# through the os_net_config.providers entry point.
+providers = utils.Registry('os_net_config.providers', {
+    'ifcfg': 'os_net_config.impl_ifcfg.IfcfgNetConfig',
+    'eni': 'os_net_config.impl_eni.ENINetConfig',
+    'iproute': 'os_net_config.impl_iproute.IprouteNetConfig',
+})
+
+
+def _get_provider(opts):
+    name = opts.provider
+    if not name:
         if os.path.exists('/etc/sysconfig/network-scripts/'):
-            provider = impl_ifcfg.IfcfgNetConfig()
+            name = 'ifcfg'
         elif os.path.exists('/etc/network/'):
-            provider = impl_eni.ENINetConfig()
+            name = 'eni'
         else:
             logger.error('Unable to set provider for this operating system.')
-            return 1
+            return None
+    provider_class = providers.get(name)
+    if provider_class is None:
+        logger.error('Invalid provider specified.')
+        return None
+    kwargs = {}
+    if name == 'ifcfg':
+        kwargs['ovs_transaction'] = opts.ovs_transaction
+        if opts.workers:
+            kwargs['workers'] = opts.workers
+    elif name == 'eni':
+        kwargs['fragments'] = opts.eni_fragments
+    return provider_class(**kwargs)
 
-    if os.path.exists(opts.config_file):
-        with open(opts.config_file) as cf:
-            iface_array = json.loads(cf.read()).get("network_config")
-            logger.debug('network_config JSON: %s' % str(iface_array))
-    else:
-        logger.error('No config file exists at: %s' % opts.config_file)
+
+def run(opts):
+    logger.info('Using config file at: %s' % opts.config_file)
+    if opts.validate:
+        return validate_config(opts.config_file)
+
+    provider = _get_provider(opts)
+    if provider is None:
         return 1
-    if not isinstance(iface_array, list):
-        logger.error('No interfaces defined in config: %s' % opts.config_file)
+
+    provider_name = provider.__class__.__name__
+    version = os_net_config.__version__
+    options = provider.renderOptions()
+    # plans always look at the host, and so do runs of providers whose
+    # configuration does not survive a reboot
+    may_skip = provider.persistent and not opts.plan
+    state = {}
+    if not opts.no_state:
+        state = utils.load_state(opts.state_file)
+        provider.ifup_timings.update(state.get('ifup_timings', {}))
+        if (may_skip and
+                utils.state_unchanged(state, provider_name,
+                                      opts.config_file, version=version,
+                                      options=options)):
+            logger.info('No changes since the last run.')
+            return 0
+
+    if not os.path.exists(opts.config_file):
+        logger.error('No config file exists at: %s' % opts.config_file)
         return 1
-    for iface_json in iface_array:
-        obj = objects.object_from_json(iface_json)
-        provider.addObject(obj)
+    with utils.timings.phase('config_read'):
+        if opts.stream:
+            config_fingerprint = utils.file_fingerprint(opts.config_file)
+        else:
+            with open(opts.config_file) as cf:
+                config_data = cf.read()
+            config_fingerprint = utils.fingerprint(config_data)
+
+    if (may_skip and
+            utils.state_unchanged(state, provider_name, opts.config_file,
+                                  config_fingerprint, version, options)):
+        logger.info('No changes since the last run.')
+        state['config_stat'] = utils.file_stat(opts.config_file)
+        utils.save_state(opts.state_file, state)
+        return 0
+
+    cache_file = '%s.cache' % opts.config_file
+    compiled = None
+    if not opts.no_cache:
+        with utils.timings.phase('cache_load'):
+            compiled = utils.load_compiled(cache_file, config_fingerprint,
+                                           version)
+    built = None
+    nodes = names = selected = None
+    if compiled is not None:
+        logger.info('Using compiled config cache: %s' % cache_file)
+        os_net_config.seed_render_cache(
+            compiled['rendered'].get(provider_name, {}))
+        with utils.timings.phase('render'):
+            for obj in compiled['objects']:
+                provider.addObject(obj)
+    elif opts.stream:
+        # NOTE: streaming keeps memory bounded, so it never holds on to
+        # every object to build the compiled cache.
+        with open(opts.config_file) as cf:
+            if not _add_objects(provider,
+                                utils.iter_json_array(cf, 'network_config'),
+                                opts.config_file):
+                return 1
+    else:
+        with utils.timings.phase('json_decode'):
+            iface_array = json.loads(config_data).get("network_config")
+        logger.debug('network_config JSON: %s' % str(iface_array))
+        if not isinstance(iface_array, list):
+            logger.error('No interfaces defined in config: %s' %
+                         opts.config_file)
+            return 1
+        built = []
+        if not opts.no_state:
+            with utils.timings.phase('config_diff'):
+                nodes, tops = incremental.fingerprint_nodes(iface_array)
+            if (provider.incremental and state.get('objects') and
+                    utils.same_provider(state, provider_name, version,
+                                        options) and
+                    utils.files_unchanged(state)):
+                # NOTE: the compiled cache needs every object, so it is
+                # only written by full builds.
+                names, selected = incremental.rebuild_set(
+                    nodes, tops, state['objects'])
+                logger.info('Rebuilding %i of %i config entries' %
+                            (len(selected), len(tops)))
+                built = None
+        if not _add_objects(provider, iface_array, opts.config_file, built,
+                            selected, names):
+            return 1
+
+    if compiled is not None:
+        save_cache = provider_name not in compiled['rendered']
+    else:
+        save_cache = built is not None
+    # plans never write anything, not even the cache
+    if save_cache and not opts.no_cache and not opts.plan:
+        rendered = dict(compiled['rendered']) if compiled else {}
+        rendered[provider_name] = provider.rendered
+        with utils.timings.phase('cache_save'):
+            utils.save_compiled(cache_file, config_fingerprint, version,
+                                compiled['objects'] if compiled else built,
+                                rendered)
+    if opts.plan:
+        print(json.dumps(provider.plan(), indent=2, sort_keys=True))
+        return 0
     provider.apply()
+    if not opts.no_state:
+        object_fingerprints = None
+        if nodes is not None:
+            object_fingerprints = dict((key, node.fingerprint)
+                                       for key, node in six.iteritems(nodes))
+        utils.save_state(opts.state_file, utils.build_state(
+            provider_name, opts.config_file, config_fingerprint,
+            provider.renderFiles(), provider.ifup_timings,
+            object_fingerprints,
+            state.get('files') if selected is not None else None,
+            version, options))
     return 0
 
 
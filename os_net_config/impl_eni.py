@@ -15,185 +15,413 @@
 # under the License.
 
 import logging
+import time
+
+import six
 
-import netaddr
 import os_net_config
 from os_net_config import objects
 from os_net_config import utils
-
 from os_net_config.openstack.common import processutils
 
 
 logger = logging.getLogger(__name__)
 
 
-# TODO(?): should move to interfaces.d
 def _network_config_path():
     return "/etc/network/interfaces"
 
 
+def _fragment_path(name):
+    return "/etc/network/interfaces.d/%s" % name
+
+
+def _route_batch_path(name, action):
+    return "/etc/network/routes-%s.%s" % (name, action)
+
+
+# NOTE: the lines of each stanza, devices are rendered by appending these
+# to a list which is joined once.
+_IFACE = "iface %s %s %s\n"
+_ADDRESS = "    address %s\n    netmask %s\n"
+_AUTO = "auto %s\n"
+_OVS_BRIDGE_AUTO = "auto %s\nallow-ovs %s\n"
+_OVS_BRIDGE = "    ovs_type OVSBridge\n"
+_OVS_PORTS = "    ovs_ports %s\n"
+_FLUSH = "    pre-up ip addr flush dev %s\n"
+_OVS_PORT_AUTO = "auto %s\nallow-%s %s\n"
+_OVS_INT_PORT = ("    ovs_bridge %s\n    ovs_type OVSIntPort\n"
+                 "    ovs_options tag=%s\n")
+_OVS_PORT = "    ovs_bridge %s\n    ovs_type OVSPort\n"
+_VLAN = "    vlan-raw-device %s\n"
+_MTU = "    mtu %i\n"
+_SOURCE = "source %s\n"
+_ROUTE_BATCH = "up ip -force -batch %s\ndown ip -force -batch %s\n"
+_ROUTE_ADD = "route replace %s via %s dev %s\n"
+_ROUTE_DEL = "route del %s via %s dev %s\n"
+
+
+def _logical_lines(data):
+    """Yield the words of each line of an interfaces file.
+
+       Comments and blank lines are skipped and lines continued with a
+       backslash are joined.
+    """
+    continued = []
+    for line in data.splitlines():
+        if line.endswith('\\'):
+            continued.append(line[:-1])
+            continue
+        if continued:
+            continued.append(line)
+            line = ' '.join(continued)
+            continued = []
+        words = line.split()
+        if words and not words[0].startswith('#'):
+            yield words
+    if continued:
+        yield ' '.join(continued).split()
+
+
+def parse_stanzas(data):
+    """Split an interfaces file into a comparable record per device.
+
+       Each device maps to the classes it is marked with (auto,
+       allow-ovs...) and, for each address family, the method and the
+       sorted options of its iface stanza. Whitespace, comments and the
+       order of options and stanzas are ignored, so two files describing
+       the same devices compare equal.
+    """
+    marks = {}
+    stanzas = {}
+    options = None
+    for words in _logical_lines(data):
+        keyword = words[0]
+        if keyword == 'iface' and len(words) >= 2:
+            options = []
+            stanzas.setdefault(words[1], {})[' '.join(words[2:3])] = (
+                ' '.join(words[3:]), options)
+        elif keyword == 'auto' or keyword.startswith('allow-'):
+            for name in words[1:]:
+                marks.setdefault(name, set()).add(keyword)
+            options = None
+        elif keyword in ('mapping', 'source', 'source-directory'):
+            options = None
+        elif options is not None:
+            options.append(' '.join(words))
+
+    devices = {}
+    for name in set(marks) | set(stanzas):
+        devices[name] = (frozenset(marks.get(name, ())), tuple(sorted(
+            (family, method, tuple(sorted(opts)))
+            for family, (method, opts) in six.iteritems(
+                stanzas.get(name, {})))))
+    return devices
+
+
 class ENINetConfig(os_net_config.NetConfig):
     """Debian/Ubuntu implementation for network config
 
        Configure iface/bridge/routes using debian/ubuntu
-       /etc/network/interfaces format.
+       /etc/network/interfaces format. With fragments each device is
+       written to its own file under /etc/network/interfaces.d, sourced
+       from /etc/network/interfaces, so that changing one device only
+       restarts that device and the devices which depend on it.
     """
 
-    def __init__(self):
+    def __init__(self, fragments=False):
+        super(ENINetConfig, self).__init__()
+        self.fragments = fragments
         self.interfaces = {}
         self.routes = {}
+        self.route_batches = {}
         self.bridges = {}
         logger.info('Ifcfg net config provider created.')
 
-    def _addCommon(self, interface, static_addr=None):
-
-        data = ""
-        address_data = ""
-        if static_addr:
-            address_data += "    address %s\n" % static_addr.ip
-            address_data += "    netmask %s\n" % static_addr.netmask
-        else:
-            v4_addresses = interface.v4_addresses()
-            if v4_addresses:
-                data += self._addCommon(interface, v4_addresses[0])
-
-            v6_addresses = interface.v6_addresses()
-            if v6_addresses:
-                data += self._addCommon(interface, v6_addresses[0])
-
-            if data:
-                return data
+    def _addCommon(self, interface):
+        data = []
+        if interface.first_v4:
+            self._addStanza(interface, interface.first_v4, data)
+        if interface.first_v6:
+            self._addStanza(interface, interface.first_v6, data)
+        if not data:
+            self._addStanza(interface, None, data)
+        return "".join(data)
 
-        if isinstance(interface, objects.Vlan):
-            _iface = "iface vlan%i " % interface.vlan_id
-        else:
-            _iface = "iface %s " % interface.name
+    def _addStanza(self, interface, static_addr, data):
         if static_addr and static_addr.version == 6:
-            _iface += "inet6 "
+            family = "inet6"
         else:
-            _iface += "inet "
+            family = "inet"
         if interface.use_dhcp:
-            _iface += "dhcp\n"
-        elif interface.addresses:
-            _iface += "static\n"
+            method = "dhcp"
+        elif interface.has_static:
+            method = "static"
         else:
-            _iface += "manual\n"
+            method = "manual"
+        _iface = _IFACE % (interface.name, family, method)
+        address_data = ""
+        if static_addr:
+            address_data = _ADDRESS % (static_addr.ip, static_addr.netmask)
         if isinstance(interface, objects.OvsBridge):
-            data += "auto %s\n" % interface.name
-            data += "allow-ovs %s\n" % interface.name
-            data += _iface
-            data += address_data
-            data += "    ovs_type OVSBridge\n"
+            data.append(_OVS_BRIDGE_AUTO % (interface.name, interface.name))
+            data.append(_iface)
+            data.append(address_data)
+            data.append(_OVS_BRIDGE)
             if interface.members:
-                data += "    ovs_ports"
-                for i in interface.members:
-                    data += " %s" % i.name
-                data += "\n"
+                data.append(_OVS_PORTS % " ".join(
+                    i.name for i in interface.members))
                 for i in interface.members:
-                    data += "    pre-up ip addr flush dev %s\n" % i.name
+                    data.append(_FLUSH % i.name)
         elif interface.ovs_port:
+            data.append(_OVS_PORT_AUTO % (interface.name,
+                                          interface.bridge_name,
+                                          interface.name))
+            data.append(_iface)
+            data.append(address_data)
             if isinstance(interface, objects.Vlan):
-                data += "auto vlan%i\n" % interface.vlan_id
-                data += "allow-%s vlan%i\n" % (interface.bridge_name,
-                                               interface.vlan_id)
-                data += _iface
-                data += address_data
-                data += "    ovs_bridge %s\n" % interface.bridge_name
-                data += "    ovs_type OVSIntPort\n"
-                data += "    ovs_options tag=%s\n" % interface.vlan_id
-
+                data.append(_OVS_INT_PORT % (interface.bridge_name,
+                                             interface.vlan_id))
             else:
-                data += "auto %s\n" % interface.name
-                data += "allow-%s %s\n" % (interface.bridge_name,
-                                           interface.name)
-                data += _iface
-                data += address_data
-                data += "    ovs_bridge %s\n" % interface.bridge_name
-                data += "    ovs_type OVSPort\n"
+                data.append(_OVS_PORT % interface.bridge_name)
         elif isinstance(interface, objects.Vlan):
-            data += "auto vlan%i\n" % interface.vlan_id
-            data += _iface
-            data += address_data
-            data += "    vlan-raw-device %s\n" % interface.device
+            data.append(_AUTO % interface.name)
+            data.append(_iface)
+            data.append(address_data)
+            data.append(_VLAN % interface.device)
         else:
-            data += "auto %s\n" % interface.name
-            data += _iface
-            data += address_data
+            data.append(_AUTO % interface.name)
+            data.append(_iface)
+            data.append(address_data)
         if interface.mtu != 1500:
-            data += "    mtu %i\n" % interface.mtu
-        return data
+            data.append(_MTU % interface.mtu)
 
     def addInterface(self, interface):
         logger.info('adding interface: %s' % interface.name)
-        data = self._addCommon(interface)
+        data = self._addDevice(interface, self.interfaces)
         logger.debug('interface data: %s' % data)
-        self.interfaces[interface.name] = data
-        if interface.routes:
-            self._addRoutes(interface.name, interface.routes)
 
     def addBridge(self, bridge):
         logger.info('adding bridge: %s' % bridge.name)
-        data = self._addCommon(bridge)
+        data = self._addDevice(bridge, self.bridges)
         logger.debug('bridge data: %s' % data)
-        self.bridges[bridge.name] = data
-        if bridge.routes:
-            self._addRoutes(bridge.name, bridge.routes)
 
     def addVlan(self, vlan):
         logger.info('adding vlan: %s' % vlan.name)
-        data = self._addCommon(vlan)
+        data = self._addDevice(vlan, self.interfaces)
         logger.debug('vlan data: %s' % data)
-        self.interfaces[vlan.name] = data
-        if vlan.routes:
-            self._addRoutes(vlan.name, vlan.routes)
 
-    def _addRoutes(self, interface_name, routes=[]):
+    def _renderRoutes(self, interface_name, routes=[]):
+        """Return the ip -batch commands adding and deleting the routes.
+
+           Routes are added in config order with default routes first and
+           deleted in the reverse order, each direction with a single ip
+           command run from the interface's stanza.
+        """
         logger.info('adding custom route for interface: %s' % interface_name)
-        data = ""
+        destinations = []
+        for route in routes:
+            if route.default:
+                destinations.append(("default", route.next_hop))
         for route in routes:
-            rt = netaddr.IPNetwork(route.ip_netmask)
-            data += "up route add -net %s netmask %s gw %s\n" % (
-                    str(rt.ip), str(rt.netmask), route.next_hop)
-            data += "down route del -net %s netmask %s gw %s\n" % (
-                    str(rt.ip), str(rt.netmask), route.next_hop)
-        self.routes[interface_name] = data
-        logger.debug('route data: %s' % self.routes[interface_name])
+            if not route.default:
+                rt = route.network
+                destinations.append(("%s/%i" % (rt.network, rt.prefixlen),
+                                     route.next_hop))
+        up = "".join(_ROUTE_ADD % (dst, next_hop, interface_name)
+                     for dst, next_hop in destinations)
+        down = "".join(_ROUTE_DEL % (dst, next_hop, interface_name)
+                       for dst, next_hop in reversed(destinations))
+        logger.debug('route data: %s' % up)
+        return up, down
 
-    def apply(self):
-        new_config = ""
+    def _renderDevice(self, interface):
+        route_data = None
+        if interface.routes:
+            route_data = self._renderRoutes(interface.name, interface.routes)
+        return self._addCommon(interface), route_data
+
+    def _addDevice(self, interface, devices):
+        data, route_data = self._renderCached(interface, self._renderDevice)
+        devices[interface.name] = data
+        if route_data is not None:
+            self.routes[interface.name] = _ROUTE_BATCH % (
+                _route_batch_path(interface.name, 'up'),
+                _route_batch_path(interface.name, 'down'))
+            self.route_batches[interface.name] = route_data
+        return data
+
+    def _routeFiles(self):
+        """Return the ip -batch file of every device with routes."""
+        files = {}
+        for name, (up, down) in six.iteritems(self.route_batches):
+            files[_route_batch_path(name, 'up')] = up
+            files[_route_batch_path(name, 'down')] = down
+        return files
 
+    def _deviceOrder(self):
         # write out bridges first. This ensures that an ifup -a
         # on reboot brings them up first
-        for bridge_name, bridge_data in self.bridges.iteritems():
-            route_data = self.routes.get(bridge_name)
-            bridge_data += (route_data or '')
-            new_config += bridge_data
-
-        for interface_name, iface_data in self.interfaces.iteritems():
-            route_data = self.routes.get(interface_name)
-            iface_data += (route_data or '')
-            new_config += iface_data
-
-        if (utils.diff(_network_config_path(), new_config)):
-            for interface in self.interfaces.keys():
-                logger.info('running ifdown on interface: %s' % interface)
-                processutils.execute('/sbin/ifdown', interface,
-                                     check_exit_code=False)
-
-            for bridge in self.bridges.keys():
-                logger.info('running ifdown on bridge: %s' % bridge)
-                processutils.execute('/sbin/ifdown', bridge,
-                                     check_exit_code=False)
-
-            logger.info('writing config file')
-            utils.write_config(_network_config_path(), new_config)
-
-            for bridge in self.bridges.keys():
-                logger.info('running ifup on bridge: %s' % bridge)
-                processutils.execute('/sbin/ifup', bridge)
-
-            for interface in self.interfaces.keys():
-                logger.info('running ifup on interface: %s' % interface)
-                processutils.execute('/sbin/ifup', interface)
+        return self.graph.order(self.bridges) + self.graph.order(
+            self.interfaces)
+
+    def _deviceData(self):
+        """Return each device's stanzas followed by its routes."""
+        devices = {}
+        for name, data in six.iteritems(self.bridges):
+            devices[name] = data + self.routes.get(name, '')
+        for name, data in six.iteritems(self.interfaces):
+            devices[name] = data + self.routes.get(name, '')
+        return devices
+
+    def _renderConfig(self):
+        new_config = []
+        for name in self._deviceOrder():
+            if name in self.bridges:
+                new_config.append(self.bridges[name])
+            else:
+                new_config.append(self.interfaces[name])
+            new_config.append(self.routes.get(name, ''))
+        return "".join(new_config)
+
+    def _renderSources(self):
+        """Return the main file sourcing every fragment in bring up order."""
+        return "".join(_SOURCE % _fragment_path(name)
+                       for name in self._deviceOrder())
+
+    def renderOptions(self):
+        return {'fragments': self.fragments}
+
+    def renderFiles(self):
+        files = self._routeFiles()
+        if not self.fragments:
+            files[_network_config_path()] = self._renderConfig()
+            return files
+        files.update((_fragment_path(name), data)
+                     for name, data in six.iteritems(self._deviceData()))
+        files[_network_config_path()] = self._renderSources()
+        return files
+
+    def _changedDevices(self, old_data, new_data, names):
+        """Return the names whose stanzas differ between the two texts."""
+        if not old_data:
+            return list(names)
+        old = parse_stanzas(old_data)
+        new = parse_stanzas(new_data)
+        changed = []
+        for name in names:
+            if old.get(name) != new.get(name):
+                changed.append(name)
+            else:
+                logger.info('No changes required for: %s' % name)
+        return changed
+
+    def _routeCommands(self, old_up, new_up):
+        """Return the ip -batch commands which move to the new routes."""
+        old_routes = [line for line in old_up.splitlines() if line.strip()]
+        new_routes = new_up.splitlines()
+        commands = [route.replace('route replace ', 'route del ', 1)
+                    for route in old_routes if route not in new_routes]
+        commands.extend([route for route in new_routes
+                         if route not in old_routes])
+        return commands
+
+    def _changes(self):
+        """Work out everything apply() needs to do without doing it.
+
+           Files are compared stanza by stanza, so only the devices whose
+           configuration really changed are restarted, along with the
+           devices which depend on them. A file which only differs in
+           layout is rewritten without restarting anything. Devices where
+           only the routes changed are updated live.
+        """
+        devices = set(self.interfaces) | set(self.bridges)
+        update_files = {}
+        changed = []
+        if not self.fragments:
+            path = _network_config_path()
+            new_config = self._renderConfig()
+            old_config = utils.get_file_data(path)
+            if old_config != new_config:
+                update_files[path] = new_config
+                changed = self._changedDevices(old_config, new_config,
+                                               self._deviceOrder())
         else:
+            device_data = self._deviceData()
+            for name in self._deviceOrder():
+                data = device_data[name]
+                path = _fragment_path(name)
+                old_data = utils.get_file_data(path)
+                if old_data != data:
+                    update_files[path] = data
+                    changed.extend(self._changedDevices(old_data, data,
+                                                        [name]))
+            sources = self._renderSources()
+            if utils.diff(_network_config_path(), sources):
+                update_files[_network_config_path()] = sources
+        restart = self.graph.all_dependents(changed) & devices
+
+        hot_update = []
+        route_commands = []
+        for name, (up, down) in sorted(six.iteritems(self.route_batches)):
+            up_path = _route_batch_path(name, 'up')
+            old_up = utils.get_file_data(up_path)
+            if old_up == up and not utils.diff(
+                    _route_batch_path(name, 'down'), down):
+                continue
+            update_files[up_path] = up
+            update_files[_route_batch_path(name, 'down')] = down
+            if name not in restart:
+                hot_update.append(name)
+                route_commands.extend(self._routeCommands(old_up, up))
+        return {'update_files': update_files,
+                'restart': self.graph.order(restart),
+                'hot_update': hot_update, 'route_commands': route_commands}
+
+    def plan(self):
+        changes = self._changes()
+        return self._buildPlan(sorted(changes['update_files']),
+                               changes['restart'], changes['hot_update'])
+
+    def apply(self):
+        with utils.timings.phase('diff'):
+            changes = self._changes()
+        update_files = changes['update_files']
+        route_commands = changes['route_commands']
+        if not update_files:
             logger.info('No interface changes are required.')
+            return
+
+        levels = self.graph.levels(changes['restart'])
+        with utils.timings.phase('ifdown'):
+            for level in reversed(levels):
+                for device in level:
+                    logger.info('running ifdown on: %s' % device)
+                    utils.execute('/sbin/ifdown', device,
+                                  check_exit_code=False)
+
+        for location in sorted(update_files):
+            logger.info('writing config file: %s' % location)
+        with utils.timings.phase('file_write'):
+            utils.write_configs(update_files)
+
+        if route_commands:
+            # devices where only the routes changed are updated live
+            logger.info('updating routes: %s' % '; '.join(route_commands))
+            with utils.timings.phase('route_update'):
+                try:
+                    utils.execute('/sbin/ip', '-force', '-batch', '-',
+                                  process_input='\n'.join(route_commands) +
+                                  '\n')
+                except (processutils.ProcessExecutionError, OSError) as e:
+                    # the route batch files are already written, so carry
+                    # on and bring the devices back up
+                    logger.error('updating routes failed: %s' % e)
+
+        with utils.timings.phase('ifup'):
+            for level in levels:
+                for device in level:
+                    logger.info('running ifup on: %s' % device)
+                    start = time.time()
+                    utils.execute('/sbin/ifup', device)
+                    self.ifup_timings[device] = time.time() - start
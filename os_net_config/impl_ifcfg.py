@@ -15,12 +15,15 @@
 # under the License.
 
 import logging
+import os
+import time
+
+import eventlet
+import six
 
 import os_net_config
 from os_net_config import objects
 from os_net_config import utils
-
-
 from os_net_config.openstack.common import processutils
 
 
@@ -40,173 +43,361 @@ def route_config_path(name):
     return "/etc/sysconfig/network-scripts/route-%s" % name
 
 
+# NOTE: the L3 half of ifup-ovs, run once the OVS transaction created the
+# device.
+IFUP_ETH = "/etc/sysconfig/network-scripts/ifup-eth"
+
+
+# NOTE: the default number of devices brought up concurrently in each wave
+DEFAULT_WORKERS = 4
+
+# NOTE: the lines of each ifcfg setting, devices are rendered by appending
+# these to a list which is joined once.
+_HEADER = "DEVICE=%s\nONBOOT=yes\nHOTPLUG=no\n"
+_VLAN = "VLAN=yes\nPHYSDEV=%s\n"
+_OVS = "DEVICETYPE=ovs\n"
+_OVS_INT_PORT = "TYPE=OVSIntPort\nOVS_BRIDGE=%s\nOVS_OPTIONS=\"tag=%s\"\n"
+_OVS_PORT = "TYPE=OVSPort\nOVS_BRIDGE=%s\n"
+_OVS_BRIDGE = "DEVICETYPE=ovs\nTYPE=OVSBridge\n"
+_OVS_BOND = "DEVICETYPE=ovs\nTYPE=OVSBond\n"
+_OVS_DHCP = "OVSBOOTPROTO=dhcp\n"
+_OVS_DHCP_INTERFACES = "OVSDHCPINTERFACES=\"%s\"\n"
+_BOND_IFACES = "BOND_IFACES=\"%s\"\n"
+_OVS_OPTIONS = "OVS_OPTIONS=\"%s\"\n"
+_DHCP = "BOOTPROTO=dhcp\n"
+_NO_IP = "BOOTPROTO=none\n"
+_MTU = "MTU=%i\n"
+_IPV6 = "IPV6INIT=yes\n"
+_IPV6_MTU = "IPV6_MTU=%i\n"
+_DHCPV6 = "DHCPV6C=yes\n"
+_STATIC = "BOOTPROTO=static\nIPADDR=%s\nNETMASK=%s\n"
+_STATIC_V6 = "IPV6_AUTOCONF=no\nIPV6ADDR=%s\n"
+_DEFAULT_ROUTE = "default via %s dev %s\n"
+_ROUTE = "%s via %s dev %s\n"
+
+
 class IfcfgNetConfig(os_net_config.NetConfig):
     """Configure network interfaces using the ifcfg format."""
 
-    def __init__(self):
+    incremental = True
+
+    def __init__(self, workers=DEFAULT_WORKERS, ovs_transaction=False):
+        super(IfcfgNetConfig, self).__init__()
         self.interfaces = {}
         self.routes = {}
         self.bridges = {}
+        self.workers = max(1, workers)
+        self.ovs_transaction = ovs_transaction
+        # the OVS devices the transaction may have to program
+        self.ovs_objects = {}
         logger.info('Ifcfg net config provider created.')
 
+    def _ovsCommand(self, obj):
+        """Return the ovs-vsctl arguments which create the OVS device.
+
+           This mirrors what the ifup-ovs script runs for each device type
+           so the whole set can be committed in a single transaction.
+        """
+        if isinstance(obj, objects.OvsBridge):
+            cmd = ['--may-exist', 'add-br', obj.name]
+            if obj.ovs_options:
+                cmd.extend(obj.ovs_options.split())
+            return cmd
+        if not obj.bridge_name:
+            return None
+        cmd = ['--if-exists', 'del-port', obj.name, '--']
+        if isinstance(obj, objects.OvsBond):
+            cmd.extend(['--fake-iface', 'add-bond', obj.bridge_name,
+                        obj.name])
+            cmd.extend([member.name for member in obj.members])
+            if obj.ovs_options:
+                cmd.extend(obj.ovs_options.split())
+        elif isinstance(obj, objects.Vlan):
+            cmd.extend(['add-port', obj.bridge_name, obj.name,
+                        'tag=%s' % obj.vlan_id, '--', 'set', 'Interface',
+                        obj.name, 'type=internal'])
+        else:
+            cmd.extend(['add-port', obj.bridge_name, obj.name])
+        return cmd
+
+    def _applyOvsTransaction(self, devices):
+        """Program every OVS device in one ovs-vsctl transaction."""
+        args = []
+        for level in self.graph.levels(devices):
+            for name in level:
+                args.append('--')
+                args.extend(self._ovsCommand(self.ovs_objects[name]))
+        if args:
+            logger.info('running ovs-vsctl transaction: %s' % ' '.join(args))
+            utils.execute('/usr/bin/ovs-vsctl', *args)
+
+    def _ifupL3(self, name):
+        """Run ifup-eth for an OVS device created by the transaction.
+
+           This is what ifup-ovs runs after its own ovs-vsctl call, so the
+           port is not reprogrammed a second time. ifup-ovs only hands a
+           bridge to ifup-eth with BOOTPROTO=dhcp once a port is up, the
+           transaction created the ports already.
+        """
+        obj = self.ovs_objects[name]
+        kwargs = {}
+        if isinstance(obj, objects.OvsBridge) and obj.use_dhcp:
+            kwargs['env_variables'] = dict(os.environ, BOOTPROTO='dhcp')
+        utils.execute(IFUP_ETH, name, **kwargs)
+
     def _addCommon(self, base_opt):
-        data = "DEVICE=%s\n" % base_opt.name
-        data += "ONBOOT=yes\n"
-        data += "HOTPLUG=no\n"
+        data = [_HEADER % base_opt.name]
         if isinstance(base_opt, objects.Vlan):
-            data += "VLAN=yes\n"
-            data += "PHYSDEV=%s\n" % base_opt.device
+            data.append(_VLAN % base_opt.device)
         if base_opt.ovs_port:
-            data += "DEVICETYPE=ovs\n"
+            data.append(_OVS)
             if base_opt.bridge_name:
                 if isinstance(base_opt, objects.Vlan):
-                    data += "TYPE=OVSIntPort\n"
-                    data += "OVS_BRIDGE=%s\n" % base_opt.bridge_name
-                    data += "OVS_OPTIONS=\"tag=%s\"\n" % base_opt.vlan_id
+                    data.append(_OVS_INT_PORT % (base_opt.bridge_name,
+                                                 base_opt.vlan_id))
                 else:
-                    data += "TYPE=OVSPort\n"
-                    data += "OVS_BRIDGE=%s\n" % base_opt.bridge_name
+                    data.append(_OVS_PORT % base_opt.bridge_name)
         if isinstance(base_opt, objects.OvsBridge):
-            data += "DEVICETYPE=ovs\n"
-            data += "TYPE=OVSBridge\n"
+            data.append(_OVS_BRIDGE)
             if base_opt.use_dhcp:
-                data += "OVSBOOTPROTO=dhcp\n"
+                data.append(_OVS_DHCP)
             if base_opt.members:
-                members = [member.name for member in base_opt.members]
-                data += ("OVSDHCPINTERFACES=\"%s\"\n" % " ".join(members))
+                data.append(_OVS_DHCP_INTERFACES % " ".join(
+                    member.name for member in base_opt.members))
             if base_opt.ovs_options:
-                data += "OVS_OPTIONS=\"%s\"\n" % base_opt.ovs_options
+                data.append(_OVS_OPTIONS % base_opt.ovs_options)
         elif isinstance(base_opt, objects.OvsBond):
-            data += "DEVICETYPE=ovs\n"
-            data += "TYPE=OVSBond\n"
+            data.append(_OVS_BOND)
             if base_opt.use_dhcp:
-                data += "OVSBOOTPROTO=dhcp\n"
+                data.append(_OVS_DHCP)
             if base_opt.members:
-                members = [member.name for member in base_opt.members]
-                data += ("BOND_IFACES=\"%s\"\n" % " ".join(members))
+                data.append(_BOND_IFACES % " ".join(
+                    member.name for member in base_opt.members))
             if base_opt.ovs_options:
-                data += "OVS_OPTIONS=\"%s\"\n" % base_opt.ovs_options
-        else:
-            if base_opt.use_dhcp:
-                data += "BOOTPROTO=dhcp\n"
-            elif not base_opt.addresses:
-                data += "BOOTPROTO=none\n"
+                data.append(_OVS_OPTIONS % base_opt.ovs_options)
+        elif base_opt.use_dhcp:
+            data.append(_DHCP)
+        elif not base_opt.has_static:
+            data.append(_NO_IP)
         if base_opt.mtu != 1500:
-            data += "MTU=%i\n" % base_opt.mtu
-        if base_opt.use_dhcpv6 or base_opt.v6_addresses():
-            data += "IPV6INIT=yes\n"
+            data.append(_MTU % base_opt.mtu)
+        first_v6 = base_opt.first_v6
+        if base_opt.use_dhcpv6 or first_v6:
+            data.append(_IPV6)
             if base_opt.mtu != 1500:
-                data += "IPV6_MTU=%i\n" % base_opt.mtu
+                data.append(_IPV6_MTU % base_opt.mtu)
         if base_opt.use_dhcpv6:
-            data += "DHCPV6C=yes\n"
-        elif base_opt.addresses:
+            data.append(_DHCPV6)
+        elif base_opt.has_static:
             #TODO(dprince): Do we want to support multiple addresses?
-            v4_addresses = base_opt.v4_addresses()
-            if v4_addresses:
-                first_v4 = v4_addresses[0]
-                data += "BOOTPROTO=static\n"
-                data += "IPADDR=%s\n" % first_v4.ip
-                data += "NETMASK=%s\n" % first_v4.netmask
-
-            v6_addresses = base_opt.v6_addresses()
-            if v6_addresses:
-                first_v6 = v6_addresses[0]
-                data += "IPV6_AUTOCONF=no\n"
-                data += "IPV6ADDR=%s\n" % first_v6.ip
-        return data
+            first_v4 = base_opt.first_v4
+            if first_v4:
+                data.append(_STATIC % (first_v4.ip, first_v4.netmask))
 
-    def _addRoutes(self, interface_name, routes=[]):
+            if first_v6:
+                data.append(_STATIC_V6 % first_v6.ip)
+        return "".join(data)
+
+    def _renderRoutes(self, interface_name, routes=[]):
         logger.info('adding custom route for interface: %s' % interface_name)
-        data = ""
-        first_line = ""
+        # the default route always goes first
+        data = [""]
         for route in routes:
             if route.default:
-                first_line = "default via %s dev %s\n" % (route.next_hop,
-                                                          interface_name)
+                data[0] = _DEFAULT_ROUTE % (route.next_hop, interface_name)
             else:
-                data += "%s via %s dev %s\n" % (route.ip_netmask,
-                                                route.next_hop,
-                                                interface_name)
-        self.routes[interface_name] = first_line + data
-        logger.debug('route data: %s' % self.routes[interface_name])
+                data.append(_ROUTE % (route.ip_netmask, route.next_hop,
+                                      interface_name))
+        data = "".join(data)
+        logger.debug('route data: %s' % data)
+        return data
+
+    def _renderDevice(self, base_opt):
+        route_data = None
+        if base_opt.routes:
+            route_data = self._renderRoutes(base_opt.name, base_opt.routes)
+        return self._addCommon(base_opt), route_data
+
+    def _addDevice(self, base_opt, devices):
+        data, route_data = self._renderCached(base_opt, self._renderDevice)
+        devices[base_opt.name] = data
+        if self.ovs_transaction and self._ovsCommand(base_opt):
+            self.ovs_objects[base_opt.name] = base_opt
+        if route_data is not None:
+            self.routes[base_opt.name] = route_data
+        return data
 
     def addInterface(self, interface):
         logger.info('adding interface: %s' % interface.name)
-        data = self._addCommon(interface)
+        data = self._addDevice(interface, self.interfaces)
         logger.debug('interface data: %s' % data)
-        self.interfaces[interface.name] = data
-        if interface.routes:
-            self._addRoutes(interface.name, interface.routes)
 
     def addVlan(self, vlan):
         logger.info('adding vlan: %s' % vlan.name)
-        data = self._addCommon(vlan)
+        data = self._addDevice(vlan, self.interfaces)
         logger.debug('vlan data: %s' % data)
-        self.interfaces[vlan.name] = data
-        if vlan.routes:
-            self._addRoutes(vlan.name, vlan.routes)
 
     def addBridge(self, bridge):
         logger.info('adding bridge: %s' % bridge.name)
-        data = self._addCommon(bridge)
+        data = self._addDevice(bridge, self.bridges)
         logger.debug('bridge data: %s' % data)
-        self.bridges[bridge.name] = data
-        if bridge.routes:
-            self._addRoutes(bridge.name, bridge.routes)
 
     def addBond(self, bond):
         logger.info('adding bond: %s' % bond.name)
-        data = self._addCommon(bond)
+        data = self._addDevice(bond, self.interfaces)
         logger.debug('bond data: %s' % data)
-        self.interfaces[bond.name] = data
-        if bond.routes:
-            self._addRoutes(bond.name, bond.routes)
 
-    def apply(self):
-        logger.info('applying network configs...')
-        restart_interfaces = []
-        restart_bridges = []
-        update_files = {}
-
-        for interface_name, iface_data in self.interfaces.iteritems():
-            route_data = self.routes.get(interface_name, '')
-            if (utils.diff(ifcfg_config_path(interface_name), iface_data) or
-                utils.diff(route_config_path(interface_name), route_data)):
-                restart_interfaces.append(interface_name)
-                update_files[ifcfg_config_path(interface_name)] = iface_data
-                update_files[route_config_path(interface_name)] = route_data
-            else:
-                logger.info('No changes required for interface: %s' %
-                            interface_name)
-
-        for bridge_name, bridge_data in self.bridges.iteritems():
-            route_data = self.routes.get(bridge_name, '')
-            if (utils.diff(ifcfg_config_path(bridge_name), bridge_data) or
-                utils.diff(route_config_path(bridge_name), route_data)):
-                restart_bridges.append(bridge_name)
-                update_files[bridge_config_path(bridge_name)] = bridge_data
-                update_files[route_config_path(bridge_name)] = route_data
+    def renderFiles(self):
+        files = {}
+        for interface_name, iface_data in six.iteritems(self.interfaces):
+            files[ifcfg_config_path(interface_name)] = iface_data
+            files[route_config_path(interface_name)] = self.routes.get(
+                interface_name, '')
+        for bridge_name, bridge_data in six.iteritems(self.bridges):
+            files[bridge_config_path(bridge_name)] = bridge_data
+            files[route_config_path(bridge_name)] = self.routes.get(
+                bridge_name, '')
+        return files
+
+    def _classifyChange(self, name, data, config_path, update_files):
+        """Work out what differs on disk for a single device.
+
+           Returns 'restart' when the ifcfg file changed, 'routes' when only
+           the route file changed and None when nothing changed. The files
+           which need writing are added to update_files.
+        """
+        route_data = self.routes.get(name, '')
+        route_path = route_config_path(name)
+        if utils.diff(config_path, data):
+            update_files[config_path] = data
+            update_files[route_path] = route_data
+            return 'restart'
+        if utils.diff(route_path, route_data):
+            update_files[route_path] = route_data
+            return 'routes'
+        return None
+
+    def _routeCommands(self, name):
+        """Return the ip -batch commands which move to the new routes."""
+        old_routes = utils.get_file_data(route_config_path(name))
+        old_routes = [line for line in old_routes.splitlines()
+                      if line.strip()]
+        new_routes = self.routes.get(name, '').splitlines()
+        commands = ['route del %s' % route for route in old_routes
+                    if route not in new_routes]
+        commands.extend(['route replace %s' % route for route in new_routes
+                         if route not in old_routes])
+        return commands
+
+    def _changes(self):
+        """Work out everything apply() needs to do without doing it."""
+        changes = {'restart': [], 'hot_update': [], 'route_commands': [],
+                   'update_files': {}, 'ovs_devices': set(),
+                   'link_only': set()}
+        devices = [(name, self.interfaces[name], ifcfg_config_path(name))
+                   for name in self.graph.order(self.interfaces)]
+        devices.extend([(name, self.bridges[name], bridge_config_path(name))
+                        for name in self.graph.order(self.bridges)])
+
+        for name, data, config_path in devices:
+            change = self._classifyChange(name, data, config_path,
+                                          changes['update_files'])
+            if change == 'restart':
+                changes['restart'].append(name)
+            elif change == 'routes':
+                changes['hot_update'].append(name)
+                changes['route_commands'].extend(self._routeCommands(name))
             else:
-                logger.info('No changes required for bridge: %s' % bridge_name)
+                logger.info('No changes required for: %s' % name)
+
+        if self.ovs_transaction:
+            for name in changes['restart']:
+                obj = self.ovs_objects.get(name)
+                if obj is None:
+                    continue
+                changes['ovs_devices'].add(name)
+                if not (obj.use_dhcp or obj.use_dhcpv6 or obj.has_static):
+                    changes['link_only'].add(name)
+        return changes
+
+    def plan(self):
+        changes = self._changes()
+        # OVS devices with L3 configuration are still reconfigured by
+        # ifup-eth, only the link only ones are updated without downtime
+        restart = [name for name in changes['restart']
+                   if name not in changes['link_only']]
+        hot_update = changes['hot_update'] + sorted(changes['link_only'])
+        return self._buildPlan(sorted(changes['update_files']),
+                               restart, hot_update, parallel=True)
 
-        for interface in restart_interfaces:
-            logger.info('running ifdown on interface: %s' % interface)
-            processutils.execute('/sbin/ifdown', interface,
-                                 check_exit_code=False)
+    def apply(self):
+        logger.info('applying network configs...')
+        with utils.timings.phase('diff'):
+            changes = self._changes()
+        restart = changes['restart']
+        ovs_devices = changes['ovs_devices']
+        update_files = changes['update_files']
+        route_commands = changes['route_commands']
+        waves = self.graph.levels(restart)
 
-        for bridge in restart_bridges:
-            logger.info('running ifdown on bridge: %s' % bridge)
-            processutils.execute('/sbin/ifdown', bridge,
-                                 check_exit_code=False)
+        # take devices down in the reverse order they are brought up, OVS
+        # devices are reprogrammed in place by the transaction instead
+        with utils.timings.phase('ifdown'):
+            self._runWaves('ifdown', reversed(self.graph.levels(
+                           set(restart) - ovs_devices)),
+                           check_exit_code=False)
 
-        for location, data in update_files.iteritems():
+        for location in sorted(update_files):
             logger.info('writing config file: %s' % location)
-            utils.write_config(location, data)
+        with utils.timings.phase('file_write'):
+            utils.write_configs(update_files)
 
-        for bridge in restart_bridges:
-            logger.info('running ifup on bridge: %s' % bridge)
-            processutils.execute('/sbin/ifup', bridge)
+        if route_commands:
+            # devices where only the routes changed are updated live
+            logger.info('updating routes: %s' % '; '.join(route_commands))
+            with utils.timings.phase('route_update'):
+                try:
+                    utils.execute('/sbin/ip', '-force', '-batch', '-',
+                                  process_input='\n'.join(route_commands) +
+                                  '\n')
+                except (processutils.ProcessExecutionError, OSError) as e:
+                    # the route files are already written, so carry on and
+                    # bring the devices back up rather than leave them down
+                    logger.error('updating routes failed: %s' % e)
+
+        if ovs_devices:
+            with utils.timings.phase('ovs_transaction'):
+                self._applyOvsTransaction(ovs_devices)
+
+        with utils.timings.phase('ifup'):
+            self._runWaves('ifup', waves, ovs_devices=ovs_devices,
+                           link_only=changes['link_only'])
+
+    def _runWaves(self, command, waves, ovs_devices=(), link_only=(),
+                  **kwargs):
+        pool = eventlet.GreenPool(self.workers)
+
+        def _run(device):
+            start = time.time()
+            if device in link_only:
+                logger.info('setting link up on: %s' % device)
+                utils.execute('/sbin/ip', 'link', 'set', 'dev',
+                              device, 'up')
+            elif device in ovs_devices:
+                logger.info('running ifup-eth on: %s' % device)
+                self._ifupL3(device)
+            else:
+                logger.info('running %s on: %s' % (command, device))
+                utils.execute('/sbin/%s' % command, device, **kwargs)
+            return device, time.time() - start
 
-        for interface in restart_interfaces:
-            logger.info('running ifup on interface: %s' % interface)
-            processutils.execute('/sbin/ifup', interface)
+        total_start = time.time()
+        for i, wave in enumerate(waves):
+            wave_start = time.time()
+            for device, elapsed in pool.imap(_run, wave):
+                if command == 'ifup':
+                    self.ifup_timings[device] = elapsed
+            logger.info('%s wave %i (%s) took %.3fs' %
+                        (command, i, ' '.join(wave), time.time() - wave_start))
+        logger.info('%s total took %.3fs' %
+                    (command, time.time() - total_start))
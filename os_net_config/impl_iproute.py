@@ -14,8 +14,199 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import errno
+import logging
+import socket
+
 import os_net_config
+from os_net_config import netlink
+from os_net_config import objects
+from os_net_config import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def _family(version):
+    return socket.AF_INET if version == 4 else socket.AF_INET6
 
 
 class IprouteNetConfig(os_net_config.NetConfig):
-    """Configure network interfaces using iproute2."""
+    """Configure network interfaces using iproute2.
+
+       Links, VLANs, addresses, MTU and routes are programmed directly over
+       rtnetlink. The current state is dumped once and only the deltas are
+       sent, batched into as few send() calls as possible. Nothing is
+       persisted to disk and no external commands are run.
+    """
+
+    persistent = False
+
+    def __init__(self):
+        super(IprouteNetConfig, self).__init__()
+        self.links = {}
+        logger.info('Iproute net config provider created.')
+
+    def _addLink(self, base_opt):
+        if base_opt.use_dhcp or base_opt.use_dhcpv6:
+            raise os_net_config.NotImplemented(
+                'DHCP is not supported by the iproute provider.')
+        if base_opt.ovs_port:
+            raise os_net_config.NotImplemented(
+                'OVS ports are not supported by the iproute provider.')
+        self.links[base_opt.name] = base_opt
+
+    def addInterface(self, interface):
+        logger.info('adding interface: %s' % interface.name)
+        self._addLink(interface)
+
+    def addVlan(self, vlan):
+        logger.info('adding vlan: %s' % vlan.name)
+        self._addLink(vlan)
+
+    def addBridge(self, bridge):
+        raise os_net_config.NotImplemented(
+            'OVS bridges are not supported by the iproute provider.')
+
+    def addBond(self, bond):
+        raise os_net_config.NotImplemented(
+            'OVS bonds are not supported by the iproute provider.')
+
+    def _desiredAddresses(self, base_opt, index):
+        addrs = set()
+        for addr in base_opt.addresses:
+            addrs.add(netlink.Addr(index, _family(addr.version),
+                                   addr.parsed.packed, addr.prefixlen,
+                                   netlink.RT_SCOPE_UNIVERSE))
+        return addrs
+
+    def _desiredRoutes(self, base_opt, index):
+        routes = set()
+        for route in base_opt.routes:
+            gateway = route.gateway
+            if route.default:
+                dst = None
+                dst_len = 0
+            else:
+                dst = route.network.network_packed
+                dst_len = route.network.prefixlen
+            routes.add(netlink.Route(_family(gateway.version), dst, dst_len,
+                                     gateway.packed, index,
+                                     netlink.RT_TABLE_MAIN,
+                                     netlink.RTPROT_STATIC))
+        return routes
+
+    def _linkMessages(self, links):
+        """Return the messages which create any missing VLAN devices."""
+        messages = []
+        for level in self.graph.levels(self.links.keys()):
+            for name in level:
+                obj = self.links[name]
+                if name in links or not isinstance(obj, objects.Vlan):
+                    continue
+                parent = links.get(obj.device)
+                if parent is None:
+                    raise netlink.NetlinkError(
+                        'VLAN device %s does not exist' % obj.device,
+                        errno.ENODEV)
+                logger.info('creating vlan: %s' % name)
+                messages.append(netlink.new_vlan(name, parent.index,
+                                                 obj.vlan_id))
+        return messages
+
+    def _configMessages(self, links, addresses, routes, changed=None):
+        """Return the messages which move the links to the desired state.
+
+           Link settings go first, then addresses and finally routes so
+           that gateways are reachable by the time routes are added. The
+           names of the devices which need any message are added to
+           changed when it is given.
+        """
+        link_msgs = []
+        addr_msgs = []
+        route_msgs = []
+        for name in sorted(self.links):
+            count = len(link_msgs) + len(addr_msgs) + len(route_msgs)
+            obj = self.links[name]
+            link = links.get(name)
+            if link is None:
+                raise netlink.NetlinkError('device %s does not exist' % name,
+                                           errno.ENODEV)
+            mtu = obj.mtu if obj.mtu != link.mtu else None
+            if mtu is not None or not link.flags & netlink.IFF_UP:
+                logger.info('setting link up on: %s' % name)
+                link_msgs.append(netlink.set_link(link.index, mtu=mtu))
+
+            current = set(addr for addr in addresses
+                          if addr.index == link.index and
+                          addr.scope == netlink.RT_SCOPE_UNIVERSE)
+            desired = self._desiredAddresses(obj, link.index)
+            for addr in sorted(current - desired):
+                logger.info('removing address from: %s' % name)
+                addr_msgs.append(netlink.del_addr(addr))
+            for addr in sorted(desired - current):
+                logger.info('adding address to: %s' % name)
+                addr_msgs.append(netlink.new_addr(addr))
+
+            current = set(route for route in routes
+                          if route.oif == link.index and
+                          route.table == netlink.RT_TABLE_MAIN and
+                          route.protocol == netlink.RTPROT_STATIC)
+            desired = self._desiredRoutes(obj, link.index)
+            for route in sorted(current - desired):
+                logger.info('removing route from: %s' % name)
+                route_msgs.append(netlink.del_route(route))
+            for route in sorted(desired - current,
+                                key=lambda r: (r.dst_len, r.dst)):
+                logger.info('adding route to: %s' % name)
+                route_msgs.append(netlink.new_route(route))
+            if (changed is not None and
+                    len(link_msgs) + len(addr_msgs) + len(route_msgs) >
+                    count):
+                changed.add(name)
+        return link_msgs + addr_msgs + route_msgs
+
+    def plan(self):
+        sock = netlink.RtnlSocket()
+        try:
+            links = dict((link.name, link) for link in sock.get_links())
+            addresses = sock.get_addresses()
+            routes = sock.get_routes()
+        finally:
+            sock.close()
+        # VLANs which do not exist yet are planned against a placeholder
+        # link, creating them never disrupts an existing device
+        for name, obj in self.links.items():
+            if name not in links and isinstance(obj, objects.Vlan):
+                links[name] = netlink.Link(-1, name, 0, None, 'vlan', None,
+                                           obj.vlan_id)
+        changed = set()
+        self._configMessages(links, addresses, routes, changed)
+        return self._buildPlan([], [], list(changed))
+
+    def apply(self):
+        logger.info('applying network configs...')
+        sock = netlink.RtnlSocket()
+        try:
+            with utils.timings.phase('netlink_dump'):
+                links = dict((link.name, link) for link in sock.get_links())
+                addresses = sock.get_addresses()
+                routes = sock.get_routes()
+
+            with utils.timings.phase('netlink_apply'):
+                messages = self._linkMessages(links)
+                if messages:
+                    sock.batch(messages)
+                    links = dict((link.name, link)
+                                 for link in sock.get_links())
+
+            with utils.timings.phase('diff'):
+                messages = self._configMessages(links, addresses, routes)
+            if messages:
+                logger.info('sending %i netlink messages' % len(messages))
+                with utils.timings.phase('netlink_apply'):
+                    sock.batch(messages)
+            else:
+                logger.info('No changes required.')
+        finally:
+            sock.close()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Work out which objects changed since the last applied config.
+
+Every object of a network_config, members included, is keyed by type and
+name and fingerprinted from its JSON. A member only contributes its key to
+its parent's fingerprint, so changing one VLAN of a bridge leaves the
+bridge alone, while adding or removing a member does not. Comparing with
+the fingerprints saved in the state file gives the devices to rebuild, plus
+every device stacked on top of them.
+
+Fingerprints follow the key order of the decoded JSON, reordering the keys
+of an object at worst rebuilds it for nothing.
+"""
+
+import collections
+
+from os_net_config import objects
+from os_net_config import utils
+
+
+Node = collections.namedtuple('Node', 'names fingerprint dependencies')
+
+
+def _vlan_names(obj_json):
+    if obj_json.get('type') == 'vlan':
+        try:
+            return ['vlan%i' % int(obj_json.get('vlan_id'))]
+        except (TypeError, ValueError):
+            return []
+    try:
+        vlan_ids = objects.parse_vlan_ids(obj_json.get('vlan_ids'))
+    except objects.InvalidConfigException:
+        return []
+    return ['vlan%i' % vlan_id for start, end in vlan_ids
+            for vlan_id in range(start, end + 1)]
+
+
+def _node_key(obj_json):
+    if not isinstance(obj_json, dict):
+        return 'invalid:%s' % utils.structural_hash(obj_json)
+    obj_type = obj_json.get('type')
+    if obj_type == 'vlan_range':
+        name = '%s:%s' % (obj_json.get('device'), obj_json.get('vlan_ids'))
+    elif obj_type == 'vlan':
+        name = obj_json.get('vlan_id')
+    else:
+        name = obj_json.get('name')
+    return '%s:%s' % (obj_type, name)
+
+
+def fingerprint_nodes(iface_array):
+    """Fingerprint every object of a network_config.
+
+       Returns a dict of key -> Node and, for each top level entry, the
+       keys of the objects it holds.
+    """
+    nodes = {}
+    tops = []
+
+    def _add(obj_json, parent, parent_key, keys):
+        key = _node_key(obj_json)
+        keys.append(key)
+        if not isinstance(obj_json, dict):
+            nodes[key] = Node([], key, [])
+            return
+        if obj_json.get('type') in ('vlan', 'vlan_range'):
+            names = _vlan_names(obj_json)
+        else:
+            names = [obj_json.get('name')]
+        members = obj_json.get('members')
+        if not isinstance(members, list):
+            members = []
+        node_json = dict(obj_json, parent=parent_key)
+        if members:
+            node_json['members'] = [_node_key(member) for member in members]
+        dependencies = [name for name in (parent, obj_json.get('device'))
+                        if name]
+        nodes[key] = Node(names, utils.structural_hash(node_json),
+                          dependencies)
+        for member in members:
+            _add(member, obj_json.get('name'), key, keys)
+
+    for obj_json in iface_array:
+        keys = []
+        _add(obj_json, None, None, keys)
+        tops.append(keys)
+    return nodes, tops
+
+
+def rebuild_set(nodes, tops, previous):
+    """Return the device names to rebuild and the top level entries to load.
+
+       previous maps keys to the fingerprints of the last applied config.
+    """
+    dependents = {}
+    changed = set()
+    for key, node in nodes.items():
+        for dependency in node.dependencies:
+            dependents.setdefault(dependency, set()).update(node.names)
+        if previous.get(key) != node.fingerprint:
+            changed.add(key)
+
+    names = set()
+    pending = [name for key in changed for name in nodes[key].names]
+    while pending:
+        name = pending.pop()
+        if name not in names:
+            names.add(name)
+            pending.extend(dependents.get(name, ()))
+
+    indexes = set(i for i, keys in enumerate(tops)
+                  for key in keys
+                  if key in changed or names.intersection(nodes[key].names))
+    return names, indexes
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Minimal rtnetlink client used by the iproute provider.
+
+Only the handful of messages needed to manage links, VLANs, addresses and
+routes are implemented. Requests are batched so that many messages go to
+the kernel in a single send() call.
+"""
+
+import collections
+import errno
+import logging
+import os
+import socket
+import struct
+
+
+logger = logging.getLogger(__name__)
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_LINK = 5
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_VLAN_ID = 1
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+
+IFF_UP = 0x1
+
+RT_TABLE_MAIN = 254
+RTPROT_STATIC = 4
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+
+_NLMSGHDR = struct.Struct('IHHII')
+_NLMSGERR = struct.Struct('i')
+_RTATTR = struct.Struct('HH')
+_IFINFOMSG = struct.Struct('BxHiII')
+_IFADDRMSG = struct.Struct('BBBBI')
+_RTMSG = struct.Struct('BBBBBBBBI')
+
+# NOTE: keep each send() well below the default socket buffer sizes so the
+# acks for one chunk always fit in the receive buffer.
+_BATCH_SIZE = 32768
+_RECV_SIZE = 65536
+
+Link = collections.namedtuple('Link', 'index name flags mtu kind link '
+                                      'vlan_id')
+Addr = collections.namedtuple('Addr', 'index family address prefixlen '
+                                      'scope')
+Route = collections.namedtuple('Route', 'family dst dst_len gateway oif '
+                                        'table protocol')
+
+
+class NetlinkError(Exception):
+    def __init__(self, message, code=None):
+        super(NetlinkError, self).__init__(message)
+        self.code = code
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type, data):
+    length = _RTATTR.size + len(data)
+    return (_RTATTR.pack(length, attr_type) + data +
+            b'\0' * (_align(length) - length))
+
+
+def parse_attrs(data, offset=0):
+    attrs = {}
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _attr_string(value):
+    return value.split(b'\0', 1)[0].decode('utf-8')
+
+
+def build_message(msg_type, flags, seq, payload):
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type,
+                          flags | NLM_F_REQUEST, seq, 0) + payload
+
+
+def parse_messages(data):
+    """Yield (type, flags, seq, body) for each message in a buffer."""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, pid = _NLMSGHDR.unpack_from(data,
+                                                                  offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield (msg_type, flags, seq,
+               data[offset + _NLMSGHDR.size:offset + length])
+        offset += _align(length)
+
+
+def new_vlan(name, parent_index, vlan_id):
+    linkinfo = (pack_attr(IFLA_INFO_KIND, b'vlan') +
+                pack_attr(IFLA_INFO_DATA,
+                          pack_attr(IFLA_VLAN_ID,
+                                    struct.pack('H', vlan_id))))
+    payload = (_IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) +
+               pack_attr(IFLA_IFNAME, name.encode('utf-8') + b'\0') +
+               pack_attr(IFLA_LINK, struct.pack('i', parent_index)) +
+               pack_attr(IFLA_LINKINFO, linkinfo))
+    return RTM_NEWLINK, NLM_F_CREATE | NLM_F_EXCL, payload
+
+
+def set_link(index, mtu=None, up=True):
+    payload = _IFINFOMSG.pack(socket.AF_UNSPEC, 0, index,
+                              IFF_UP if up else 0, IFF_UP)
+    if mtu is not None:
+        payload += pack_attr(IFLA_MTU, struct.pack('I', mtu))
+    return RTM_NEWLINK, 0, payload
+
+
+def _addr_message(msg_type, flags, addr):
+    payload = (_IFADDRMSG.pack(addr.family, addr.prefixlen, 0,
+                               RT_SCOPE_UNIVERSE, addr.index) +
+               pack_attr(IFA_LOCAL, addr.address) +
+               pack_attr(IFA_ADDRESS, addr.address))
+    return msg_type, flags, payload
+
+
+def new_addr(addr):
+    return _addr_message(RTM_NEWADDR, NLM_F_CREATE | NLM_F_REPLACE, addr)
+
+
+def del_addr(addr):
+    return _addr_message(RTM_DELADDR, 0, addr)
+
+
+def _route_message(msg_type, flags, route):
+    scope = RT_SCOPE_UNIVERSE if route.gateway else RT_SCOPE_LINK
+    payload = _RTMSG.pack(route.family, route.dst_len, 0, 0, route.table,
+                          route.protocol, scope, RTN_UNICAST, 0)
+    if route.dst:
+        payload += pack_attr(RTA_DST, route.dst)
+    if route.gateway:
+        payload += pack_attr(RTA_GATEWAY, route.gateway)
+    payload += pack_attr(RTA_OIF, struct.pack('i', route.oif))
+    return msg_type, flags, payload
+
+
+def new_route(route):
+    return _route_message(RTM_NEWROUTE, NLM_F_CREATE | NLM_F_REPLACE, route)
+
+
+def del_route(route):
+    return _route_message(RTM_DELROUTE, 0, route)
+
+
+def parse_link(body):
+    family, dev_type, index, flags, change = _IFINFOMSG.unpack_from(body)
+    attrs = parse_attrs(body, _IFINFOMSG.size)
+    kind = None
+    vlan_id = None
+    linkinfo = parse_attrs(attrs.get(IFLA_LINKINFO, b''))
+    if IFLA_INFO_KIND in linkinfo:
+        kind = _attr_string(linkinfo[IFLA_INFO_KIND])
+        info_data = parse_attrs(linkinfo.get(IFLA_INFO_DATA, b''))
+        if kind == 'vlan' and IFLA_VLAN_ID in info_data:
+            vlan_id = struct.unpack('H', info_data[IFLA_VLAN_ID][:2])[0]
+    link = None
+    if IFLA_LINK in attrs:
+        link = struct.unpack('i', attrs[IFLA_LINK][:4])[0]
+    mtu = None
+    if IFLA_MTU in attrs:
+        mtu = struct.unpack('I', attrs[IFLA_MTU][:4])[0]
+    return Link(index, _attr_string(attrs.get(IFLA_IFNAME, b'')), flags,
+                mtu, kind, link, vlan_id)
+
+
+def parse_addr(body):
+    family, prefixlen, flags, scope, index = _IFADDRMSG.unpack_from(body)
+    attrs = parse_attrs(body, _IFADDRMSG.size)
+    address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    return Addr(index, family, address, prefixlen, scope)
+
+
+def parse_route(body):
+    (family, dst_len, src_len, tos, table, protocol, scope, rt_type,
+     flags) = _RTMSG.unpack_from(body)
+    attrs = parse_attrs(body, _RTMSG.size)
+    if RTA_TABLE in attrs:
+        table = struct.unpack('I', attrs[RTA_TABLE][:4])[0]
+    oif = None
+    if RTA_OIF in attrs:
+        oif = struct.unpack('i', attrs[RTA_OIF][:4])[0]
+    return Route(family, attrs.get(RTA_DST), dst_len, attrs.get(RTA_GATEWAY),
+                 oif, table, protocol)
+
+
+class RtnlSocket(object):
+    """A NETLINK_ROUTE socket which dumps state and sends batches."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    def _next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def _dump(self, msg_type, payload, parse):
+        seq = self._next_seq()
+        self.sock.send(build_message(msg_type, NLM_F_DUMP, seq, payload))
+        results = []
+        while True:
+            data = self.sock.recv(_RECV_SIZE)
+            for msg_type, flags, msg_seq, body in parse_messages(data):
+                if msg_seq != seq:
+                    continue
+                if msg_type == NLMSG_DONE:
+                    return results
+                if msg_type == NLMSG_ERROR:
+                    code = -_NLMSGERR.unpack_from(body)[0]
+                    raise NetlinkError('netlink dump failed: %s' %
+                                       os.strerror(code), code)
+                results.append(parse(body))
+
+    def get_links(self):
+        return self._dump(RTM_GETLINK,
+                          _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0),
+                          parse_link)
+
+    def get_addresses(self):
+        return self._dump(RTM_GETADDR,
+                          _IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0),
+                          parse_addr)
+
+    def get_routes(self):
+        return self._dump(RTM_GETROUTE,
+                          _RTMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0, 0,
+                                      0),
+                          parse_route)
+
+    def _wait_acks(self, pending):
+        errors = []
+        while pending:
+            data = self.sock.recv(_RECV_SIZE)
+            for msg_type, flags, seq, body in parse_messages(data):
+                if msg_type != NLMSG_ERROR or seq not in pending:
+                    continue
+                code = -_NLMSGERR.unpack_from(body)[0]
+                description = pending.pop(seq)
+                if code:
+                    errors.append('%s: %s' % (description,
+                                              os.strerror(code)))
+        return errors
+
+    def batch(self, messages):
+        """Send (type, flags, payload) messages, many per send() call.
+
+           Every message requests an ack, all of them are sent even if
+           some fail and a NetlinkError listing the failures is raised at
+           the end.
+        """
+        errors = []
+        buf = b''
+        pending = {}
+        for msg_type, flags, payload in messages:
+            seq = self._next_seq()
+            msg = build_message(msg_type, flags | NLM_F_ACK, seq, payload)
+            if buf and len(buf) + len(msg) > _BATCH_SIZE:
+                self.sock.send(buf)
+                errors.extend(self._wait_acks(pending))
+                buf = b''
+            buf += msg
+            pending[seq] = 'netlink message %i (type %i)' % (seq, msg_type)
+        if buf:
+            self.sock.send(buf)
+            errors.extend(self._wait_acks(pending))
+        if errors:
+            raise NetlinkError('netlink request failed: %s' %
+                               '; '.join(errors), errno.EIO)
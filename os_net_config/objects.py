@@ -14,24 +14,176 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import socket
+import struct
+
 import netaddr
 from openstack.common import strutils
 
+from os_net_config import utils
+
 
 class InvalidConfigException(ValueError):
     pass
 
 
+# NOTE: other object types can be added through the os_net_config.objects
+# entry point, they need a from_json() staticmethod and may set a schema
+# attribute for the validator.
+object_types = utils.Registry('os_net_config.objects', {
+    'interface': 'os_net_config.objects.Interface',
+    'vlan': 'os_net_config.objects.Vlan',
+    'ovs_bridge': 'os_net_config.objects.OvsBridge',
+    'ovs_bond': 'os_net_config.objects.OvsBond',
+    'vlan_range': 'os_net_config.objects.VlanRange',
+})
+
+
 def object_from_json(json):
-    obj_type = json.get("type")
-    if obj_type == "interface":
-        return Interface.from_json(json)
-    elif obj_type == "vlan":
-        return Vlan.from_json(json)
-    elif obj_type == "ovs_bridge":
-        return OvsBridge.from_json(json)
-    elif obj_type == "ovs_bond":
-        return OvsBond.from_json(json)
+    """Build an object from its JSON and freeze it."""
+    obj = _object_from_json(json)
+    if isinstance(obj, _Immutable):
+        obj.freeze()
+    return obj
+
+
+def _object_from_json(json):
+    # NOTE: members are built unfrozen, their parent still sets
+    # bridge_name on them before the whole tree is frozen.
+    obj_class = object_types.get(json.get("type"))
+    if obj_class is not None:
+        return obj_class.from_json(json)
+
+
+def _mtu_from_json(json):
+    mtu = json.get('mtu', 1500)
+    try:
+        return int(mtu)
+    except (TypeError, ValueError):
+        raise InvalidConfigException('Invalid MTU: %s' % mtu)
+
+
+def _member_from_json(json, parent):
+    # a VlanRange has no single device to attach to the parent
+    if json.get('type') == 'vlan_range':
+        msg = 'vlan_range is not allowed as a member of %s' % parent
+        raise InvalidConfigException(msg)
+    return _object_from_json(json)
+
+
+def _format_ip(value, version):
+    if version == 4:
+        return socket.inet_ntoa(struct.pack('!I', value))
+    return str(netaddr.IPAddress(value, version))
+
+
+class ParsedNetwork(collections.namedtuple('ParsedNetwork',
+                                           'value prefixlen version')):
+    """An immutable parsed ip/prefix, shared through parse_network().
+
+       Only integers are stored, the string forms are built on demand.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ip(self):
+        return _format_ip(self.value, self.version)
+
+    @property
+    def _mask(self):
+        width = 32 if self.version == 4 else 128
+        return ((1 << width) - 1) ^ ((1 << (width - self.prefixlen)) - 1)
+
+    @property
+    def netmask(self):
+        return _format_ip(self._mask, self.version)
+
+    @property
+    def network(self):
+        return _format_ip(self.value & self._mask, self.version)
+
+    @property
+    def packed(self):
+        return netaddr.IPAddress(self.value, self.version).packed
+
+    @property
+    def network_packed(self):
+        return netaddr.IPAddress(self.value & self._mask,
+                                 self.version).packed
+
+
+# NOTE: configs tend to repeat the same prefixes and gateways across many
+# VLANs, so parsed values are shared process wide.
+_network_cache = utils.LRUCache('network', 8192)
+
+
+def parse_network(ip_netmask):
+    """Parse an ip or ip/prefix string, memoized in a bounded cache."""
+    parsed = _network_cache.get(ip_netmask)
+    if parsed is None:
+        ip_nw = netaddr.IPNetwork(ip_netmask)
+        parsed = ParsedNetwork(int(ip_nw.ip), ip_nw.prefixlen,
+                               ip_nw.version)
+        _network_cache.set(ip_netmask, parsed)
+    return parsed
+
+
+_slots_cache = {}
+
+
+def _all_slots(cls):
+    slots = _slots_cache.get(cls)
+    if slots is None:
+        slots = tuple(slot for klass in reversed(cls.__mro__)
+                      for slot in klass.__dict__.get('__slots__', ()))
+        _slots_cache[cls] = slots
+    return slots
+
+
+class _Immutable(object):
+    """Base class for config objects which are frozen once built.
+
+       freeze() turns lists into tuples, freezes the child objects and
+       makes any later assignment fail. The structural hash only depends
+       on the object's contents, so it is stable across processes.
+    """
+
+    __slots__ = ('_frozen', '_hash')
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('%s objects are immutable' %
+                                 type(self).__name__)
+        object.__setattr__(self, name, value)
+
+    def freeze(self):
+        object.__setattr__(self, '_frozen', True)
+        return self
+
+    # NOTE: slots are pickled as a plain tuple, which keeps the compiled
+    # config cache small and bypasses __setattr__ on frozen objects.
+    def __getstate__(self):
+        return tuple(getattr(self, slot, None)
+                     for slot in _all_slots(type(self)))
+
+    def __setstate__(self, state):
+        for slot, value in zip(_all_slots(type(self)), state):
+            object.__setattr__(self, slot, value)
+
+    def _key(self):
+        """Return the JSON serializable contents of the object."""
+        raise NotImplementedError()
+
+    @property
+    def structural_hash(self):
+        digest = getattr(self, '_hash', None)
+        if digest is None:
+            digest = utils.structural_hash(self._key())
+            if getattr(self, '_frozen', False):
+                object.__setattr__(self, '_hash', digest)
+        return digest
 
 
 def _get_required_field(json, name, object_name):
@@ -43,14 +195,27 @@ def _get_required_field(json, name, object_name):
     return field
 
 
-class Route(object):
+class Route(_Immutable):
     """Base class for network routes."""
 
+    __slots__ = ('next_hop', 'ip_netmask', 'default')
+
     def __init__(self, next_hop, ip_netmask="", default=False):
         self.next_hop = next_hop
         self.ip_netmask = ip_netmask
         self.default = default
 
+    def _key(self):
+        return ('Route', self.next_hop, self.ip_netmask, self.default)
+
+    @property
+    def network(self):
+        return parse_network(self.ip_netmask)
+
+    @property
+    def gateway(self):
+        return parse_network(self.next_hop)
+
     @staticmethod
     def from_json(json):
         next_hop = _get_required_field(json, 'next_hop', 'Route')
@@ -59,15 +224,44 @@ class Route(object):
         return Route(next_hop, ip_netmask, default)
 
 
-class Address(object):
-    """Base class for network addresses."""
+class Address(_Immutable):
+    """Base class for network addresses.
+
+       The address is kept as a shared ParsedNetwork holding integers, the
+       string forms are only built when a renderer asks for them.
+    """
+
+    __slots__ = ('parsed',)
 
     def __init__(self, ip_netmask):
-        self.ip_netmask = ip_netmask
-        ip_nw = netaddr.IPNetwork(self.ip_netmask)
-        self.ip = str(ip_nw.ip)
-        self.netmask = str(ip_nw.netmask)
-        self.version = ip_nw.version
+        self.parsed = parse_network(ip_netmask)
+
+    def _key(self):
+        return ('Address', self.parsed)
+
+    @property
+    def value(self):
+        return self.parsed.value
+
+    @property
+    def prefixlen(self):
+        return self.parsed.prefixlen
+
+    @property
+    def version(self):
+        return self.parsed.version
+
+    @property
+    def ip(self):
+        return self.parsed.ip
+
+    @property
+    def netmask(self):
+        return self.parsed.netmask
+
+    @property
+    def ip_netmask(self):
+        return '%s/%i' % (self.ip, self.prefixlen)
 
     @staticmethod
     def from_json(json):
@@ -75,13 +269,17 @@ class Address(object):
         return Address(ip_netmask)
 
 
-class _BaseOpts(object):
+class _BaseOpts(_Immutable):
     """Base abstraction for logical port options."""
 
+    __slots__ = ('name', 'mtu', 'use_dhcp', 'use_dhcpv6', '_addresses',
+                 '_v4_addresses', '_v6_addresses', 'routes', 'bridge_name',
+                 'ovs_port')
+
     def __init__(self, name, use_dhcp=False, use_dhcpv6=False, addresses=[],
                  routes=[], mtu=1500):
         self.name = name
-        self.mtu = mtu
+        self.mtu = int(mtu)
         self.use_dhcp = use_dhcp
         self.use_dhcpv6 = use_dhcpv6
         self.addresses = addresses
@@ -89,28 +287,57 @@ class _BaseOpts(object):
         self.bridge_name = None
         self.ovs_port = False
 
-    def v4_addresses(self):
-        v4_addresses = []
-        for addr in self.addresses:
-            if addr.version == 4:
-                v4_addresses.append(addr)
+    @property
+    def addresses(self):
+        return self._addresses
+
+    @addresses.setter
+    def addresses(self, addresses):
+        # NOTE: the v4/v6 partition is computed once here, assign a new
+        # list rather than changing the old one in place.
+        self._addresses = addresses
+        self._v4_addresses = tuple(a for a in addresses if a.version == 4)
+        self._v6_addresses = tuple(a for a in addresses if a.version == 6)
+
+    def freeze(self):
+        if not getattr(self, '_frozen', False):
+            object.__setattr__(self, '_addresses', tuple(self._addresses))
+            object.__setattr__(self, 'routes', tuple(self.routes))
+            for child in self._addresses + self.routes:
+                child.freeze()
+            super(_BaseOpts, self).freeze()
+        return self
+
+    def _key(self):
+        return (type(self).__name__, self.name, self.mtu, self.use_dhcp,
+                self.use_dhcpv6, [addr._key() for addr in self._addresses],
+                [route._key() for route in self.routes], self.bridge_name,
+                self.ovs_port)
 
-        return v4_addresses
+    def v4_addresses(self):
+        return self._v4_addresses
 
     def v6_addresses(self):
-        v6_addresses = []
-        for addr in self.addresses:
-            if addr.version == 6:
-                v6_addresses.append(addr)
+        return self._v6_addresses
+
+    @property
+    def first_v4(self):
+        return self._v4_addresses[0] if self._v4_addresses else None
 
-        return v6_addresses
+    @property
+    def first_v6(self):
+        return self._v6_addresses[0] if self._v6_addresses else None
+
+    @property
+    def has_static(self):
+        return bool(self._addresses)
 
     @staticmethod
     def base_opts_from_json(json):
         use_dhcp = strutils.bool_from_string(str(json.get('use_dhcp', False)))
         use_dhcpv6 = strutils.bool_from_string(str(json.get('use_dhcpv6',
                                                False)))
-        mtu = json.get('mtu', 1500)
+        mtu = _mtu_from_json(json)
         addresses = []
         routes = []
 
@@ -140,6 +367,8 @@ class _BaseOpts(object):
 class Interface(_BaseOpts):
     """Base class for network interfaces."""
 
+    __slots__ = ()
+
     def __init__(self, name, use_dhcp=False, use_dhcpv6=False, addresses=[],
                  routes=[], mtu=1500):
         super(Interface, self).__init__(name, use_dhcp, use_dhcpv6, addresses,
@@ -159,25 +388,150 @@ class Vlan(_BaseOpts):
        matches the vlan ID being used. Example: vlan5
     """
 
+    __slots__ = ('vlan_id', 'device')
+
     def __init__(self, device, vlan_id, use_dhcp=False, use_dhcpv6=False,
                  addresses=[], routes=[], mtu=1500):
+        vlan_id = int(vlan_id)
         name = 'vlan%i' % vlan_id
         super(Vlan, self).__init__(name, use_dhcp, use_dhcpv6, addresses,
                                    routes, mtu)
-        self.vlan_id = int(vlan_id)
+        self.vlan_id = vlan_id
         self.device = device
 
+    def _key(self):
+        return super(Vlan, self)._key() + (self.vlan_id, self.device)
+
     @staticmethod
     def from_json(json):
         device = _get_required_field(json, 'device', 'Vlan')
         vlan_id = _get_required_field(json, 'vlan_id', 'Vlan')
+        try:
+            vlan_id = int(vlan_id)
+        except (TypeError, ValueError):
+            raise InvalidConfigException('Invalid VLAN ID: %s' % vlan_id)
         opts = _BaseOpts.base_opts_from_json(json)
         return Vlan(device, vlan_id, *opts)
 
 
+def parse_vlan_ids(value):
+    """Parse '100-199,300' into ((100, 199), (300, 300))."""
+    ranges = []
+    for part in str(value).split(','):
+        start, sep, end = part.strip().partition('-')
+        try:
+            start = int(start)
+            end = int(end) if sep else start
+        except ValueError:
+            raise InvalidConfigException('Invalid VLAN range: %s' % part)
+        if not 1 <= start <= end <= 4094:
+            raise InvalidConfigException('Invalid VLAN range: %s' % part)
+        ranges.append((start, end))
+    return tuple(ranges)
+
+
+def template_fields(vlan_id, index):
+    """Return the fields available to vlan_range templates."""
+    return {'vlan_id': vlan_id, 'index': index,
+            'vlan_id_hi': vlan_id >> 8, 'vlan_id_lo': vlan_id & 0xff}
+
+
+class VlanRange(_Immutable):
+    """A compact range of VLANs sharing a device and settings.
+
+       Address and route strings are templates formatted for each VLAN
+       with template_fields(), e.g. 10.{vlan_id_hi}.{vlan_id_lo}.2/24.
+       The Vlan objects are only built by expand(), one at a time.
+    """
+
+    __slots__ = ('device', 'vlan_ids', 'use_dhcp', 'use_dhcpv6', 'mtu',
+                 'addresses', 'routes')
+
+    def __init__(self, device, vlan_ids, use_dhcp=False, use_dhcpv6=False,
+                 addresses=(), routes=(), mtu=1500):
+        self.device = device
+        self.vlan_ids = vlan_ids
+        self.use_dhcp = use_dhcp
+        self.use_dhcpv6 = use_dhcpv6
+        self.mtu = int(mtu)
+        self.addresses = tuple(addresses)
+        self.routes = tuple(routes)
+
+    def _key(self):
+        return ('VlanRange', self.device, self.vlan_ids, self.use_dhcp,
+                self.use_dhcpv6, self.mtu, self.addresses, self.routes)
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.vlan_ids)
+
+    def expand(self):
+        """Yield a Vlan for each id in the range."""
+        index = 0
+        for start, end in self.vlan_ids:
+            for vlan_id in range(start, end + 1):
+                fields = template_fields(vlan_id, index)
+                try:
+                    addresses = [Address(addr.format(**fields))
+                                 for addr in self.addresses]
+                    routes = [Route(next_hop.format(**fields),
+                                    ip_netmask.format(**fields), default)
+                              for next_hop, ip_netmask, default
+                              in self.routes]
+                except (netaddr.AddrFormatError, KeyError, IndexError,
+                        ValueError) as e:
+                    raise InvalidConfigException(
+                        'Invalid address or route for VLAN %i: %s' %
+                        (vlan_id, e))
+                yield Vlan(self.device, vlan_id, self.use_dhcp,
+                           self.use_dhcpv6, addresses, routes,
+                           self.mtu).freeze()
+                index += 1
+
+    @staticmethod
+    def from_json(json):
+        device = _get_required_field(json, 'device', 'VlanRange')
+        vlan_ids = parse_vlan_ids(_get_required_field(json, 'vlan_ids',
+                                                      'VlanRange'))
+        use_dhcp = strutils.bool_from_string(str(json.get('use_dhcp', False)))
+        use_dhcpv6 = strutils.bool_from_string(str(json.get('use_dhcpv6',
+                                               False)))
+        mtu = _mtu_from_json(json)
+        addresses = []
+        routes = []
+
+        addresses_json = json.get('addresses')
+        if addresses_json:
+            if isinstance(addresses_json, list):
+                for address in addresses_json:
+                    addresses.append(_get_required_field(
+                        address, 'ip_netmask', 'Address'))
+            else:
+                msg = 'Addresses must be a list.'
+                raise InvalidConfigException(msg)
+
+        routes_json = json.get('routes')
+        if routes_json:
+            if isinstance(routes_json, list):
+                for route in routes_json:
+                    next_hop = _get_required_field(route, 'next_hop',
+                                                   'Route')
+                    default = strutils.bool_from_string(
+                        str(route.get('default', False)))
+                    routes.append((next_hop, route.get('ip_netmask', ""),
+                                   default))
+            else:
+                msg = 'Routes must be a list.'
+                raise InvalidConfigException(msg)
+
+        return VlanRange(device, vlan_ids, use_dhcp, use_dhcpv6, addresses,
+                         routes, mtu)
+
+
 class OvsBridge(_BaseOpts):
     """Base class for OVS bridges."""
 
+    __slots__ = ('members', 'ovs_options')
+
     def __init__(self, name, use_dhcp=False, use_dhcpv6=False, addresses=[],
                  routes=[], mtu=1500, members=[], ovs_options=None):
         super(OvsBridge, self).__init__(name, use_dhcp, use_dhcpv6, addresses,
@@ -188,6 +542,18 @@ class OvsBridge(_BaseOpts):
             member.bridge_name = name
             member.ovs_port = True
 
+    def freeze(self):
+        if not getattr(self, '_frozen', False):
+            object.__setattr__(self, 'members', tuple(self.members))
+            for member in self.members:
+                member.freeze()
+        return super(OvsBridge, self).freeze()
+
+    def _key(self):
+        return super(OvsBridge, self)._key() + (
+            self.ovs_options,
+            [member.structural_hash for member in self.members])
+
     @staticmethod
     def from_json(json):
         name = _get_required_field(json, 'name', 'OvsBridge')
@@ -200,7 +566,7 @@ class OvsBridge(_BaseOpts):
         if members_json:
             if isinstance(members_json, list):
                 for member in members_json:
-                    members.append(object_from_json(member))
+                    members.append(_member_from_json(member, 'OvsBridge'))
             else:
                 msg = 'Members must be a list.'
                 raise InvalidConfigException(msg)
@@ -211,6 +577,8 @@ class OvsBridge(_BaseOpts):
 class OvsBond(_BaseOpts):
     """Base class for OVS bonds."""
 
+    __slots__ = ('members', 'ovs_options')
+
     def __init__(self, name, use_dhcp=False, use_dhcpv6=False, addresses=[],
                  routes=[], mtu=1500, members=[], ovs_options=None):
         super(OvsBond, self).__init__(name, use_dhcp, use_dhcpv6, addresses,
@@ -218,6 +586,18 @@ class OvsBond(_BaseOpts):
         self.members = members
         self.ovs_options = ovs_options
 
+    def freeze(self):
+        if not getattr(self, '_frozen', False):
+            object.__setattr__(self, 'members', tuple(self.members))
+            for member in self.members:
+                member.freeze()
+        return super(OvsBond, self).freeze()
+
+    def _key(self):
+        return super(OvsBond, self)._key() + (
+            self.ovs_options,
+            [member.structural_hash for member in self.members])
+
     @staticmethod
     def from_json(json):
         name = _get_required_field(json, 'name', 'OvsBond')
@@ -230,7 +610,7 @@ class OvsBond(_BaseOpts):
         if members_json:
             if isinstance(members_json, list):
                 for member in members_json:
-                    members.append(object_from_json(member))
+                    members.append(_member_from_json(member, 'OvsBond'))
             else:
                 msg = 'Members must be a list.'
                 raise InvalidConfigException(msg)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import fixtures
+import six
+
+from os_net_config import cli
+from os_net_config import impl_eni
+from os_net_config import impl_ifcfg
+from os_net_config import objects
+from os_net_config.openstack.common import processutils
+from os_net_config.tests import base
+
+
+class TestCliENI(base.TestCase):
+
+    def setUp(self):
+        super(TestCliENI, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.config_dir = os.path.join(self.temp_dir, 'network')
+        os.makedirs(os.path.join(self.config_dir, 'interfaces.d'))
+        self.stubs.Set(impl_eni, '_network_config_path',
+                       lambda: os.path.join(self.config_dir, 'interfaces'))
+        self.stubs.Set(impl_eni, '_fragment_path',
+                       lambda name: os.path.join(self.config_dir,
+                                                 'interfaces.d', name))
+        self.stubs.Set(impl_eni, '_route_batch_path',
+                       lambda name, action: os.path.join(
+                           self.config_dir, 'routes-%s.%s' % (name, action)))
+        self.commands = []
+
+        def test_execute(*args, **kwargs):
+            self.commands.append(args)
+        self.stubs.Set(processutils, 'execute', test_execute)
+
+        self.config_file = os.path.join(self.temp_dir, 'config.json')
+        with open(self.config_file, 'w') as f:
+            json.dump({'network_config': [
+                {'type': 'interface', 'name': 'eth0', 'use_dhcp': True},
+                {'type': 'interface', 'name': 'eth1'}]}, f)
+
+    def _main(self, *args):
+        return cli.main(['os-net-config', '-p', 'eni', '-c', self.config_file,
+                         '-s', os.path.join(self.temp_dir, 'state.json')] +
+                        list(args))
+
+    def test_switch_to_fragments(self):
+        self.assertEqual(0, self._main())
+        self.assertEqual([], os.listdir(os.path.join(self.config_dir,
+                                                     'interfaces.d')))
+        self.assertEqual(0, self._main('--eni-fragments'))
+        self.assertEqual(['eth0', 'eth1'], sorted(os.listdir(
+            os.path.join(self.config_dir, 'interfaces.d'))))
+
+
+_CONFIG = [
+    {'type': 'interface', 'name': 'em1',
+     'addresses': [{'ip_netmask': '192.0.2.1/24'}]},
+    {'type': 'ovs_bridge', 'name': 'br-ex', 'use_dhcp': True,
+     'members': [{'type': 'interface', 'name': 'em2'}]},
+]
+
+
+class TestCliIfcfg(base.TestCase):
+
+    def setUp(self):
+        super(TestCliIfcfg, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.scripts_dir = os.path.join(self.temp_dir, 'network-scripts')
+        os.makedirs(self.scripts_dir)
+
+        def test_path(prefix):
+            return lambda name: os.path.join(self.scripts_dir,
+                                             '%s-%s' % (prefix, name))
+        self.stubs.Set(impl_ifcfg, 'ifcfg_config_path', test_path('ifcfg'))
+        self.stubs.Set(impl_ifcfg, 'bridge_config_path', test_path('ifcfg'))
+        self.stubs.Set(impl_ifcfg, 'route_config_path', test_path('route'))
+        self.ifup_interface_names = []
+
+        def test_execute(*args, **kwargs):
+            if args[0] == '/sbin/ifup':
+                self.ifup_interface_names.append(args[1])
+        self.stubs.Set(processutils, 'execute', test_execute)
+
+        self.config_file = os.path.join(self.temp_dir, 'config.json')
+        self.state_file = os.path.join(self.temp_dir, 'state.json')
+        self._write_config(_CONFIG)
+
+    def _write_config(self, config):
+        with open(self.config_file, 'w') as f:
+            json.dump({'network_config': config}, f)
+
+    def _main(self, *args):
+        self.ifup_interface_names = []
+        return cli.main(['os-net-config', '-p', 'ifcfg', '-c',
+                         self.config_file, '-s', self.state_file] +
+                        list(args))
+
+    def _files(self):
+        files = {}
+        for name in os.listdir(self.scripts_dir):
+            with open(os.path.join(self.scripts_dir, name)) as f:
+                files[name] = f.read()
+        return files
+
+    def test_noop_rerun(self):
+        self.assertEqual(0, self._main())
+        self.assertEqual(['br-ex', 'em1', 'em2'],
+                         sorted(self.ifup_interface_names))
+        files = self._files()
+        self.assertEqual(0, self._main())
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertIn('No changes since the last run',
+                      self.log_fixture.output)
+        self.assertEqual(files, self._files())
+
+    def test_stream(self):
+        self.assertEqual(0, self._main('--no-state', '--no-cache'))
+        files = self._files()
+        shutil.rmtree(self.scripts_dir)
+        os.makedirs(self.scripts_dir)
+        self.assertEqual(0, self._main('--no-state', '--stream'))
+        self.assertEqual(files, self._files())
+        self.assertFalse(os.path.exists(self.config_file + '.cache'))
+
+    def test_one_object_changed(self):
+        self.assertEqual(0, self._main())
+        built = []
+        real_object_from_json = objects.object_from_json
+
+        def test_object_from_json(obj_json):
+            built.append(obj_json.get('name'))
+            return real_object_from_json(obj_json)
+        self.stubs.Set(objects, 'object_from_json', test_object_from_json)
+
+        config = [dict(_CONFIG[0], mtu=9000), _CONFIG[1]]
+        self._write_config(config)
+        self.assertEqual(0, self._main())
+        self.assertEqual(['em1'], built)
+        self.assertEqual(['em1'], self.ifup_interface_names)
+        self.assertIn('MTU=9000', self._files()['ifcfg-em1'])
+
+        # the files of the objects not rebuilt are still in the state
+        state = json.load(open(self.state_file))
+        self.assertEqual(sorted(self._files()),
+                         sorted(os.path.basename(path)
+                                for path in state['files']))
+        self.assertEqual(0, self._main())
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertIn('No changes since the last run',
+                      self.log_fixture.output)
+
+    def test_cache_hit(self):
+        self.assertEqual(0, self._main('--no-state'))
+        self.assertTrue(os.path.exists(self.config_file + '.cache'))
+        files = self._files()
+        shutil.rmtree(self.scripts_dir)
+        os.makedirs(self.scripts_dir)
+
+        def test_object_from_json(obj_json):
+            self.fail('object built despite the compiled cache')
+        self.stubs.Set(objects, 'object_from_json', test_object_from_json)
+        self.assertEqual(0, self._main('--no-state'))
+        self.assertIn('Using compiled config cache', self.log_fixture.output)
+        self.assertEqual(files, self._files())
+
+    def test_plan_writes_nothing(self):
+        stdout = six.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        self.assertEqual(0, self._main('--plan'))
+        plan = json.loads(stdout.getvalue())
+        self.assertEqual(['br-ex', 'em1', 'em2'], plan['restart'])
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertEqual(['config.json', 'network-scripts'],
+                         sorted(os.listdir(self.temp_dir)))
+        self.assertEqual({}, self._files())
@@ -14,6 +14,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import shutil
 import tempfile
 
 from os_net_config import impl_eni
@@ -66,8 +68,16 @@ iface vlan5 inet manual
     ovs_options tag=5
 """
 
-_RTS = """up route add -net 172.19.0.0 netmask 255.255.255.0 gw 192.168.1.1
-down route del -net 172.19.0.0 netmask 255.255.255.0 gw 192.168.1.1
+_RTS = """up ip -force -batch /etc/network/routes-eth0.up
+down ip -force -batch /etc/network/routes-eth0.down
+"""
+
+_RTS_UP = """route replace default via 192.168.1.254 dev eth0
+route replace 172.19.0.0/24 via 192.168.1.1 dev eth0
+"""
+
+_RTS_DOWN = """route del 172.19.0.0/24 via 192.168.1.1 dev eth0
+route del default via 192.168.1.254 dev eth0
 """
 
 
@@ -131,11 +141,17 @@ class TestENINetConfig(base.TestCase):
 
     def test_network_with_routes(self):
         route1 = objects.Route('192.168.1.1', '172.19.0.0/24')
+        route2 = objects.Route('192.168.1.254', default=True)
         v4_addr = objects.Address('192.168.1.2/24')
-        interface = self._default_interface([v4_addr], [route1])
+        interface = self._default_interface([v4_addr], [route1, route2])
         self.provider.addInterface(interface)
         self.assertEqual(_V4_IFACE_STATIC_IP, self.get_interface_config())
         self.assertEqual(_RTS, self.get_route_config())
+        self.assertEqual({'/etc/network/routes-eth0.up': _RTS_UP,
+                          '/etc/network/routes-eth0.down': _RTS_DOWN,
+                          '/etc/network/interfaces':
+                          _V4_IFACE_STATIC_IP + _RTS},
+                         self.provider.renderFiles())
 
     def test_network_ovs_bridge_with_dhcp(self):
         interface = self._default_interface()
@@ -169,9 +185,19 @@ class TestENINetConfigApply(base.TestCase):
         def test_config_path():
             return self.temp_config_file.name
         self.stubs.Set(impl_eni, '_network_config_path', test_config_path)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.stubs.Set(impl_eni, '_route_batch_path',
+                       lambda name, action: os.path.join(
+                           self.temp_dir, 'routes-%s.%s' % (name, action)))
+        self.commands = []
+
+        self.failing_commands = []
 
         def test_execute(*args, **kwargs):
-            pass
+            self.commands.append((args, kwargs.get('process_input')))
+            if args[0] in self.failing_commands:
+                raise processutils.ProcessExecutionError(exit_code=1)
         self.stubs.Set(processutils, 'execute', test_execute)
 
         self.provider = impl_eni.ENINetConfig()
@@ -180,16 +206,53 @@ class TestENINetConfigApply(base.TestCase):
         self.temp_config_file.close()
         super(TestENINetConfigApply, self).tearDown()
 
-    def test_network_apply(self):
-        route = objects.Route('192.168.1.1', '172.19.0.0/24')
+    def _routes_interface(self, next_hop='192.168.1.1'):
+        route1 = objects.Route(next_hop, '172.19.0.0/24')
+        route2 = objects.Route('192.168.1.254', default=True)
         v4_addr = objects.Address('192.168.1.2/24')
-        interface = objects.Interface('eth0', addresses=[v4_addr],
-                                      routes=[route])
-        self.provider.addInterface(interface)
+        return objects.Interface('eth0', addresses=[v4_addr],
+                                 routes=[route1, route2])
+
+    def test_network_apply(self):
+        self.provider.addInterface(self._routes_interface())
 
         self.provider.apply()
         iface_data = utils.get_file_data(self.temp_config_file.name)
-        self.assertEqual((_V4_IFACE_STATIC_IP + _RTS), iface_data)
+        self.assertEqual((_V4_IFACE_STATIC_IP +
+                          _RTS.replace('/etc/network', self.temp_dir)),
+                         iface_data)
+        self.assertEqual(_RTS_UP, utils.get_file_data(
+            os.path.join(self.temp_dir, 'routes-eth0.up')))
+        self.assertEqual(_RTS_DOWN, utils.get_file_data(
+            os.path.join(self.temp_dir, 'routes-eth0.down')))
+
+    def test_route_only_apply(self):
+        self.provider.addInterface(self._routes_interface())
+        self.provider.apply()
+        self.commands = []
+        provider = impl_eni.ENINetConfig()
+        provider.addInterface(self._routes_interface('192.168.1.2'))
+        self.assertEqual(['eth0'], provider.plan()['hot_update'])
+        provider.apply()
+        self.assertEqual([(('/sbin/ip', '-force', '-batch', '-'),
+                           'route del 172.19.0.0/24 via 192.168.1.1 dev '
+                           'eth0\nroute replace 172.19.0.0/24 via '
+                           '192.168.1.2 dev eth0\n')], self.commands)
+
+    def test_route_update_failure(self):
+        self.provider.addInterface(self._routes_interface())
+        self.provider.addInterface(objects.Interface('eth1'))
+        self.provider.apply()
+        self.commands = []
+        self.failing_commands.append('/sbin/ip')
+        provider = impl_eni.ENINetConfig()
+        provider.addInterface(self._routes_interface('192.168.1.2'))
+        provider.addInterface(objects.Interface('eth1', mtu=9000))
+        provider.apply()
+        self.assertEqual([('/sbin/ifdown', 'eth1'),
+                          ('/sbin/ip', '-force', '-batch', '-'),
+                          ('/sbin/ifup', 'eth1')],
+                         [args for args, process_input in self.commands])
 
     def test_dhcp_ovs_bridge_network_apply(self):
         interface = objects.Interface('eth0')
@@ -200,3 +263,151 @@ class TestENINetConfigApply(base.TestCase):
         self.provider.apply()
         iface_data = utils.get_file_data(self.temp_config_file.name)
         self.assertEqual((_OVS_BRIDGE_DHCP + _OVS_PORT_IFACE), iface_data)
+
+    def test_plan(self):
+        interface = objects.Interface('eth0')
+        self.provider.addObject(interface)
+        plan = self.provider.plan()
+        self.assertEqual([self.temp_config_file.name], plan['files'])
+        self.assertEqual(['eth0'], plan['restart'])
+        self.assertEqual({'eth0': None}, plan['estimated_downtime'])
+        self.assertEqual('', utils.get_file_data(self.temp_config_file.name))
+
+
+class TestENINetConfigFragments(base.TestCase):
+
+    def setUp(self):
+        super(TestENINetConfigFragments, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.config_file = os.path.join(self.temp_dir, 'interfaces')
+        self.stubs.Set(impl_eni, '_network_config_path',
+                       lambda: self.config_file)
+        self.stubs.Set(impl_eni, '_fragment_path',
+                       lambda name: os.path.join(self.temp_dir, name))
+        self.commands = []
+
+        def test_execute(*args, **kwargs):
+            self.commands.append(args)
+        self.stubs.Set(processutils, 'execute', test_execute)
+
+    def _apply(self, vlan_mtu=1500):
+        provider = impl_eni.ENINetConfig(fragments=True)
+        bridge = objects.OvsBridge('br0', use_dhcp=True, members=[
+            objects.Interface('eth0'), objects.Vlan('eth0', 5, mtu=vlan_mtu)])
+        provider.addObject(bridge.freeze())
+        self.commands = []
+        provider.apply()
+        return provider
+
+    def test_apply(self):
+        self._apply()
+        self.assertEqual(_OVS_BRIDGE_DHCP.replace(
+                         'ovs_ports eth0\n', 'ovs_ports eth0 vlan5\n') +
+                         '    pre-up ip addr flush dev vlan5\n',
+                         utils.get_file_data(os.path.join(self.temp_dir,
+                                                          'br0')))
+        self.assertEqual(_OVS_PORT_IFACE, utils.get_file_data(
+            os.path.join(self.temp_dir, 'eth0')))
+        self.assertEqual('source %s/br0\nsource %s/eth0\n'
+                         'source %s/vlan5\n' % ((self.temp_dir,) * 3),
+                         utils.get_file_data(self.config_file))
+
+    def test_one_device_changed(self):
+        self._apply()
+        provider = self._apply(vlan_mtu=9000)
+        self.assertEqual([('/sbin/ifdown', 'vlan5'), ('/sbin/ifup', 'vlan5')],
+                         self.commands)
+        self.assertEqual(['vlan5'], list(provider.ifup_timings))
+
+    def test_dependents_restarted(self):
+        self._apply()
+        utils.write_config(os.path.join(self.temp_dir, 'br0'), '')
+        self._apply()
+        self.assertEqual([('/sbin/ifdown', 'vlan5'),
+                          ('/sbin/ifdown', 'eth0'),
+                          ('/sbin/ifdown', 'br0'),
+                          ('/sbin/ifup', 'br0'),
+                          ('/sbin/ifup', 'eth0'),
+                          ('/sbin/ifup', 'vlan5')], self.commands)
+
+    def test_unchanged(self):
+        self._apply()
+        self._apply()
+        self.assertEqual([], self.commands)
+
+
+class TestParseStanzas(base.TestCase):
+
+    def test_layout_ignored(self):
+        data = ("# managed by hand\n"
+                "auto br0 eth0\nallow-br0 eth0\n"
+                "iface eth0   inet manual\n"
+                "  ovs_type OVSPort\n\tovs_bridge br0\n\n"
+                "iface br0 inet dhcp\n"
+                "    ovs_ports \\\n       eth0\n"
+                "    ovs_type OVSBridge\n"
+                "allow-ovs br0\n")
+        expected = impl_eni.parse_stanzas(
+            _OVS_BRIDGE_DHCP.replace('    pre-up ip addr flush dev eth0\n',
+                                     '') + _OVS_PORT_IFACE)
+        parsed = impl_eni.parse_stanzas(data)
+        self.assertEqual(expected, parsed)
+
+    def test_devices(self):
+        stanzas = impl_eni.parse_stanzas(_V4_IFACE_STATIC_IP + _RTS +
+                                         _VLAN_NO_IP)
+        self.assertEqual(['eth0', 'vlan5'], sorted(stanzas))
+        self.assertEqual((frozenset(['auto']), (('inet', 'static', (
+            'address 192.168.1.2',
+            'down ip -force -batch /etc/network/routes-eth0.down',
+            'netmask 255.255.255.0',
+            'up ip -force -batch /etc/network/routes-eth0.up')),)),
+            stanzas['eth0'])
+
+
+class TestENINetConfigTargetedRestart(base.TestCase):
+
+    def setUp(self):
+        super(TestENINetConfigTargetedRestart, self).setUp()
+        self.temp_config_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(self.temp_config_file.close)
+        self.stubs.Set(impl_eni, '_network_config_path',
+                       lambda: self.temp_config_file.name)
+        self.commands = []
+
+        def test_execute(*args, **kwargs):
+            self.commands.append(args)
+        self.stubs.Set(processutils, 'execute', test_execute)
+
+    def _plan(self, vlan_mtu=1500):
+        provider = impl_eni.ENINetConfig()
+        provider.addObject(objects.Interface('eth0'))
+        provider.addObject(objects.Vlan('eth0', 5, mtu=vlan_mtu))
+        provider.addObject(objects.Interface('eth1'))
+        return provider
+
+    def test_one_device_changed(self):
+        self._plan().apply()
+        self.commands = []
+        plan = self._plan(vlan_mtu=9000).plan()
+        self.assertEqual([self.temp_config_file.name], plan['files'])
+        self.assertEqual(['vlan5'], plan['restart'])
+
+    def test_dependents_restarted(self):
+        provider = impl_eni.ENINetConfig()
+        provider.addObject(objects.Interface('eth0', mtu=9000))
+        provider.addObject(objects.Vlan('eth0', 5))
+        provider.addObject(objects.Interface('eth1'))
+        provider.apply()
+        self.assertEqual(['eth0', 'vlan5'], self._plan().plan()['restart'])
+
+    def test_layout_only(self):
+        utils.write_config(self.temp_config_file.name,
+                           '# old header\n' + _v4_IFACE_NO_IP)
+        provider = impl_eni.ENINetConfig()
+        provider.addObject(objects.Interface('eth0'))
+        provider.apply()
+        self.assertEqual([], self.commands)
+        self.assertEqual(_v4_IFACE_NO_IP,
+                         utils.get_file_data(self.temp_config_file.name))
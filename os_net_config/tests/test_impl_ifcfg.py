@@ -16,6 +16,7 @@
 
 import tempfile
 
+import os_net_config
 from os_net_config import impl_ifcfg
 from os_net_config import objects
 from os_net_config.openstack.common import processutils
@@ -147,6 +148,13 @@ class TestIfcfgNetConfig(base.TestCase):
         self.assertEqual(_V4_IFCFG, self.get_interface_config())
         self.assertEqual(_ROUTES, self.get_route_config())
 
+    def test_default_route_first(self):
+        route1 = objects.Route('192.168.1.1', '172.19.0.0/24')
+        route2 = objects.Route('192.168.1.1', default=True)
+        interface = objects.Interface('em1', routes=[route1, route2])
+        self.provider.addInterface(interface)
+        self.assertEqual(_ROUTES, self.get_route_config())
+
     def test_network_ovs_bridge_with_dhcp(self):
         interface = objects.Interface('em1')
         bridge = objects.OvsBridge('br-ctlplane', use_dhcp=True,
@@ -162,6 +170,33 @@ class TestIfcfgNetConfig(base.TestCase):
         self.provider.addVlan(vlan)
         self.assertEqual(_VLAN_NO_IP, self.get_interface_config('vlan5'))
 
+    def test_add_vlan_range(self):
+        vlan_range = objects.VlanRange('em1', ((5, 6),))
+        self.provider.addObject(vlan_range)
+        self.assertEqual(_VLAN_NO_IP, self.get_interface_config('vlan5'))
+        self.assertEqual(_VLAN_NO_IP.replace('vlan5', 'vlan6'),
+                         self.get_interface_config('vlan6'))
+        self.assertEqual([['vlan5', 'vlan6']], self.provider.graph.levels())
+
+    def test_add_object_names(self):
+        bridge = objects.OvsBridge('br-ctlplane', members=[
+            objects.Interface('em1'), objects.Vlan('em1', 5)])
+        self.provider.addObject(bridge.freeze(), set(['vlan5']))
+        self.assertEqual(['vlan5'], list(self.provider.interfaces))
+        self.assertEqual({}, self.provider.bridges)
+        self.assertEqual([['br-ctlplane'], ['em1'], ['vlan5']],
+                         self.provider.graph.levels())
+
+    def test_render_cached(self):
+        render_cache = os_net_config._render_cache
+        render_cache.clear()
+        self.provider.addObject(objects.Vlan('em1', 5).freeze())
+        provider = impl_ifcfg.IfcfgNetConfig()
+        provider.addObject(objects.Vlan('em1', 5).freeze())
+        self.assertEqual(_VLAN_NO_IP, provider.interfaces['vlan5'])
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1},
+                         render_cache.stats())
+
     def test_add_vlan_ovs(self):
         vlan = objects.Vlan('em1', 5)
         vlan.ovs_port = True
@@ -216,8 +251,25 @@ class TestIfcfgNetConfigApply(base.TestCase):
             return self.temp_bridge_file.name
         self.stubs.Set(impl_ifcfg, 'bridge_config_path', test_bridge_path)
 
+        self.ifup_interface_names = []
+        self.ifdown_interface_names = []
+        self.commands = []
+        self.process_inputs = []
+        self.failing_commands = []
+        self.env = {}
+
         def test_execute(*args, **kwargs):
-            pass
+            self.commands.append(args)
+            if 'process_input' in kwargs:
+                self.process_inputs.append(kwargs['process_input'])
+            if 'env_variables' in kwargs:
+                self.env[args[1]] = kwargs['env_variables']
+            if args[0] in self.failing_commands:
+                raise processutils.ProcessExecutionError(exit_code=1)
+            if args[0] == '/sbin/ifup':
+                self.ifup_interface_names.append(args[1])
+            elif args[0] == '/sbin/ifdown':
+                self.ifdown_interface_names.append(args[1])
         self.stubs.Set(processutils, 'execute', test_execute)
 
         self.provider = impl_ifcfg.IfcfgNetConfig()
@@ -265,3 +317,120 @@ class TestIfcfgNetConfigApply(base.TestCase):
 
         ifcfg_data = utils.get_file_data(self.temp_ifcfg_file.name)
         self.assertEqual(_VLAN_NO_IP, ifcfg_data)
+
+    def test_ovs_bridge_ifup_order(self):
+        interface = objects.Interface('em1')
+        vlan = objects.Vlan('em1', 5)
+        bridge = objects.OvsBridge('br-ctlplane', use_dhcp=True,
+                                   members=[interface, vlan])
+        self.provider.addObject(bridge)
+        self.provider.apply()
+
+        self.assertEqual(['br-ctlplane', 'em1', 'vlan5'],
+                         self.ifup_interface_names)
+        self.assertEqual(['vlan5', 'em1', 'br-ctlplane'],
+                         self.ifdown_interface_names)
+        self.assertIn('vlan5', self.provider.ifup_timings)
+
+    def test_ovs_transaction_apply(self):
+        interface = objects.Interface('em1')
+        vlan = objects.Vlan('em1', 5)
+        bridge = objects.OvsBridge('br-ctlplane', use_dhcp=True,
+                                   members=[interface, vlan])
+        self.provider.ovs_transaction = True
+        self.provider.addObject(bridge)
+        self.provider.apply()
+
+        ovs_commands = [cmd for cmd in self.commands
+                        if cmd[0] == '/usr/bin/ovs-vsctl']
+        self.assertEqual([('/usr/bin/ovs-vsctl',
+                           '--', '--may-exist', 'add-br', 'br-ctlplane',
+                           '--', '--if-exists', 'del-port', 'em1', '--',
+                           'add-port', 'br-ctlplane', 'em1',
+                           '--', '--if-exists', 'del-port', 'vlan5', '--',
+                           'add-port', 'br-ctlplane', 'vlan5', 'tag=5',
+                           '--', 'set', 'Interface', 'vlan5',
+                           'type=internal')], ovs_commands)
+        self.assertEqual([], self.ifdown_interface_names)
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertIn(('/sbin/ip', 'link', 'set', 'dev', 'vlan5', 'up'),
+                      self.commands)
+        self.assertIn((impl_ifcfg.IFUP_ETH, 'br-ctlplane'), self.commands)
+        self.assertEqual('dhcp', self.env['br-ctlplane']['BOOTPROTO'])
+
+    def test_ovs_transaction_l3(self):
+        interface = objects.Interface('em1')
+        vlan = objects.Vlan('em1', 5,
+                            addresses=[objects.Address('192.0.2.5/24')])
+        bridge = objects.OvsBridge('br-ctlplane', members=[interface, vlan])
+        self.provider.ovs_transaction = True
+        self.provider.addObject(bridge)
+
+        plan = self.provider.plan()
+        self.assertEqual(['vlan5'], plan['restart'])
+        self.assertEqual(['br-ctlplane', 'em1'], plan['hot_update'])
+
+        self.provider.apply()
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertEqual([(impl_ifcfg.IFUP_ETH, 'vlan5')],
+                         [cmd for cmd in self.commands
+                          if cmd[0] == impl_ifcfg.IFUP_ETH])
+        self.assertNotIn('vlan5', self.env)
+        self.assertIn('vlan5', self.provider.ifup_timings)
+
+    def test_route_only_apply(self):
+        utils.write_config(self.temp_ifcfg_file.name, _V4_IFCFG)
+        utils.write_config(self.temp_route_file.name, _ROUTES)
+        route1 = objects.Route('192.168.1.1', default=True)
+        route2 = objects.Route('192.168.1.1', '172.20.0.0/24')
+        v4_addr = objects.Address('192.168.1.2/24')
+        interface = objects.Interface('em1', addresses=[v4_addr],
+                                      routes=[route1, route2])
+        self.provider.addObject(interface)
+        self.provider.apply()
+
+        self.assertEqual([], self.ifdown_interface_names)
+        self.assertEqual([], self.ifup_interface_names)
+        self.assertIn(('/sbin/ip', '-force', '-batch', '-'), self.commands)
+        self.assertEqual(['route del 172.19.0.0/24 via 192.168.1.1 dev em1\n'
+                          'route replace 172.20.0.0/24 via 192.168.1.1 '
+                          'dev em1\n'], self.process_inputs)
+        route_data = utils.get_file_data(self.temp_route_file.name)
+        self.assertEqual('default via 192.168.1.1 dev em1\n'
+                         '172.20.0.0/24 via 192.168.1.1 dev em1\n',
+                         route_data)
+
+    def test_route_update_failure(self):
+        utils.write_config(self.temp_ifcfg_file.name, _V4_IFCFG)
+        utils.write_config(self.temp_route_file.name, _ROUTES)
+        self.failing_commands.append('/sbin/ip')
+        route1 = objects.Route('192.168.1.1', default=True)
+        route2 = objects.Route('192.168.1.1', '172.20.0.0/24')
+        v4_addr = objects.Address('192.168.1.2/24')
+        interface = objects.Interface('em1', addresses=[v4_addr],
+                                      routes=[route1, route2])
+        self.provider.addObject(interface)
+        self.provider.apply()
+
+        self.assertIn(('/sbin/ip', '-force', '-batch', '-'), self.commands)
+        route_data = utils.get_file_data(self.temp_route_file.name)
+        self.assertEqual('default via 192.168.1.1 dev em1\n'
+                         '172.20.0.0/24 via 192.168.1.1 dev em1\n',
+                         route_data)
+
+    def test_plan(self):
+        utils.write_config(self.temp_ifcfg_file.name, _OVS_INTERFACE)
+        interface = objects.Interface('em1')
+        bridge = objects.OvsBridge('br-ctlplane', use_dhcp=True,
+                                   members=[interface])
+        self.provider.addObject(bridge)
+        self.provider.ifup_timings['br-ctlplane'] = 4.5
+        plan = self.provider.plan()
+
+        self.assertEqual([], self.commands)
+        self.assertEqual(['br-ctlplane'], plan['restart'])
+        self.assertEqual([['br-ctlplane']], plan['waves'])
+        self.assertEqual({'br-ctlplane': 4.5}, plan['estimated_downtime'])
+        self.assertEqual(4.5, plan['estimated_total_downtime'])
+        self.assertEqual(_OVS_INTERFACE,
+                         utils.get_file_data(self.temp_ifcfg_file.name))
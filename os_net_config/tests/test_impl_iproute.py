@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+
+import os_net_config
+from os_net_config import cli
+from os_net_config import impl_iproute
+from os_net_config import netlink
+from os_net_config import objects
+from os_net_config.tests import base
+
+
+_EM1 = netlink.Link(2, 'em1', netlink.IFF_UP, 1500, None, None, None)
+
+
+class FakeRtnlSocket(object):
+
+    def __init__(self):
+        self.links = [_EM1]
+        self.addresses = []
+        self.routes = []
+        self.batches = []
+
+    def get_links(self):
+        return self.links
+
+    def get_addresses(self):
+        return self.addresses
+
+    def get_routes(self):
+        return self.routes
+
+    def batch(self, messages):
+        self.batches.append(messages)
+        for msg_type, flags, payload in messages:
+            if msg_type == netlink.RTM_NEWLINK and flags:
+                link = netlink.parse_link(payload)
+                self.links.append(link._replace(index=len(self.links) + 2))
+
+    def close(self):
+        pass
+
+
+class TestIprouteNetConfig(base.TestCase):
+
+    def setUp(self):
+        super(TestIprouteNetConfig, self).setUp()
+        self.sock = FakeRtnlSocket()
+        self.stubs.Set(netlink, 'RtnlSocket', lambda: self.sock)
+        self.provider = impl_iproute.IprouteNetConfig()
+
+    def _message_types(self, batch):
+        return [msg_type for msg_type, flags, payload in batch]
+
+    def test_interface_apply(self):
+        route = objects.Route('192.168.1.1', '172.19.0.0/24')
+        interface = objects.Interface(
+            'em1', addresses=[objects.Address('192.168.1.2/24')],
+            routes=[route], mtu=9000)
+        self.provider.addObject(interface)
+        self.provider.apply()
+
+        self.assertEqual(1, len(self.sock.batches))
+        batch = self.sock.batches[0]
+        self.assertEqual([netlink.RTM_NEWLINK, netlink.RTM_NEWADDR,
+                          netlink.RTM_NEWROUTE], self._message_types(batch))
+        self.assertEqual(netlink.Addr(2, socket.AF_INET, b'\xc0\xa8\x01\x02',
+                                      24, netlink.RT_SCOPE_UNIVERSE),
+                         netlink.parse_addr(batch[1][2]))
+        route = netlink.parse_route(batch[2][2])
+        self.assertEqual(b'\xac\x13\x00\x00', route.dst)
+        self.assertEqual(b'\xc0\xa8\x01\x01', route.gateway)
+
+    def test_no_changes(self):
+        self.sock.addresses = [netlink.Addr(2, socket.AF_INET,
+                                            b'\xc0\xa8\x01\x02', 24,
+                                            netlink.RT_SCOPE_UNIVERSE)]
+        interface = objects.Interface(
+            'em1', addresses=[objects.Address('192.168.1.2/24')])
+        self.provider.addObject(interface)
+        self.provider.apply()
+        self.assertEqual([], self.sock.batches)
+
+    def test_stale_address_and_route_removed(self):
+        self.sock.addresses = [netlink.Addr(2, socket.AF_INET,
+                                            b'\xc0\xa8\x01\x03', 24,
+                                            netlink.RT_SCOPE_UNIVERSE)]
+        self.sock.routes = [netlink.Route(socket.AF_INET, None, 0,
+                                          b'\xc0\xa8\x01\x01', 2,
+                                          netlink.RT_TABLE_MAIN,
+                                          netlink.RTPROT_STATIC)]
+        self.provider.addObject(objects.Interface('em1'))
+        self.provider.apply()
+        self.assertEqual([[netlink.RTM_DELADDR, netlink.RTM_DELROUTE]],
+                         [self._message_types(b)
+                          for b in self.sock.batches])
+
+    def test_vlan_apply(self):
+        vlan = objects.Vlan('em1', 5,
+                            addresses=[objects.Address('192.168.5.2/24')])
+        self.provider.addObject(vlan)
+        self.provider.apply()
+
+        self.assertEqual(2, len(self.sock.batches))
+        link = netlink.parse_link(self.sock.batches[0][0][2])
+        self.assertEqual(('vlan5', 5, 2), (link.name, link.vlan_id,
+                                           link.link))
+        self.assertEqual([netlink.RTM_NEWLINK, netlink.RTM_NEWADDR],
+                         self._message_types(self.sock.batches[1]))
+
+    def test_ovs_bridge_not_supported(self):
+        bridge = objects.OvsBridge('br0')
+        self.assertRaises(os_net_config.NotImplemented,
+                          self.provider.addObject, bridge)
+
+    def test_missing_device(self):
+        self.provider.addObject(objects.Interface('em2'))
+        self.assertRaises(netlink.NetlinkError, self.provider.apply)
+
+    def test_plan(self):
+        vlan = objects.Vlan('em1', 5)
+        self.provider.addObject(vlan)
+        self.provider.addObject(objects.Interface('em1'))
+        plan = self.provider.plan()
+        self.assertEqual([], self.sock.batches)
+        self.assertEqual([], plan['restart'])
+        self.assertEqual(['vlan5'], plan['hot_update'])
+        self.assertEqual(0.0, plan['estimated_total_downtime'])
+
+
+class TestIprouteRerun(base.TestCase):
+
+    def setUp(self):
+        super(TestIprouteRerun, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.sockets = []
+
+        def test_socket():
+            self.sockets.append(FakeRtnlSocket())
+            return self.sockets[-1]
+        self.stubs.Set(netlink, 'RtnlSocket', test_socket)
+
+    def test_rerun_not_skipped(self):
+        config_file = os.path.join(self.temp_dir, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump({'network_config': [
+                {'type': 'interface', 'name': 'em1',
+                 'addresses': [{'ip_netmask': '192.0.2.1/24'}]}]}, f)
+        argv = ['os-net-config', '-p', 'iproute', '-c', config_file,
+                '-s', os.path.join(self.temp_dir, 'state.json'),
+                '--no-cache']
+        self.assertEqual(0, cli.main(argv))
+        # nothing was persisted, e.g. after a reboot the host must be
+        # configured again from the same config
+        self.assertEqual(0, cli.main(argv))
+        self.assertEqual(2, len(self.sockets))
+        self.assertEqual(1, len(self.sockets[1].batches))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import copy
+
+import six
+
+from os_net_config import incremental
+from os_net_config.tests import base
+
+
+_CONFIG = [
+    {'type': 'ovs_bridge', 'name': 'br-ctlplane',
+     'members': [
+         {'type': 'interface', 'name': 'em1'},
+         {'type': 'vlan', 'vlan_id': 16, 'device': 'em1',
+          'addresses': [{'ip_netmask': '192.0.2.1/24'}]}]},
+    {'type': 'interface', 'name': 'em2'},
+    {'type': 'vlan', 'vlan_id': 17, 'device': 'em2'},
+    {'type': 'vlan_range', 'device': 'em3', 'vlan_ids': '100-101'},
+]
+
+
+class TestIncremental(base.TestCase):
+
+    def _rebuild(self, new_config):
+        nodes, tops = incremental.fingerprint_nodes(_CONFIG)
+        previous = dict((key, node.fingerprint)
+                        for key, node in six.iteritems(nodes))
+        return incremental.rebuild_set(
+            *incremental.fingerprint_nodes(new_config), previous=previous)
+
+    def test_keys(self):
+        nodes, tops = incremental.fingerprint_nodes(_CONFIG)
+        self.assertEqual([['ovs_bridge:br-ctlplane', 'interface:em1',
+                           'vlan:16'], ['interface:em2'], ['vlan:17'],
+                          ['vlan_range:em3:100-101']], tops)
+        self.assertEqual(['vlan100', 'vlan101'],
+                         nodes['vlan_range:em3:100-101'].names)
+
+    def test_unchanged(self):
+        self.assertEqual((set(), set()), self._rebuild(_CONFIG))
+
+    def test_member_changed(self):
+        config = copy.deepcopy(_CONFIG)
+        config[0]['members'][1]['addresses'] = []
+        self.assertEqual((set(['vlan16']), set([0])), self._rebuild(config))
+
+    def test_members_added(self):
+        config = copy.deepcopy(_CONFIG)
+        config[0]['members'].append({'type': 'interface', 'name': 'em4'})
+        self.assertEqual((set(['br-ctlplane', 'em1', 'em4', 'vlan16']),
+                          set([0])), self._rebuild(config))
+
+    def test_dependents(self):
+        config = copy.deepcopy(_CONFIG)
+        config[1]['mtu'] = 9000
+        self.assertEqual((set(['em2', 'vlan17']), set([1, 2])),
+                         self._rebuild(config))
+
+    def test_parent_changed(self):
+        config = copy.deepcopy(_CONFIG)
+        config[0]['ovs_options'] = 'fail_mode=secure'
+        self.assertEqual((set(['br-ctlplane', 'em1', 'vlan16']), set([0])),
+                         self._rebuild(config))
+
+    def test_added(self):
+        config = copy.deepcopy(_CONFIG)
+        config.append({'type': 'interface', 'name': 'em5'})
+        self.assertEqual((set(['em5']), set([4])), self._rebuild(config))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import socket
+import struct
+
+from os_net_config import netlink
+from os_net_config.tests import base
+
+
+class TestNetlinkMessages(base.TestCase):
+
+    def test_attrs_padding(self):
+        data = (netlink.pack_attr(netlink.IFLA_IFNAME, b'em1\0') +
+                netlink.pack_attr(netlink.IFLA_MTU, struct.pack('I', 9000)))
+        self.assertEqual(16, len(data))
+        attrs = netlink.parse_attrs(data)
+        self.assertEqual(b'em1\0', attrs[netlink.IFLA_IFNAME])
+        self.assertEqual(struct.pack('I', 9000), attrs[netlink.IFLA_MTU])
+
+    def test_build_and_parse_messages(self):
+        data = (netlink.build_message(netlink.RTM_GETLINK, netlink.NLM_F_DUMP,
+                                      1, b'abcd') +
+                netlink.build_message(netlink.RTM_NEWADDR, 0, 2, b'ef'))
+        messages = list(netlink.parse_messages(data))
+        self.assertEqual([(netlink.RTM_GETLINK,
+                           netlink.NLM_F_DUMP | netlink.NLM_F_REQUEST, 1,
+                           b'abcd'),
+                          (netlink.RTM_NEWADDR, netlink.NLM_F_REQUEST, 2,
+                           b'ef')], messages)
+
+    def test_parse_vlan_link(self):
+        msg_type, flags, payload = netlink.new_vlan('vlan5', 2, 5)
+        self.assertEqual(netlink.RTM_NEWLINK, msg_type)
+        link = netlink.parse_link(payload)
+        self.assertEqual('vlan5', link.name)
+        self.assertEqual('vlan', link.kind)
+        self.assertEqual(5, link.vlan_id)
+        self.assertEqual(2, link.link)
+
+    def test_parse_addr(self):
+        addr = netlink.Addr(3, socket.AF_INET, b'\xc0\xa8\x01\x02', 24,
+                            netlink.RT_SCOPE_UNIVERSE)
+        msg_type, flags, payload = netlink.new_addr(addr)
+        self.assertEqual(addr, netlink.parse_addr(payload))
+
+    def test_parse_route(self):
+        route = netlink.Route(socket.AF_INET, b'\xac\x13\x00\x00', 24,
+                              b'\xc0\xa8\x01\x01', 3, netlink.RT_TABLE_MAIN,
+                              netlink.RTPROT_STATIC)
+        msg_type, flags, payload = netlink.new_route(route)
+        self.assertEqual(route, netlink.parse_route(payload))
@@ -16,6 +16,8 @@
 
 import json
 
+from six.moves import cPickle as pickle
+
 from os_net_config import objects
 from os_net_config.tests import base
 
@@ -44,6 +46,29 @@ class TestRoute(base.TestCase):
         self.assertEqual("172.19.0.0/24", route.ip_netmask)
         self.assertEqual(True, route.default)
 
+    def test_network(self):
+        route = objects.Route('172.19.0.1', '172.19.0.5/24')
+        self.assertEqual("172.19.0.0", route.network.network)
+        self.assertEqual("255.255.255.0", route.network.netmask)
+        self.assertEqual(4, route.gateway.version)
+
+
+class TestParseNetwork(base.TestCase):
+
+    def test_cached(self):
+        objects._network_cache.clear()
+        first = objects.parse_network('10.0.0.1/24')
+        second = objects.parse_network('10.0.0.1/24')
+        self.assertIs(first, second)
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1},
+                         objects._network_cache.stats())
+        self.assertIs(first, objects.Address('10.0.0.1/24').parsed)
+
+    def test_ipv6_network(self):
+        parsed = objects.parse_network('2001:abc:a::5/64')
+        self.assertEqual("2001:abc:a::", parsed.network)
+        self.assertEqual(16, len(parsed.network_packed))
+
 
 class TestAddress(base.TestCase):
 
@@ -59,6 +84,16 @@ class TestAddress(base.TestCase):
         self.assertEqual("ffff:ffff:ffff:ffff::", address.netmask)
         self.assertEqual(6, address.version)
 
+    def test_packed_address(self):
+        address = objects.Address('192.168.1.1/24')
+        self.assertEqual(0xc0a80101, address.value)
+        self.assertEqual(24, address.prefixlen)
+        self.assertEqual("192.168.1.1/24", address.ip_netmask)
+        address = objects.Address('2001:abc:a::1')
+        self.assertEqual(128, address.prefixlen)
+        self.assertEqual("2001:abc:a::1/128", address.ip_netmask)
+        self.assertFalse(hasattr(address, '__dict__'))
+
     def test_from_json(self):
         data = '{"ip_netmask": "192.0.2.5/24"}'
         address = objects.Address.from_json(json.loads(data))
@@ -86,6 +121,24 @@ class TestInterface(base.TestCase):
         self.assertEquals("192.168.1.1", interface.v4_addresses()[0].ip)
         self.assertEquals("2001:abc:a::", interface.v6_addresses()[0].ip)
 
+    def test_address_partition(self):
+        v4_addr = objects.Address('192.168.1.1/24')
+        v6_addr = objects.Address('2001:abc:a::/64')
+        interface = objects.Interface('foo')
+        self.assertFalse(interface.has_static)
+        self.assertIsNone(interface.first_v4)
+        self.assertIsNone(interface.first_v6)
+        interface.addresses = [v6_addr, v4_addr]
+        self.assertTrue(interface.has_static)
+        self.assertIs(v4_addr, interface.first_v4)
+        self.assertIs(v6_addr, interface.first_v6)
+        self.assertEqual((v6_addr,), interface.v6_addresses())
+
+    def test_slots(self):
+        interface = objects.Interface('foo')
+        self.assertFalse(hasattr(interface, '__dict__'))
+        self.assertRaises(AttributeError, setattr, interface, 'foo', 1)
+
     def test_from_json_dhcp(self):
         data = '{"type": "interface", "name": "em1", "use_dhcp": true}'
         interface = objects.object_from_json(json.loads(data))
@@ -131,6 +184,43 @@ class TestVlan(base.TestCase):
         self.assertEqual(True, vlan.use_dhcp)
 
 
+class TestVlanRange(base.TestCase):
+
+    def test_from_json(self):
+        data = '{"type": "vlan_range", "device": "bond1", ' \
+               '"vlan_ids": "100-102, 300", "mtu": 9000, ' \
+               '"addresses": [{"ip_netmask": ' \
+               '"10.{vlan_id_hi}.{vlan_id_lo}.2/24"}], ' \
+               '"routes": [{"next_hop": "10.{vlan_id_hi}.{vlan_id_lo}.1", ' \
+               '"ip_netmask": "172.16.{index}.0/24"}]}'
+        vlan_range = objects.object_from_json(json.loads(data))
+        self.assertEqual(((100, 102), (300, 300)), vlan_range.vlan_ids)
+        self.assertEqual(4, len(vlan_range))
+        vlans = list(vlan_range.expand())
+        self.assertEqual(['vlan100', 'vlan101', 'vlan102', 'vlan300'],
+                         [vlan.name for vlan in vlans])
+        self.assertEqual('bond1', vlans[3].device)
+        self.assertEqual(9000, vlans[3].mtu)
+        self.assertEqual('10.1.44.2', vlans[3].first_v4.ip)
+        self.assertEqual('10.1.44.1', vlans[3].routes[0].next_hop)
+        self.assertEqual('172.16.3.0/24', vlans[3].routes[0].ip_netmask)
+
+    def test_expand_invalid_address(self):
+        vlan_range = objects.VlanRange('bond1', ((250, 260),),
+                                       addresses=['10.0.{vlan_id}.2/24'])
+        vlans = vlan_range.expand()
+        self.assertEqual('vlan250', next(vlans).name)
+        for vlan_id in range(251, 256):
+            next(vlans)
+        e = self.assertRaises(objects.InvalidConfigException, next, vlans)
+        self.assertIn('VLAN 256', str(e))
+
+    def test_invalid_vlan_ids(self):
+        for vlan_ids in ('0-10', '10-5', 'ten', '4000-4095'):
+            self.assertRaises(objects.InvalidConfigException,
+                              objects.parse_vlan_ids, vlan_ids)
+
+
 class TestBridge(base.TestCase):
 
     def test_from_json_dhcp(self):
@@ -152,6 +242,13 @@ class TestBridge(base.TestCase):
         self.assertEqual(True, interface1.ovs_port)
         self.assertEqual("br-foo", interface1.bridge_name)
 
+    def test_from_json_vlan_range_member(self):
+        data = {'type': 'ovs_bridge', 'name': 'br-foo',
+                'members': [{'type': 'vlan_range', 'device': 'em1',
+                             'vlan_ids': '10-20'}]}
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.object_from_json, data)
+
 
 class TestBond(base.TestCase):
 
@@ -179,3 +276,82 @@ class TestBond(base.TestCase):
         self.assertEqual("em1", interface1.name)
         interface2 = bridge.members[1]
         self.assertEqual("em2", interface2.name)
+
+    def test_from_json_vlan_range_member(self):
+        data = {'type': 'ovs_bond', 'name': 'bond1',
+                'members': [{'type': 'vlan_range', 'device': 'em1',
+                             'vlan_ids': '10-20'}]}
+        self.assertRaises(objects.InvalidConfigException,
+                          objects.object_from_json, data)
+
+
+class TestObjectTypes(base.TestCase):
+
+    def test_builtin_types(self):
+        self.assertEqual(['interface', 'ovs_bond', 'ovs_bridge', 'vlan',
+                          'vlan_range'], objects.object_types.names())
+        obj = objects.object_from_json({'type': 'vlan', 'device': 'em1',
+                                        'vlan_id': 5})
+        self.assertIsInstance(obj, objects.Vlan)
+
+    def test_unknown_type(self):
+        self.assertIsNone(objects.object_from_json({'type': 'bridge'}))
+
+    def test_registered_type(self):
+        class FakeType(objects.Interface):
+            __slots__ = ()
+
+            @staticmethod
+            def from_json(json):
+                return FakeType(json['name'])
+
+        objects.object_types.register('fake', FakeType)
+        self.addCleanup(objects.object_types.loaded.pop, 'fake')
+        obj = objects.object_from_json({'type': 'fake', 'name': 'em1'})
+        self.assertIsInstance(obj, FakeType)
+
+
+class TestImmutable(base.TestCase):
+
+    _BRIDGE = {'type': 'ovs_bridge', 'name': 'br0',
+               'members': [{'type': 'interface', 'name': 'em1',
+                            'addresses': [{'ip_netmask': '192.0.2.1/24'}],
+                            'routes': [{'next_hop': '192.0.2.254'}]}]}
+
+    def test_frozen(self):
+        bridge = objects.object_from_json(self._BRIDGE)
+        member = bridge.members[0]
+        self.assertRaises(AttributeError, setattr, bridge, 'mtu', 9000)
+        self.assertRaises(AttributeError, setattr, member, 'addresses', [])
+        self.assertRaises(AttributeError, setattr, member.routes[0],
+                          'default', True)
+        self.assertIsInstance(bridge.members, tuple)
+        self.assertIsInstance(member.addresses, tuple)
+        self.assertEqual('br0', member.bridge_name)
+
+    def test_structural_hash(self):
+        bridge = objects.object_from_json(self._BRIDGE)
+        self.assertEqual(bridge.structural_hash,
+                         objects.object_from_json(
+                             json.loads(json.dumps(self._BRIDGE)))
+                         .structural_hash)
+        member = objects.Interface('em1', addresses=[
+            objects.Address('192.0.2.1/24')],
+            routes=[objects.Route('192.0.2.254')])
+        self.assertNotEqual(bridge.members[0].structural_hash,
+                            member.structural_hash)
+        member.bridge_name = 'br0'
+        member.ovs_port = True
+        self.assertEqual(bridge.members[0].structural_hash,
+                         member.structural_hash)
+        member.mtu = 9000
+        self.assertNotEqual(bridge.members[0].structural_hash,
+                            member.structural_hash)
+
+    def test_pickle(self):
+        bridge = objects.object_from_json(self._BRIDGE)
+        digest = bridge.structural_hash
+        loaded = pickle.loads(pickle.dumps(bridge, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(digest, loaded.structural_hash)
+        self.assertEqual('192.0.2.1', loaded.members[0].first_v4.ip)
+        self.assertRaises(AttributeError, setattr, loaded, 'mtu', 9000)
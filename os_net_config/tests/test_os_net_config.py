@@ -21,6 +21,15 @@ test_os_net_config
 Tests for `os_net_config` module.
 """
 
+import gc
+import json
+import os
+import subprocess
+import sys
+
+import os_net_config
+from os_net_config import impl_eni
+from os_net_config import objects
 from os_net_config.tests import base
 
 
@@ -28,3 +37,116 @@ class TestOs_net_config(base.TestCase):
 
     def test_something(self):
         pass
+
+
+class TestNetConfigGraph(base.TestCase):
+
+    def setUp(self):
+        super(TestNetConfigGraph, self).setUp()
+        self.graph = os_net_config.NetConfigGraph()
+
+    def test_independent_devices(self):
+        self.graph.add(objects.Interface('em2'))
+        self.graph.add(objects.Interface('em1'))
+        self.assertEqual([['em1', 'em2']], self.graph.levels())
+
+    def test_bridge_with_bond_and_vlan(self):
+        em1 = objects.Interface('em1')
+        em2 = objects.Interface('em2')
+        bond = objects.OvsBond('bond0', members=[em1, em2])
+        vlan = objects.Vlan('bond0', 5)
+        bridge = objects.OvsBridge('br0', members=[bond, vlan])
+        for obj in [bridge, bond, em1, em2, vlan]:
+            self.graph.add(obj)
+        self.assertEqual([['br0'], ['bond0'], ['em1', 'em2', 'vlan5']],
+                         self.graph.levels())
+        self.assertEqual(set(['br0']), self.graph.dependencies['bond0'])
+        self.assertEqual(set(['bond0', 'em1', 'em2', 'vlan5']),
+                         self.graph.all_dependents(['bond0']))
+
+    def test_levels_subset(self):
+        em1 = objects.Interface('em1')
+        bridge = objects.OvsBridge('br0', members=[em1])
+        self.graph.add(bridge)
+        self.graph.add(em1)
+        self.graph.add(objects.Vlan('em2', 6))
+        self.assertEqual([['em1', 'vlan6']],
+                         self.graph.levels(['em1', 'vlan6']))
+
+    def test_cycle(self):
+        self.graph._addEdge('a', 'b')
+        self.graph._addEdge('b', 'a')
+        self.assertEqual([['c'], ['a', 'b']],
+                         self.graph.levels(['a', 'b', 'c']))
+
+    def test_net_config_add_object(self):
+        provider = os_net_config.NetConfig()
+        self.stubs.Set(provider, 'addBridge', lambda bridge: None)
+        self.stubs.Set(provider, 'addInterface', lambda iface: None)
+        bridge = objects.OvsBridge('br0', members=[objects.Interface('em1')])
+        provider.addObject(bridge)
+        self.assertEqual(set(['br0', 'em1']), set(provider.graph.nodes))
+        self.assertEqual([['br0'], ['em1']], provider.graph.levels())
+
+    def test_graph_keeps_names_only(self):
+        provider = impl_eni.ENINetConfig()
+        provider.addObject(objects.VlanRange(
+            'em1', ((1, 900),),
+            addresses=['10.{vlan_id_hi}.{vlan_id_lo}.2/24']))
+        self.assertEqual(900, len(provider.graph.nodes))
+        gc.collect()
+        self.assertLess(len([obj for obj in gc.get_objects()
+                             if isinstance(obj, objects.Vlan)]), 10)
+
+
+_RENDER_SCRIPT = """
+import json
+import sys
+
+from os_net_config import impl_eni
+from os_net_config import impl_ifcfg
+from os_net_config import objects
+
+config = json.loads(sys.argv[1])
+output = []
+for provider in (impl_eni.ENINetConfig(),
+                 impl_eni.ENINetConfig(fragments=True),
+                 impl_ifcfg.IfcfgNetConfig()):
+    for obj_json in config:
+        provider.addObject(objects.object_from_json(obj_json))
+    output.append(sorted(provider.renderFiles().items()))
+    output.append(provider.plan())
+sys.stdout.write(json.dumps(output, sort_keys=True))
+"""
+
+
+class TestCanonicalOrder(base.TestCase):
+
+    def test_order(self):
+        graph = os_net_config.NetConfigGraph()
+        bridge = objects.OvsBridge('br0', members=[objects.Interface('em2')])
+        for obj in [objects.Vlan('em2', 5), objects.Interface('em1'),
+                    bridge, bridge.members[0]]:
+            graph.add(obj)
+        self.assertEqual(['br0', 'em1', 'em2', 'vlan5'], graph.order())
+        self.assertEqual(['em1', 'vlan5'], graph.order(['vlan5', 'em1']))
+
+    def test_hash_seed_independent(self):
+        config = [{'type': 'ovs_bridge', 'name': 'br-%i' % i,
+                   'members': [{'type': 'interface', 'name': 'em%i' % i}]}
+                  for i in range(8)]
+        config.extend({'type': 'vlan', 'device': 'em%i' % (i % 8),
+                       'vlan_id': i + 1,
+                       'addresses': [{'ip_netmask': '10.0.%i.2/24' % i}],
+                       'routes': [{'next_hop': '10.0.%i.1' % i,
+                                   'ip_netmask': '172.16.%i.0/24' % i}]}
+                      for i in range(32))
+        outputs = set()
+        for seed in ('0', '1', '2', '3', '4'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            proc = subprocess.Popen([sys.executable, '-c', _RENDER_SCRIPT,
+                                     json.dumps(config)],
+                                    stdout=subprocess.PIPE, env=env)
+            outputs.add(proc.communicate()[0])
+            self.assertEqual(0, proc.returncode)
+        self.assertEqual(1, len(outputs))
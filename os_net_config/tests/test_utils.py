@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import json
+import os
+import tempfile
+
+import six
+
+from os_net_config.openstack.common import processutils
+from os_net_config.tests import base
+from os_net_config import utils
+
+
+class TestState(base.TestCase):
+
+    def setUp(self):
+        super(TestState, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.temp_dir, 'config.json')
+        self.ifcfg_file = os.path.join(self.temp_dir, 'ifcfg-em1')
+        self.state_file = os.path.join(self.temp_dir, 'state', 'state.json')
+        utils.write_config(self.config_file, '{"network_config": []}')
+        utils.write_config(self.ifcfg_file, 'DEVICE=em1\n')
+
+    def _save_state(self):
+        state = utils.build_state('IfcfgNetConfig', self.config_file,
+                                  utils.fingerprint('{"network_config": []}'),
+                                  {self.ifcfg_file: 'DEVICE=em1\n'})
+        utils.save_state(self.state_file, state)
+        return utils.load_state(self.state_file)
+
+    def test_load_missing_state(self):
+        self.assertEqual({}, utils.load_state(self.state_file))
+
+    def test_state_unchanged(self):
+        state = self._save_state()
+        self.assertEqual(utils.fingerprint('DEVICE=em1\n'),
+                         state['files'][self.ifcfg_file]['fingerprint'])
+        self.assertTrue(utils.state_unchanged(state, 'IfcfgNetConfig',
+                                              self.config_file))
+
+    def test_state_provider_changed(self):
+        state = self._save_state()
+        self.assertFalse(utils.state_unchanged(state, 'ENINetConfig',
+                                               self.config_file))
+
+    def test_state_version_changed(self):
+        state = utils.build_state('ENINetConfig', self.config_file,
+                                  utils.fingerprint('{"network_config": []}'),
+                                  {self.ifcfg_file: 'DEVICE=em1\n'},
+                                  version='1.0', options={'fragments': False})
+        utils.save_state(self.state_file, state)
+        state = utils.load_state(self.state_file)
+        self.assertTrue(utils.state_unchanged(
+            state, 'ENINetConfig', self.config_file, version='1.0',
+            options={'fragments': False}))
+        self.assertFalse(utils.state_unchanged(
+            state, 'ENINetConfig', self.config_file, version='1.1',
+            options={'fragments': False}))
+        self.assertFalse(utils.state_unchanged(
+            state, 'ENINetConfig', self.config_file, version='1.0',
+            options={'fragments': True}))
+
+    def test_state_file_changed(self):
+        state = self._save_state()
+        utils.write_config(self.ifcfg_file, 'DEVICE=em1\nMTU=9000\n')
+        self.assertFalse(utils.state_unchanged(state, 'IfcfgNetConfig',
+                                               self.config_file))
+
+    def test_state_previous_files(self):
+        previous = self._save_state()['files']
+        route_file = os.path.join(self.temp_dir, 'route-em1')
+        state = utils.build_state('IfcfgNetConfig', self.config_file,
+                                  utils.fingerprint('{}'), {route_file: ''},
+                                  object_fingerprints={'interface:em1': 'x'},
+                                  previous_files=previous)
+        self.assertEqual(sorted([self.ifcfg_file, route_file]),
+                         sorted(state['files']))
+        self.assertEqual({'interface:em1': 'x'}, state['objects'])
+        self.assertTrue(utils.files_unchanged(state))
+
+    def test_state_config_fingerprint(self):
+        state = self._save_state()
+        self.assertEqual(utils.file_fingerprint(self.config_file),
+                         state['config'])
+        self.assertTrue(utils.state_unchanged(
+            state, 'IfcfgNetConfig', self.config_file,
+            utils.fingerprint('{"network_config": []}')))
+        self.assertFalse(utils.state_unchanged(state, 'IfcfgNetConfig',
+                                               self.config_file,
+                                               utils.fingerprint('{}')))
+
+
+class TestCompiledCache(base.TestCase):
+
+    def setUp(self):
+        super(TestCompiledCache, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.temp_dir, 'config.json.cache')
+
+    def test_round_trip(self):
+        utils.save_compiled(self.cache_file, 'abc', '1.0', ['obj'],
+                            {'IfcfgNetConfig': {('IfcfgNetConfig', 'h'): 'x'}})
+        compiled = utils.load_compiled(self.cache_file, 'abc', '1.0')
+        self.assertEqual(['obj'], compiled['objects'])
+        self.assertEqual('x', compiled['rendered']['IfcfgNetConfig'][
+            ('IfcfgNetConfig', 'h')])
+
+    def test_stale(self):
+        utils.save_compiled(self.cache_file, 'abc', '1.0', [], {})
+        self.assertIsNone(utils.load_compiled(self.cache_file, 'def', '1.0'))
+        self.assertIsNone(utils.load_compiled(self.cache_file, 'abc', '1.1'))
+        self.assertIsNone(utils.load_compiled(self.cache_file + '.missing',
+                                              'abc', '1.0'))
+
+    def test_insecure(self):
+        utils.save_compiled(self.cache_file, 'abc', '1.0', [], {})
+        os.chmod(self.cache_file, 0o666)
+        self.assertIsNone(utils.load_compiled(self.cache_file, 'abc', '1.0'))
+
+    def test_corrupt(self):
+        utils.write_config(self.cache_file, 'not a pickle')
+        self.assertIsNone(utils.load_compiled(self.cache_file, 'abc', '1.0'))
+
+
+class TestIterJsonArray(base.TestCase):
+
+    def _iter(self, data, chunk_size=4):
+        return list(utils.iter_json_array(io.StringIO(six.text_type(data)),
+                                          'network_config', chunk_size))
+
+    def test_elements(self):
+        config = {'version': 12345,
+                  'network_config': [{'type': 'interface', 'name': 'em1',
+                                      'mtu': 9000},
+                                     {'type': 'vlan', 'vlan_id': 10,
+                                      'device': 'em1'}],
+                  'other': [1, 'two', None]}
+        for chunk_size in (1, 3, 4096):
+            self.assertEqual(config['network_config'],
+                             self._iter(json.dumps(config, indent=1),
+                                        chunk_size))
+
+    def test_empty(self):
+        self.assertEqual([], self._iter(u'{"network_config": [ ]}'))
+
+    def test_missing_key(self):
+        self.assertRaises(KeyError, self._iter, u'{}')
+        self.assertRaises(KeyError, self._iter, u'{"network": []}')
+
+    def test_not_array(self):
+        self.assertRaises(TypeError, self._iter, u'{"network_config": {}}')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._iter, u'[]')
+        self.assertRaises(ValueError, self._iter,
+                          u'{"network_config": [{"type": }]}')
+        self.assertRaises(ValueError, self._iter,
+                          u'{"network_config": [{}, {}')
+        self.assertRaises(ValueError, self._iter,
+                          u'{"network_config": []} {}')
+
+
+class TestRegistry(base.TestCase):
+
+    def test_builtin(self):
+        registry = utils.Registry('os_net_config.test', {
+            'execute': 'os_net_config.utils.execute',
+        })
+        self.assertEqual({}, registry.loaded)
+        self.assertIs(utils.execute, registry.get('execute'))
+        self.assertEqual(['execute'], registry.names())
+
+    def test_register(self):
+        registry = utils.Registry('os_net_config.test', {})
+        self.assertIsNone(registry.get('fake'))
+        registry.register('fake', TestRegistry)
+        self.assertIs(TestRegistry, registry.get('fake'))
+
+
+class TestWriteConfigs(base.TestCase):
+
+    def setUp(self):
+        super(TestWriteConfigs, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def _configs(self, count):
+        return dict((os.path.join(self.temp_dir, 'ifcfg-em%i' % i),
+                     'DEVICE=em%i\n' % i) for i in range(count))
+
+    def test_write_configs(self):
+        ifcfg = os.path.join(self.temp_dir, 'ifcfg-em1')
+        route = os.path.join(self.temp_dir, 'route-em1')
+        utils.write_config(ifcfg, 'old data')
+        os.chmod(ifcfg, 0o640)
+        utils.write_configs({ifcfg: 'DEVICE=em1\n', route: ''})
+        self.assertEqual('DEVICE=em1\n', utils.get_file_data(ifcfg))
+        self.assertEqual('', utils.get_file_data(route))
+        self.assertEqual(0o640, os.stat(ifcfg).st_mode & 0o777)
+        self.assertEqual(0o644, os.stat(route).st_mode & 0o777)
+        self.assertEqual(['ifcfg-em1', 'route-em1'],
+                         sorted(os.listdir(self.temp_dir)))
+
+    def test_write_configs_binary(self):
+        cache = os.path.join(self.temp_dir, 'config.json.cache')
+        utils.write_configs({cache: b'\x80\x02}q\x00.'})
+        with open(cache, 'rb') as f:
+            self.assertEqual(b'\x80\x02}q\x00.', f.read())
+
+    def test_write_configs_failure(self):
+        ifcfg = os.path.join(self.temp_dir, 'ifcfg-em1')
+        missing = os.path.join(self.temp_dir, 'missing', 'ifcfg-em2')
+        self.assertRaises(OSError, utils.write_configs,
+                          {ifcfg: 'DEVICE=em1\n', missing: 'DEVICE=em2\n'})
+        self.assertEqual([], os.listdir(self.temp_dir))
+
+    def test_write_configs_fsync(self):
+        fsyncs = []
+        real_fsync = os.fsync
+
+        def test_fsync(fd):
+            fsyncs.append(fd)
+            real_fsync(fd)
+        self.stubs.Set(os, 'fsync', test_fsync)
+        utils.write_configs(self._configs(3))
+        # every staged file, then the directory once
+        self.assertEqual(4, len(fsyncs))
+        self.assertEqual(3, len(os.listdir(self.temp_dir)))
+
+
+class TestTimings(base.TestCase):
+
+    def test_phases(self):
+        timings = utils.Timings()
+        with timings.phase('render'):
+            pass
+        with timings.phase('diff'):
+            pass
+        with timings.phase('render'):
+            pass
+        report = timings.report()
+        self.assertEqual(['render', 'diff'],
+                         [phase['phase'] for phase in report['phases']])
+        self.assertIn('render: ', timings.summary())
+
+    def test_phase_on_error(self):
+        timings = utils.Timings()
+
+        def _fail():
+            with timings.phase('ifup'):
+                raise RuntimeError()
+        self.assertRaises(RuntimeError, _fail)
+        self.assertEqual(['ifup'], [phase['phase'] for phase in
+                                    timings.report()['phases']])
+
+    def test_execute_timed(self):
+        self.stubs.Set(processutils, 'execute',
+                       lambda *args, **kwargs: ('out', ''))
+        utils.timings.reset()
+        self.assertEqual(('out', ''), utils.execute('/sbin/ifup', 'em1'))
+        self.assertEqual(['/sbin/ifup em1'],
+                         [cmd['command'] for cmd in
+                          utils.timings.report()['commands']])
+
+    def test_cache_stats(self):
+        cache = utils.LRUCache('test', 2)
+        self.addCleanup(utils._caches.pop, 'test')
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 2},
+                         utils.timings.report()['caches']['test'])
+        self.assertIn('test cache: 1 hits, 1 misses',
+                      utils.timings.summary())
+
+    def test_cache_eviction_order(self):
+        cache = utils.LRUCache('test', 3)
+        self.addCleanup(utils._caches.pop, 'test')
+        for key in 'abcd':
+            cache.set(key, key.upper())
+        cache.set('b', 'B2')
+        self.assertEqual('C', cache.get('c'))
+        cache.set('e', 'E')
+        cache.set('f', 'F')
+        self.assertEqual([None, None, 'C', None, 'E', 'F'],
+                         [cache.get(key) for key in 'abcdef'])
+        cache.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'size': 0}, cache.stats())
+        cache.set('a', 'A')
+        self.assertEqual('A', cache.get('a'))
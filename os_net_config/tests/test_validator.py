@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from os_net_config import cli
+from os_net_config import impl_ifcfg
+from os_net_config import objects
+from os_net_config.tests import base
+from os_net_config import validator
+
+
+_VALID = {'network_config': [
+    {'type': 'ovs_bridge', 'name': 'br-ctlplane', 'use_dhcp': 'true',
+     'members': [
+         {'type': 'ovs_bond', 'name': 'bond1', 'ovs_options': 'mode=slb',
+          'members': [{'type': 'interface', 'name': 'em1'},
+                      {'type': 'interface', 'name': 'em2'}]},
+         {'type': 'vlan', 'vlan_id': 16, 'device': 'bond1', 'mtu': 9000,
+          'addresses': [{'ip_netmask': '192.0.2.1/24'}],
+          'routes': [{'next_hop': '192.0.2.254', 'ip_netmask': '10.0.0.0/8',
+                      'default': True}]}]},
+    {'type': 'interface', 'name': 'em3', 'use_dhcpv6': False,
+     'addresses': [{'ip_netmask': '2001:abc:a::/64'}]},
+]}
+
+
+class TestValidator(base.TestCase):
+
+    def test_valid(self):
+        self.assertEqual([], validator.validate(_VALID))
+
+    def test_all_errors(self):
+        config = {'network_config': [
+            {'type': 'interface', 'use_dhcp': 'maybe',
+             'addresses': [{'ip_netmask': '192.0.2.300/24'}, {}]},
+            {'type': 'vlan', 'device': 'em1', 'vlan_id': 5000, 'mtu': 'big',
+             'routes': {'next_hop': '192.0.2.1'}},
+            {'type': 'ovs_bridge', 'name': 'br0', 'adresses': [],
+             'members': [{'name': 'em2'}, {'type': 'bridge'}, 'em3']},
+        ]}
+        self.assertEqual([
+            "network_config[0].addresses[0].ip_netmask: '192.0.2.300/24' "
+            "is not a valid IP address or network",
+            "network_config[0].addresses[1]: 'ip_netmask' is required",
+            "network_config[0]: 'name' is required",
+            "network_config[0].use_dhcp: must be a boolean",
+            "network_config[1].mtu: must be an MTU between 68 and 65535",
+            "network_config[1].routes: must be a list",
+            "network_config[1].vlan_id: must be a VLAN ID between 1 and "
+            "4094",
+            "network_config[2].members[0]: 'type' is required",
+            "network_config[2].members[1].type: unknown type 'bridge'",
+            "network_config[2].members[2]: must be an object",
+            "network_config[2].adresses: unknown field",
+        ], validator.validate(config))
+
+    def test_missing_network_config(self):
+        self.assertEqual(["'network_config' is required"],
+                         validator.validate({}))
+        self.assertEqual(['network_config: must be a list'],
+                         validator.validate({'network_config': {}}))
+
+    def test_validate_object(self):
+        self.assertEqual(["network_config[4]: 'device' is required"],
+                         validator.validate_object(
+                             {'type': 'vlan', 'vlan_id': '10'},
+                             'network_config[4]'))
+
+    def test_unknown_field_warning(self):
+        config = {'network_config': [
+            {'type': 'interface', 'name': 'em1', 'nm_controlled': True,
+             'mtu': 'big'}]}
+        warnings = []
+        self.assertEqual(
+            ["network_config[0].mtu: must be an MTU between 68 and 65535"],
+            validator.validate(config, warnings))
+        self.assertEqual(["network_config[0].nm_controlled: unknown field"],
+                         warnings)
+
+    def test_lenient_booleans(self):
+        config = {'network_config': [
+            {'type': 'interface', 'name': 'em1', 'use_dhcp': 1,
+             'use_dhcpv6': 'maybe'}]}
+        warnings = []
+        self.assertEqual([], validator.validate(config, warnings))
+        self.assertEqual(["network_config[0].use_dhcpv6: must be a boolean"],
+                         warnings)
+        self.assertEqual(["network_config[0].use_dhcpv6: must be a boolean"],
+                         validator.validate(config))
+
+    def test_mtu_string(self):
+        iface_json = {'type': 'interface', 'name': 'em1', 'mtu': '9000'}
+        self.assertEqual([], validator.validate_object(iface_json,
+                                                       'network_config[0]'))
+        interface = objects.object_from_json(iface_json)
+        self.assertEqual(9000, interface.mtu)
+        provider = impl_ifcfg.IfcfgNetConfig()
+        provider.addObject(interface)
+        self.assertIn('MTU=9000\n', provider.interfaces['em1'])
+        vlan_range = objects.object_from_json(
+            {'type': 'vlan_range', 'device': 'em1', 'vlan_ids': '5',
+             'mtu': '9000'})
+        self.assertEqual(9000, next(vlan_range.expand()).mtu)
+
+    def test_add_objects_unknown_field(self):
+        class FakeProvider(object):
+            def __init__(self):
+                self.objects = []
+
+            def addObject(self, obj, names=None):
+                self.objects.append(obj)
+
+        provider = FakeProvider()
+        self.assertTrue(cli._add_objects(
+            provider, [{'type': 'interface', 'name': 'em1',
+                        'nm_controlled': True}], 'config.json'))
+        self.assertEqual(['em1'], [obj.name for obj in provider.objects])
+
+    def test_vlan_id_string(self):
+        vlan_json = {'type': 'vlan', 'device': 'em1', 'vlan_id': '10'}
+        self.assertEqual([], validator.validate_object(vlan_json,
+                                                       'network_config[0]'))
+        vlan = objects.object_from_json(vlan_json)
+        self.assertEqual('vlan10', vlan.name)
+        self.assertEqual(10, vlan.vlan_id)
+
+    def test_vlan_range(self):
+        config = {'network_config': [
+            {'type': 'vlan_range', 'device': 'bond1', 'vlan_ids': '10-20',
+             'addresses': [{'ip_netmask': '10.0.{index}.2/24'}],
+             'routes': [{'next_hop': '10.0.{index}.1'}]},
+            {'type': 'vlan_range', 'device': 'bond1', 'vlan_ids': '20-10',
+             'addresses': [{'ip_netmask': '10.0.{vlan}.2/24'}],
+             'routes': [{'next_hop': '10.0.{index}.300'}]},
+            {'type': 'ovs_bridge', 'name': 'br0', 'members': [
+                {'type': 'vlan_range', 'device': 'br0', 'vlan_ids': '5'}]},
+            {'type': 'vlan_range', 'device': 'bond1',
+             'vlan_ids': '10,200-300',
+             'addresses': [{'ip_netmask': '192.0.2.{vlan_id}/24'},
+                           {'ip_netmask': '10.{index}.0.2/24'}],
+             'routes': [{'next_hop': '10.0.{index}.300'}]},
+        ]}
+        self.assertEqual([
+            "network_config[1].addresses[0].ip_netmask: invalid template "
+            "'10.0.{vlan}.2/24': 'vlan'",
+            "network_config[1].vlan_ids: Invalid VLAN range: 20-10",
+            "network_config[2].members[0].type: 'vlan_range' is not "
+            "allowed here",
+            "network_config[3].addresses[0].ip_netmask: '192.0.2.300/24' "
+            "is not a valid IP address or network for VLAN 300",
+            "network_config[3].routes[0].next_hop: '10.0.0.300' is not a "
+            "valid IP address for VLAN 10",
+        ], validator.validate(config))
+
+    def test_plugin_schema(self):
+        class FakeType(object):
+            schema = ({'type': 'string', 'name': 'string'}, ['name'])
+
+        objects.object_types.register('fake', FakeType)
+        self.addCleanup(objects.object_types.loaded.pop, 'fake')
+        self.addCleanup(validator._plugin_validators.clear)
+        self.assertEqual(["network_config[0]: 'name' is required"],
+                         validator.validate({'network_config': [
+                             {'type': 'fake'}]}))
+
+
+class TestValidateOption(base.TestCase):
+
+    def _run(self, config):
+        config_file = tempfile.NamedTemporaryFile(suffix='.json',
+                                                  delete=False)
+        self.addCleanup(os.unlink, config_file.name)
+        config_file.write(json.dumps(config).encode('utf-8'))
+        config_file.close()
+        # a fresh interpreter shows which modules --validate loads
+        script = ('import sys\n'
+                  'from os_net_config import cli\n'
+                  'code = cli.main(["os-net-config", "--validate", "-c", '
+                  '%r])\n'
+                  'print(sorted(m for m in sys.modules '
+                  'if m.startswith("os_net_config.impl")))\n'
+                  'sys.exit(code)\n' % config_file.name)
+        proc = subprocess.Popen([sys.executable, '-c', script],
+                                stdout=subprocess.PIPE)
+        output = proc.communicate()[0].decode('utf-8')
+        return proc.returncode, output.splitlines()
+
+    def test_valid(self):
+        self.assertEqual((0, ['[]']), self._run(_VALID))
+
+    def test_unknown_field(self):
+        code, lines = self._run({'network_config': [
+            {'type': 'interface', 'name': 'em1', 'nm_controlled': True}]})
+        self.assertEqual(1, code)
+        self.assertIn('network_config[0].nm_controlled: unknown field',
+                      lines[0])
+
+    def test_invalid(self):
+        code, lines = self._run({'network_config': [{'type': 'vlan'}]})
+        self.assertEqual(1, code)
+        self.assertEqual(["network_config[0]: 'device' is required",
+                          "network_config[0]: 'vlan_id' is required",
+                          "[]"], [line.split(': ', 1)[1]
+                                  if ': ' in line else line
+                                  for line in lines])
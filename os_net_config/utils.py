@@ -14,17 +14,260 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import contextlib
+import hashlib
+import json
 import logging
+import os
+import stat
+import tempfile
+import time
+
+import six
+from six.moves import cPickle as pickle
+
+from os_net_config.openstack.common import importutils
+from os_net_config.openstack.common import processutils
 
 
 logger = logging.getLogger(__name__)
 
+_caches = {}
+
+_PREV, _NEXT, _KEY, _VALUE = range(4)
+
+
+class LRUCache(object):
+    """A bounded least recently used cache with hit/miss counters.
+
+       Entries live in a dict and are chained in a circular doubly linked
+       list, most recently used last, so lookups and evictions stay O(1).
+       Every cache registers itself by name so its counters show up in
+       the timings report.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.data = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self.hits = 0
+        self.misses = 0
+        _caches[name] = self
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+    def _append(self, link):
+        last = self._root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = self._root
+        last[_NEXT] = self._root[_PREV] = link
+
+    def get(self, key, default=None):
+        link = self.data.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self._unlink(link)
+        self._append(link)
+        self.hits += 1
+        return link[_VALUE]
+
+    def set(self, key, value):
+        link = self.data.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[_VALUE] = value
+        else:
+            link = [None, None, key, value]
+            self.data[key] = link
+        self._append(link)
+        if len(self.data) > self.maxsize:
+            oldest = self._root[_NEXT]
+            self._unlink(oldest)
+            del self.data[oldest[_KEY]]
+
+    def clear(self):
+        self.data.clear()
+        self._root[:] = [self._root, self._root, None, None]
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.data)}
+
+
+class Registry(object):
+    """A name to class mapping which is resolved lazily.
+
+       Built in classes come from a static table of import paths. Entry
+       points in group are only scanned when a name is not built in, and
+       nothing is imported until its name is looked up.
+    """
+
+    def __init__(self, group, builtins):
+        self.group = group
+        self.builtins = builtins
+        self.loaded = {}
+        self._entry_points = None
+
+    def _plugins(self):
+        if self._entry_points is None:
+            self._entry_points = {}
+            try:
+                import pkg_resources
+            except ImportError:
+                return self._entry_points
+            for entry_point in pkg_resources.iter_entry_points(self.group):
+                self._entry_points.setdefault(entry_point.name, entry_point)
+        return self._entry_points
+
+    def register(self, name, cls):
+        self.loaded[name] = cls
+
+    def names(self):
+        return sorted(set(self.builtins) | set(self.loaded) |
+                      set(self._plugins()))
+
+    def get(self, name):
+        """Return the class registered as name, None if there is none."""
+        cls = self.loaded.get(name)
+        if cls is None:
+            if name in self.builtins:
+                cls = importutils.import_class(self.builtins[name])
+            elif name in self._plugins():
+                logger.info('loading %s plugin: %s' % (self.group, name))
+                cls = self._plugins()[name].load()
+            else:
+                return None
+            self.loaded[name] = cls
+        return cls
+
+
+class Timings(object):
+    """Wall clock time spent per phase and per external command."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.phases = {}
+        self.phase_names = []
+        self.commands = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            if name not in self.phases:
+                self.phase_names.append(name)
+                self.phases[name] = 0.0
+            self.phases[name] += time.time() - start
+
+    def add_command(self, cmd, elapsed):
+        self.commands.append({'command': cmd, 'seconds': elapsed})
+
+    def report(self):
+        return {
+            'total': time.time() - self.start,
+            'phases': [{'phase': name, 'seconds': self.phases[name]}
+                       for name in self.phase_names],
+            'commands': self.commands,
+            'caches': dict((name, cache.stats())
+                           for name, cache in six.iteritems(_caches)),
+        }
+
+    def summary(self):
+        report = self.report()
+        lines = ['total: %.3fs' % report['total']]
+        lines.extend('%(phase)s: %(seconds).3fs' % phase
+                     for phase in report['phases'])
+        lines.append('%i external commands: %.3fs' %
+                     (len(self.commands),
+                      sum(cmd['seconds'] for cmd in self.commands)))
+        lines.extend('%s cache: %i hits, %i misses' %
+                     (name, cache.hits, cache.misses)
+                     for name, cache in sorted(six.iteritems(_caches)))
+        return '\n'.join(lines)
+
+
+timings = Timings()
+
+
+def execute(*cmd, **kwargs):
+    """Run an external command through processutils and time it."""
+    start = time.time()
+    try:
+        return processutils.execute(*cmd, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        logger.debug('%s took %.3fs' % (' '.join(cmd), elapsed))
+        timings.add_command(' '.join(cmd), elapsed)
+
 
 def write_config(filename, data):
     with open(filename, "w") as f:
         f.write(str(data))
 
 
+def write_configs(files):
+    """Atomically write a set of config files.
+
+       Every file is staged as a temp file in its target directory and the
+       whole set is fsync'd before any of them is renamed into place. Each
+       directory is then fsync'd once to make the renames durable, so a
+       crash leaves either the old or the new content but never a
+       partially written file.
+    """
+    staged = []
+    try:
+        for filename, data in sorted(six.iteritems(files)):
+            dirname = os.path.dirname(filename) or '.'
+            fd, temp_name = tempfile.mkstemp(
+                prefix='.%s.' % os.path.basename(filename), dir=dirname)
+            # bytes, e.g. a pickle, are written as they are
+            binary = isinstance(data, six.binary_type)
+            f = os.fdopen(fd, 'wb' if binary else 'w')
+            staged.append((f, temp_name, filename))
+            f.write(data if binary else str(data))
+        for f, temp_name, filename in staged:
+            f.flush()
+            try:
+                mode = stat.S_IMODE(os.stat(filename).st_mode)
+            except OSError:
+                mode = 0o644
+            os.chmod(temp_name, mode)
+        for f, temp_name, filename in staged:
+            os.fsync(f.fileno())
+    except Exception:
+        for f, temp_name, filename in staged:
+            f.close()
+            os.unlink(temp_name)
+        raise
+    for f, temp_name, filename in staged:
+        f.close()
+
+    dir_fds = []
+    try:
+        for f, temp_name, filename in staged:
+            os.rename(temp_name, filename)
+        for dirname in set(os.path.dirname(filename) or '.'
+                           for f, temp_name, filename in staged):
+            dir_fds.append(os.open(dirname, os.O_RDONLY))
+        for dir_fd in dir_fds:
+            os.fsync(dir_fd)
+    finally:
+        for dir_fd in dir_fds:
+            os.close(dir_fd)
+
+
 def get_file_data(filename):
     try:
         with open(filename, "r") as f:
@@ -36,7 +279,271 @@ def get_file_data(filename):
 
 def diff(filename, data):
     file_data = get_file_data(filename)
+    # convert to string as JSON may have unicode in it
+    if file_data == data:
+        return False
     logger.debug("Diff file data:\n%s" % file_data)
     logger.debug("Diff data:\n%s" % data)
-    # convert to string as JSON may have unicode in it
-    return not file_data == data
+    return True
+
+
+def fingerprint(data):
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_stat(filename):
+    """Return the [mtime, size] of a file or None if it does not exist."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def load_state(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+_key_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def structural_hash(key):
+    """Return a stable fingerprint of a JSON serializable key."""
+    return fingerprint(_key_encoder.encode(key))
+
+
+def file_fingerprint(filename, chunk_size=65536):
+    """Return fingerprint() of a file's contents without loading it whole."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_state(provider_name, config_file, config_fingerprint,
+                rendered_files, ifup_timings=None, object_fingerprints=None,
+                previous_files=None, version=None, options=None):
+    """Record what was applied so an identical run can be skipped.
+
+       The state holds a fingerprint of the config and of every rendered
+       file along with the mtime/size of the files on disk. The last ifup
+       time of each device is kept to estimate downtime in plans and the
+       fingerprint of each config object to rebuild only what changed.
+       previous_files carries over the files of objects not rebuilt.
+       version and options, the provider options which change its
+       output, must match for a later run to be skipped.
+    """
+    files = dict(previous_files or {})
+    files.update((path, {'fingerprint': fingerprint(data),
+                         'stat': file_stat(path)})
+                 for path, data in six.iteritems(rendered_files))
+    return {
+        'ifup_timings': ifup_timings or {},
+        'provider': provider_name,
+        'version': version,
+        'options': options or {},
+        'config': config_fingerprint,
+        'config_stat': file_stat(config_file),
+        'files': files,
+        'objects': object_fingerprints or {},
+    }
+
+
+def load_compiled(filename, config_fingerprint, version):
+    """Return the compiled config cache if it matches, else None.
+
+       The cache is a pickle, so it is only trusted when it is owned by
+       the current user and nobody else can write to it.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    if (st.st_uid != os.getuid() or
+            st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        logger.warning('Ignoring insecure compiled config cache: %s' %
+                       filename)
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            compiled = pickle.load(f)
+    except Exception as e:
+        logger.warning('Unable to load compiled config cache %s: %s' %
+                       (filename, e))
+        return None
+    if (not isinstance(compiled, dict) or
+            compiled.get('config') != config_fingerprint or
+            compiled.get('version') != version):
+        return None
+    return compiled
+
+
+def save_compiled(filename, config_fingerprint, version, objects,
+                  rendered):
+    """Write the parsed objects and their rendered output to a cache.
+
+       rendered maps each provider name to its (provider, structural
+       hash) -> output dict.
+    """
+    compiled = {
+        'config': config_fingerprint,
+        'version': version,
+        'objects': objects,
+        'rendered': rendered,
+    }
+    try:
+        write_configs({filename: pickle.dumps(compiled,
+                                              pickle.HIGHEST_PROTOCOL)})
+    except (IOError, OSError) as e:
+        logger.warning('Unable to write compiled config cache %s: %s' %
+                       (filename, e))
+
+
+def save_state(filename, state):
+    try:
+        state_dir = os.path.dirname(filename)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        with open(filename, 'w') as f:
+            json.dump(state, f)
+    except (IOError, OSError) as e:
+        logger.warning('Unable to write state file %s: %s' % (filename, e))
+
+
+def same_provider(state, provider_name, version=None, options=None):
+    """Check that the state was written by the same provider and release.
+
+       A new release or different rendering options may render other
+       files from the same config.
+    """
+    return (bool(state) and state.get('provider') == provider_name and
+            state.get('version') == version and
+            state.get('options', {}) == (options or {}))
+
+
+def state_unchanged(state, provider_name, config_file,
+                    config_fingerprint=None, version=None, options=None):
+    """Check whether the last applied state still matches.
+
+       Only stat() calls are made when the config file itself is
+       unchanged on disk. If config_fingerprint is given it is compared
+       instead, so a touched but identical config matches too.
+    """
+    if not same_provider(state, provider_name, version, options):
+        return False
+    if config_fingerprint is None:
+        if file_stat(config_file) != state.get('config_stat'):
+            return False
+    elif config_fingerprint != state.get('config'):
+        return False
+    return files_unchanged(state)
+
+
+def files_unchanged(state):
+    """Check that no file written by the last run was changed since."""
+    for path, info in six.iteritems(state.get('files', {})):
+        if file_stat(path) != info.get('stat'):
+            return False
+    return True
+
+
+class _JsonStream(object):
+    """A JSON text read from a file a chunk at a time."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        # NOTE: read at least as much as is buffered so that re-decoding a
+        # large value after each refill stays linear overall.
+        chunk = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non whitespace character, '' at the end."""
+        while True:
+            while (self.pos < len(self.buf) and
+                    self.buf[self.pos] in ' \t\n\r'):
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expecting one of %s but found %r' %
+                             (', '.join(chars), char or 'end of data'))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the file
+            if end == len(self.buf) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_json_array(f, key, chunk_size=65536):
+    """Yield the elements of the array under key in a JSON object file.
+
+       Only one element is decoded and held in memory at a time. Other
+       keys of the top level object are decoded and discarded. KeyError is
+       raised if the key is missing and TypeError if it is not an array.
+    """
+    stream = _JsonStream(f, chunk_size)
+    stream.expect('{')
+    found = False
+    if stream.peek() == '}':
+        stream.pos += 1
+    else:
+        while True:
+            name = stream.value()
+            stream.expect(':')
+            if name == key and not found:
+                found = True
+                if stream.peek() != '[':
+                    raise TypeError('%s is not an array' % key)
+                stream.pos += 1
+                if stream.peek() == ']':
+                    stream.pos += 1
+                else:
+                    while True:
+                        yield stream.value()
+                        if stream.expect(',]') == ']':
+                            break
+            else:
+                stream.value()
+            if stream.expect(',}') == '}':
+                break
+    if stream.peek():
+        raise ValueError('Extra data after the top level object')
+    if not found:
+        raise KeyError(key)
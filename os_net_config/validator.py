@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Single pass validation of network_config documents.
+
+Each object type is described by a small schema which is compiled once,
+at import time, into nested check functions. Checks never stop at the
+first problem: every error is collected along with the JSON path of the
+offending value, e.g. ``network_config[3].addresses[0].ip_netmask``.
+Unknown fields and values which older releases silently read as false
+booleans may be collected apart as warnings, so configs which applied
+before still apply.
+"""
+
+import netaddr
+import six
+
+from os_net_config import objects
+from os_net_config.openstack.common import strutils
+
+
+_BOOL_STRINGS = strutils.TRUE_STRINGS + strutils.FALSE_STRINGS
+
+_BASE_FIELDS = {
+    'type': 'string',
+    'use_dhcp': 'boolean',
+    'use_dhcpv6': 'boolean',
+    'mtu': 'mtu',
+    'addresses': ['address'],
+    'routes': ['route'],
+}
+
+# field name -> spec, a spec is a scalar name, a one item list for a list
+# of that spec or the name of another schema. Required fields are listed
+# separately and must be present and non empty.
+SCHEMAS = {
+    'address': ({'ip_netmask': 'ip_netmask'}, ['ip_netmask']),
+    'route': ({'next_hop': 'ip', 'ip_netmask': 'ip_netmask',
+               'default': 'boolean'}, ['next_hop']),
+    'interface': (dict(_BASE_FIELDS, name='string'), ['name']),
+    'vlan': (dict(_BASE_FIELDS, device='string', vlan_id='vlan_id'),
+             ['device', 'vlan_id']),
+    'ovs_bridge': (dict(_BASE_FIELDS, name='string', ovs_options='string',
+                        members=['member']), ['name']),
+    'ovs_bond': (dict(_BASE_FIELDS, name='string', ovs_options='string',
+                      members=['member']), ['name']),
+    'address_template': ({'ip_netmask': 'ip_netmask_template'},
+                         ['ip_netmask']),
+    'route_template': ({'next_hop': 'ip_template',
+                        'ip_netmask': 'ip_netmask_template',
+                        'default': 'boolean'}, ['next_hop']),
+    'vlan_range': (dict(_BASE_FIELDS, device='string', vlan_ids='vlan_ids',
+                        addresses=['address_template'],
+                        routes=['route_template']),
+                   ['device', 'vlan_ids']),
+}
+
+# the schemas which may appear as network_config and members entries,
+# types registered by plugins are checked against their own schema
+OBJECT_TYPES = ('interface', 'vlan', 'ovs_bridge', 'ovs_bond', 'vlan_range')
+MEMBER_TYPES = ('interface', 'vlan', 'ovs_bridge', 'ovs_bond')
+
+
+def _check_string(value, path, errors):
+    if not isinstance(value, six.string_types):
+        errors.append('%s: must be a string' % path)
+
+
+def _check_boolean(value, path, errors):
+    # objects parse booleans with bool_from_string(str(value)), which
+    # reads anything else as false, so that is only warned about
+    if six.text_type(value).strip().lower() not in _BOOL_STRINGS:
+        getattr(errors, 'warnings', errors).append(
+            '%s: must be a boolean' % path)
+
+
+def _integer(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, six.integer_types):
+        return value
+    if isinstance(value, six.string_types) and value.isdigit():
+        return int(value)
+    return None
+
+
+def _integer_check(name, minimum, maximum):
+    def check(value, path, errors):
+        number = _integer(value)
+        if number is None or not minimum <= number <= maximum:
+            errors.append('%s: must be %s between %i and %i' %
+                          (path, name, minimum, maximum))
+    return check
+
+
+def _check_ip(value, path, errors):
+    try:
+        netaddr.IPAddress(value)
+    except (netaddr.AddrFormatError, TypeError, ValueError):
+        errors.append('%s: %r is not a valid IP address' % (path, value))
+
+
+def _check_ip_netmask(value, path, errors):
+    try:
+        netaddr.IPNetwork(value)
+    except (netaddr.AddrFormatError, TypeError, ValueError):
+        errors.append('%s: %r is not a valid IP address or network' %
+                      (path, value))
+
+
+def _check_vlan_ids(value, path, errors):
+    try:
+        objects.parse_vlan_ids(value)
+    except objects.InvalidConfigException as e:
+        errors.append('%s: %s' % (path, e))
+
+
+def _check_template(value, path, errors):
+    # the values are checked per VLAN by _check_vlan_range
+    try:
+        value.format(**objects.template_fields(1, 0))
+    except (AttributeError, KeyError, IndexError, ValueError) as e:
+        errors.append('%s: invalid template %r: %s' % (path, value, e))
+
+
+def _object_check(types):
+    def check(value, path, errors):
+        if not isinstance(value, dict):
+            errors.append('%s: must be an object' % path)
+            return
+        obj_type = value.get('type')
+        if not obj_type:
+            errors.append("%s: 'type' is required" % path)
+            return
+        if obj_type in types:
+            _VALIDATORS[obj_type](value, path, errors)
+        elif obj_type in OBJECT_TYPES:
+            errors.append('%s.type: %r is not allowed here' %
+                          (path, obj_type))
+        elif _plugin_validator(obj_type) is None:
+            errors.append('%s.type: unknown type %r' % (path, obj_type))
+        else:
+            _plugin_validator(obj_type)(value, path, errors)
+    return check
+
+
+_check_object = _object_check(OBJECT_TYPES)
+
+
+_SCALARS = {
+    'string': _check_string,
+    'boolean': _check_boolean,
+    'mtu': _integer_check('an MTU', 68, 65535),
+    'vlan_id': _integer_check('a VLAN ID', 1, 4094),
+    'ip': _check_ip,
+    'ip_netmask': _check_ip_netmask,
+    'ip_template': _check_template,
+    'ip_netmask_template': _check_template,
+    'vlan_ids': _check_vlan_ids,
+    'object': _check_object,
+    'member': _object_check(MEMBER_TYPES),
+}
+
+
+def _compile_spec(spec):
+    if isinstance(spec, list):
+        return _compile_list(_compile_spec(spec[0]))
+    if spec in _SCALARS:
+        return _SCALARS[spec]
+    # resolved at call time so schemas may refer to each other
+    return lambda value, path, errors: _VALIDATORS[spec](value, path, errors)
+
+
+def _compile_list(check_item):
+    def check(value, path, errors):
+        if not isinstance(value, list):
+            errors.append('%s: must be a list' % path)
+            return
+        for i, item in enumerate(value):
+            check_item(item, '%s[%i]' % (path, i), errors)
+    return check
+
+
+def _compile_schema(fields, required):
+    checks = [(name, _compile_spec(fields[name]), name in required)
+              for name in sorted(fields)]
+    known = frozenset(fields)
+
+    def check(value, path, errors):
+        if not isinstance(value, dict):
+            errors.append('%s: must be an object' % path)
+            return
+        for name, check_field, is_required in checks:
+            field = value.get(name)
+            if is_required and not field and field != 0:
+                errors.append("%s: '%s' is required" % (path, name))
+            elif field is not None:
+                check_field(field, '%s.%s' % (path, name), errors)
+        unknown = getattr(errors, 'warnings', errors)
+        for name in sorted(set(value) - known):
+            unknown.append('%s.%s: unknown field' % (path, name))
+    return check
+
+
+_VALIDATORS = dict((name, _compile_schema(*schema))
+                   for name, schema in six.iteritems(SCHEMAS))
+
+# (list, field, check) for the templates of a vlan_range
+_TEMPLATES = (
+    ('addresses', 'ip_netmask', _check_ip_netmask),
+    ('routes', 'next_hop', _check_ip),
+    ('routes', 'ip_netmask', _check_ip_netmask),
+)
+
+
+def _span_ends(vlan_ids):
+    """Yield (vlan_id, index) for the first and last VLAN of each span."""
+    index = 0
+    for start, end in vlan_ids:
+        yield start, index
+        if end != start:
+            yield end, index + end - start
+        index += end - start + 1
+
+
+_check_vlan_range_schema = _VALIDATORS['vlan_range']
+
+
+def _check_vlan_range(value, path, errors):
+    """Check the templates formatted for both ends of every span too."""
+    _check_vlan_range_schema(value, path, errors)
+    if not isinstance(value, dict):
+        return
+    try:
+        vlan_ids = objects.parse_vlan_ids(value.get('vlan_ids'))
+    except objects.InvalidConfigException:
+        return
+    ends = list(_span_ends(vlan_ids))
+    for list_name, field, check_value in _TEMPLATES:
+        entries = value.get(list_name)
+        if not isinstance(entries, list):
+            continue
+        for i, entry in enumerate(entries):
+            template = entry.get(field) if isinstance(entry, dict) else None
+            if not isinstance(template, six.string_types):
+                continue
+            field_path = '%s.%s[%i].%s' % (path, list_name, i, field)
+            for vlan_id, index in ends:
+                try:
+                    formatted = template.format(
+                        **objects.template_fields(vlan_id, index))
+                except (KeyError, IndexError, ValueError):
+                    break
+                field_errors = []
+                check_value(formatted, field_path, field_errors)
+                if field_errors:
+                    errors.extend('%s for VLAN %i' % (error, vlan_id)
+                                  for error in field_errors)
+                    break
+
+
+_VALIDATORS['vlan_range'] = _check_vlan_range
+_check_network_config = _compile_list(_check_object)
+_plugin_validators = {}
+
+
+def _no_check(value, path, errors):
+    pass
+
+
+def _plugin_validator(obj_type):
+    """Return the check for an object type registered by a plugin."""
+    if obj_type not in _plugin_validators:
+        check = None
+        obj_class = objects.object_types.get(obj_type)
+        if obj_class is not None:
+            schema = getattr(obj_class, 'schema', None)
+            if schema:
+                check = _compile_schema(*schema)
+            else:
+                check = _no_check
+        _plugin_validators[obj_type] = check
+    return _plugin_validators[obj_type]
+
+
+class _Errors(list):
+    """An error list which sends lenient problems to a warnings list."""
+
+    def __init__(self, warnings):
+        super(_Errors, self).__init__()
+        self.warnings = warnings
+
+
+def _errors(warnings):
+    return [] if warnings is None else _Errors(warnings)
+
+
+def validate_object(obj_json, path, warnings=None):
+    """Return the errors in a single network_config entry.
+
+       Unknown fields and unrecognised booleans are errors unless a
+       warnings list is given, they are then appended to it instead.
+    """
+    errors = _errors(warnings)
+    _check_object(obj_json, path, errors)
+    return list(errors)
+
+
+def validate(config, warnings=None):
+    """Return every error in a whole config document, [] if it is valid.
+
+       warnings is handled as by validate_object().
+    """
+    if not isinstance(config, dict):
+        return ['must be an object']
+    iface_array = config.get('network_config')
+    if iface_array is None:
+        return ["'network_config' is required"]
+    errors = _errors(warnings)
+    _check_network_config(iface_array, 'network_config', errors)
+    return list(errors)
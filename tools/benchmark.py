@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Scale benchmarks for os-net-config.
+
+Generates synthetic TripleO style network_config documents (bridges on
+top of bonds with a fan-out of VLANs) and times parsing, rendering,
+diffing and applying them with each file based provider. External
+commands are stubbed out and config files go to a temp directory, so no
+privileges are needed and the host is never touched.
+
+    python tools/benchmark.py --output results.json
+    python tools/benchmark.py --baseline results.json
+    python tools/benchmark.py --routes 10000
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import os_net_config
+from os_net_config import impl_eni
+from os_net_config import impl_ifcfg
+from os_net_config import objects
+from os_net_config.openstack.common import processutils
+from os_net_config import utils
+
+
+SIZES = [10, 100, 1000, 4000]
+PROVIDERS = ['ifcfg', 'eni']
+# NOTE: the ENI provider does not support OVS bonds
+BOND_PROVIDERS = ['ifcfg']
+
+
+def generate_config(size, bonds=True):
+    """Return a network_config list with roughly size objects.
+
+       Two bridges each hold a bond of two interfaces, the remaining
+       objects are VLANs split between bridge internal ports and VLANs on
+       top of the bonds. Every VLAN has an address and every fourth one a
+       route. Without bonds the bridges hold a single interface instead.
+    """
+    config = []
+    vlans = max(size - 8, 0)
+    for i in range(2):
+        port = {'type': 'interface', 'name': 'em%i' % (i * 2)}
+        if bonds:
+            port = {'type': 'ovs_bond', 'name': 'bond%i' % i,
+                    'ovs_options': 'bond_mode=balance-slb',
+                    'members': [port, {'type': 'interface',
+                                       'name': 'em%i' % (i * 2 + 1)}]}
+        config.append({'type': 'ovs_bridge', 'name': 'br%i' % i,
+                       'use_dhcp': i == 0, 'members': [port]})
+    for vlan_id in range(1, vlans + 1):
+        vlan = {'type': 'vlan', 'vlan_id': vlan_id,
+                'device': config[vlan_id % 2]['members'][0]['name'],
+                'addresses': [{'ip_netmask': '10.%i.%i.2/24' %
+                               (vlan_id // 256, vlan_id % 256)}]}
+        if vlan_id % 4 == 0:
+            vlan['routes'] = [{'next_hop': '10.%i.%i.1' %
+                               (vlan_id // 256, vlan_id % 256),
+                               'ip_netmask': '172.%i.%i.0/24' %
+                               (16 + vlan_id // 256, vlan_id % 256)}]
+        if vlan_id % 2:
+            config.append(vlan)
+        else:
+            config[vlan_id % 4 // 2]['members'].append(vlan)
+    return config
+
+
+_write_configs = utils.write_configs
+
+
+def _redirect_paths(temp_dir):
+    """Point every provider path into temp_dir and stub out commands.
+
+       Writes anywhere else are refused, so a path helper added to a
+       provider later cannot make the benchmark write to the host.
+    """
+    def _path(prefix):
+        return lambda name: os.path.join(temp_dir, '%s-%s' % (prefix, name))
+    impl_ifcfg.ifcfg_config_path = _path('ifcfg')
+    impl_ifcfg.bridge_config_path = _path('ifcfg')
+    impl_ifcfg.route_config_path = _path('route')
+    impl_eni._network_config_path = lambda: os.path.join(temp_dir,
+                                                         'interfaces')
+    impl_eni._fragment_path = _path('interfaces.d')
+    impl_eni._route_batch_path = lambda name, action: os.path.join(
+        temp_dir, 'routes-%s.%s' % (name, action))
+    processutils.execute = lambda *args, **kwargs: ('', '')
+
+    def write_configs(files):
+        for path in files:
+            if os.path.dirname(os.path.abspath(path)) != temp_dir:
+                raise RuntimeError('benchmark tried to write %s' % path)
+        _write_configs(files)
+    utils.write_configs = write_configs
+
+
+def _new_provider(name):
+    if name == 'ifcfg':
+        return impl_ifcfg.IfcfgNetConfig()
+    return impl_eni.ENINetConfig()
+
+
+def _timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def _clear_caches():
+    # every run starts cold, otherwise the fastest run only measures
+    # render cache hits
+    os_net_config._render_cache.clear()
+    objects._network_cache.clear()
+
+
+def run_once(provider_name, config):
+    timings = {}
+    _clear_caches()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        _redirect_paths(temp_dir)
+        timings['parse'], objs = _timed(
+            lambda: [objects.object_from_json(c) for c in config])
+
+        provider = _new_provider(provider_name)
+        timings['render'], _ = _timed(
+            lambda: [provider.addObject(obj) for obj in objs])
+
+        files = provider.renderFiles()
+        timings['diff'], _ = _timed(
+            lambda: [utils.diff(path, data) for path, data in
+                     files.items()])
+
+        timings['apply'], _ = _timed(provider.apply)
+        # a second apply against the written files is the common no-op run
+        provider = _new_provider(provider_name)
+        for obj in objs:
+            provider.addObject(obj)
+        timings['apply_noop'], _ = _timed(provider.apply)
+    finally:
+        shutil.rmtree(temp_dir)
+    return timings
+
+
+def run(sizes, providers, repeat):
+    results = {}
+    for provider_name in providers:
+        for size in sizes:
+            config = generate_config(size,
+                                     bonds=provider_name in BOND_PROVIDERS)
+            best = {}
+            for i in range(repeat):
+                for phase, elapsed in run_once(provider_name,
+                                               config).items():
+                    best[phase] = min(best.get(phase, elapsed), elapsed)
+            results['%s/%i' % (provider_name, size)] = best
+    return results
+
+
+def run_routes(count, providers, repeat):
+    """Time rendering a single interface with count static routes.
+
+       The full file is rendered too, which for ENI joins every device
+       into /etc/network/interfaces.
+    """
+    routes = [objects.Route('192.0.2.1', '10.%i.%i.0/24' %
+                            (i // 256 % 256, i % 256))
+              for i in range(count)]
+    results = {}
+    for provider_name in providers:
+        best = None
+        for i in range(repeat):
+            # a new object each time so the render cache is never hit
+            interface = objects.Interface(
+                'em1', addresses=[objects.Address('192.0.2.2/24')],
+                routes=routes).freeze()
+            provider = _new_provider(provider_name)
+            elapsed, _ = _timed(lambda: (provider.addObject(interface),
+                                         provider.renderFiles()))
+            _clear_caches()
+            best = min(best or elapsed, elapsed)
+        results['%s/routes/%i' % (provider_name, count)] = {'render': best}
+    return results
+
+
+def _deep_size(obj, seen):
+    """Return the bytes used by obj and everything only it refers to."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += _deep_size(item, seen)
+    elif hasattr(obj, '__dict__') or hasattr(obj, '__slots__'):
+        if hasattr(obj, '__dict__'):
+            size += _deep_size(obj.__dict__, seen)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += _deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def run_memory(sizes):
+    """Return the average bytes per parsed object for each size.
+
+       Shared singletons (small ints, interned strings, None, bools) are
+       counted once for the whole tree, like they are in a real process.
+    """
+    results = {}
+    for size in sizes:
+        objs = [objects.object_from_json(c) for c in generate_config(size)]
+        count = [0]
+
+        def _count(obj):
+            count[0] += 1 + len(obj.addresses) + len(obj.routes)
+            for member in getattr(obj, 'members', []):
+                _count(member)
+        for obj in objs:
+            _count(obj)
+        seen = set([id(None), id(True), id(False)])
+        total = sum(_deep_size(obj, seen) for obj in objs)
+        results['memory/%i' % size] = {'bytes_per_object':
+                                       float(total) / count[0],
+                                       'bytes': float(total)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio to the baseline and return the regressed keys."""
+    regressions = []
+    for key in sorted(results):
+        for phase in sorted(results[key]):
+            old = baseline.get(key, {}).get(phase)
+            new = results[key][phase]
+            if not old:
+                continue
+            ratio = new / old
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressions.append('%s %s' % (key, phase))
+            print('%-12s %-16s %11.4f %11.4f %6.2fx%s' %
+                  (key, phase, old, new, ratio, flag))
+    return regressions
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--providers', nargs='+', default=PROVIDERS,
+                        choices=PROVIDERS)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per size, the fastest one is kept')
+    parser.add_argument('--memory', action='store_true',
+                        help='measure the memory used by the object model '
+                             'instead of timing the run')
+    parser.add_argument('--routes', type=int, metavar='COUNT',
+                        help='time rendering an interface with this many '
+                             'routes instead of the scale run')
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run to compare to')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    opts = parser.parse_args(argv[1:])
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = {
+        'python': platform.python_version(),
+    }
+    if opts.memory:
+        results['results'] = run_memory(opts.sizes)
+    elif opts.routes:
+        results['results'] = run_routes(opts.routes, opts.providers,
+                                        opts.repeat)
+    else:
+        results['results'] = run(opts.sizes, opts.providers, opts.repeat)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results['results'], baseline, opts.threshold):
+            return 1
+    elif not opts.output:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))